@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+
+import argparse
+import json
+import sys
+
+from qsprpred.data.utils.benchmark import (
+    BENCHMARK_SIZES,
+    compare_benchmarks,
+    get_benchmark_descsets,
+    run_benchmarks,
+)
+
+
+def QSPRArgParser(txt=None):
+    """Define and read command line arguments."""
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument('-o', '--output', type=str, default='benchmark.json',
+                        help="JSON file to save the benchmark results to")
+    parser.add_argument('-ds', '--descriptors', type=str, nargs='*', default=None,
+                        help=f"Names of the benchmarked descriptor sets, all by default. Available: "
+                             f"{', '.join(get_benchmark_descsets())}")
+    parser.add_argument('-s', '--sizes', type=int, nargs='*', default=list(BENCHMARK_SIZES),
+                        help="Numbers of molecules")
+    parser.add_argument('-ncpu', '--ncpu', type=int, nargs='*', default=None,
+                        help="Numbers of worker processes, powers of two up to the number of cores by default")
+    parser.add_argument('-cs', '--chunk_size', type=int, default=1000,
+                        help="Number of molecules per chunk")
+    parser.add_argument('-bl', '--baseline', type=str, default=None,
+                        help="JSON file with the results of an earlier run to compare the new results to")
+    parser.add_argument('-tol', '--tolerance', type=float, default=0.1,
+                        help="Relative loss of throughput compared to the baseline that is reported as regression")
+
+    if txt:
+        args = parser.parse_args(txt)
+    else:
+        args = parser.parse_args()
+
+    return args
+
+
+if __name__ == '__main__':
+    args = QSPRArgParser()
+
+    descsets = get_benchmark_descsets()
+    if args.descriptors:
+        unknown = [name for name in args.descriptors if name not in descsets]
+        if unknown:
+            sys.exit(f"Unknown descriptor sets: {', '.join(unknown)}")
+        descsets = {name: descsets[name] for name in args.descriptors}
+
+    results = run_benchmarks(descsets, args.sizes, args.ncpu, args.chunk_size, args.output)
+    print(json.dumps(results, indent=2))
+
+    if args.baseline:
+        comparison = compare_benchmarks(args.baseline, results, args.tolerance)
+        print(comparison.to_string())
+        if comparison["regression"].any():
+            sys.exit(1)
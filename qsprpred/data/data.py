@@ -1,31 +1,40 @@
 """This module contains the QSPRDataset that holds and prepares data for modelling."""
-import concurrent
+import copy
 import json
 import os
+import time
 import warnings
-from typing import Callable, List, Literal
+from typing import Callable, Dict, List, Literal
 
 import numpy as np
 import pandas as pd
+import rdkit
+from qsprpred import VERSION
 from qsprpred.data.interfaces import MoleculeDataSet, datasplit
 from qsprpred.data.utils.descriptorcalculator import Calculator, DescriptorsCalculator
+from qsprpred.data.utils.descriptorsets import DescriptorSet
 from qsprpred.data.utils.feature_standardization import (
     SKLearnStandardizer,
     apply_feature_standardizer,
 )
 from qsprpred.data.utils.folds import Folds
+from qsprpred.data.utils.molecules import to_binary, to_inchikey
+from qsprpred.data.utils.parallel import WorkerPool
 from qsprpred.data.utils.scaffolds import Scaffold
-from qsprpred.data.utils.smiles_standardization import (
-    chembl_smi_standardizer,
-    sanitize_smiles,
+from qsprpred.data.utils.smiles_standardization import clean_smiles
+from qsprpred.data.utils.sparse_features import densify, has_sparse
+from qsprpred.data.utils.storage import (
+    STORAGE_BACKENDS,
+    DescriptorMatrix,
+    detect_store_format,
+    get_storage,
+    get_store_format_from_path,
 )
 from qsprpred.logs import logger
 from qsprpred.models.tasks import ModelTasks
-from rdkit import Chem
 from rdkit.Chem import PandasTools
 from sklearn.model_selection import KFold, StratifiedKFold
 from sklearn.preprocessing import LabelEncoder
-from tqdm.auto import tqdm
 
 
 class MoleculeTable(MoleculeDataSet):
@@ -33,6 +42,8 @@ class MoleculeTable(MoleculeDataSet):
     Class that holds and prepares molecule data for modelling and other analyses.
     """
 
+    molCol = "RDMolBinary"  # name of the column with binary molecules
+
     class ParallelApplyWrapper:
         """
         A wrapper class to parallelize pandas apply functions.
@@ -74,7 +85,7 @@ class MoleculeTable(MoleculeDataSet):
             """
 
             return data.apply(self.func, raw=self.raw, axis=self.axis, result_type=self.result_type,
-                              args=self.args, **self.kwargs if self.kwargs else {})
+                              args=self.args if self.args else (), **self.kwargs if self.kwargs else {})
 
     def __init__(
             self,
@@ -87,6 +98,10 @@ class MoleculeTable(MoleculeDataSet):
             n_jobs: int = 1,
             chunk_size: int = 50,
             drop_invalids: bool = True,
+            store_format: str = "pickle",
+            memmap_descriptors: bool = False,
+            store_mols: bool = False,
+            lazy: bool = False,
     ):
         """
 
@@ -99,20 +114,43 @@ class MoleculeTable(MoleculeDataSet):
             the dataframe from disk will override the supplied data frame. Set 'overwrite' to `True` to override the data frame on disk.
             smilescol (str): Name of the column containing the SMILES sequences of molecules.
             add_rdkit (bool): Add RDKit molecule instances to the dataframe. WARNING: This can take a lot of memory.
+            Deprecated, use `store_mols` instead.
             store_dir (str): Directory to store the dataset files. Defaults to the current directory. If it already contains files with the same name, the existing data will be loaded.
             overwrite (bool): Overwrite existing dataset.
             n_jobs (int): Number of jobs to use for parallel processing. If <= 0, all available cores will be used.
             chunk_size (int): Size of chunks to use per job in parallel processing.
             drop_invalids (bool): Drop invalid molecules from the data frame.
+            store_format (str): Storage backend used to save the data frame, either 'pickle' (one file with the whole data frame)
+            or 'parquet' (a directory with a Parquet file for each column group, which can be loaded separately). If no data frame is
+            supplied and the data set was saved with a different backend, the format found on disk is used.
+            memmap_descriptors (bool): Keep descriptors outside of the data frame in a `float32` matrix memory-mapped from disk
+            (see `DescriptorMatrix`). Features are then served as views of this matrix where possible instead of copies of
+            data frame columns. Data sets saved with a descriptor matrix always use it when loaded.
+            store_mols (bool): Keep binary RDKit molecules (`Mol.ToBinary`) of the SMILES in the column `molCol`. The molecules
+            are created when the SMILES are cleaned or validated and are then used to calculate scaffolds and descriptors
+            instead of parsing the SMILES again. Data sets saved with this column always use it when loaded.
+            lazy (bool): When loading a data set from a columnar store (i.e. 'parquet'), only read the property columns and defer
+            loading of the descriptor and scaffold columns until they are accessed. Only the requested columns are then read
+            from disk (see `loadColumns`). Accessing `df` directly loads all remaining columns.
         """
 
         # settings
         self.smilescol = smilescol
         self.includesRdkit = add_rdkit
+        if add_rdkit:
+            warnings.warn("The 'add_rdkit' option is deprecated and will be removed in the future. "
+                          "Use 'store_mols' to keep molecules in the data frame.", DeprecationWarning)
+        self.storeMols = store_mols
         self.name = name
         self.descriptorCalculator = None
+        self.descriptorProvenance = {}
         self.nJobs = n_jobs if n_jobs > 0 else os.cpu_count()
         self.chunkSize = chunk_size
+        self.workerPool = None
+        self.lazy = lazy
+        self._df = None
+        self._deferredColumns = []
+        self._storedColumns = []
 
         # paths
         self.storeDir = store_dir.rstrip("/")
@@ -120,7 +158,13 @@ class MoleculeTable(MoleculeDataSet):
         self.descriptorCalculatorPath = f"{self.storePrefix}_feature_calculators.json"
         if not os.path.exists(self.storeDir):
             raise FileNotFoundError(f"Directory '{self.storeDir}' does not exist.")
-        self.storePath = f'{self.storePrefix}_df.pkl'
+        if df is None and not get_storage(store_format, self.storePrefix).exists():
+            store_format = detect_store_format(self.storePrefix) or store_format
+        self.storeFormat = store_format
+        self.storage = get_storage(self.storeFormat, self.storePrefix)
+        self.storePath = self.storage.path
+        self.memmapDescriptors = memmap_descriptors
+        self.descriptorMatrix = DescriptorMatrix(self.storePrefix) if memmap_descriptors else None
 
         # data frame initialization
         if df is not None:
@@ -140,16 +184,76 @@ class MoleculeTable(MoleculeDataSet):
                     f"No data frame found in store for '{self.name}'. Are you sure this is the correct dataset? If you are creating a new data set, make sure to supply a data frame.")
             self.reload()
 
+        # move descriptors from the data frame to the descriptor matrix if requested
+        if self.memmapDescriptors:
+            descriptor_names = [col for col in self.getColumnNames() if col.startswith("Descriptor_")]
+            if len(descriptor_names) > 0:
+                self.descriptorMatrix.write(self.loadColumns(descriptor_names))
+                self._df.drop(descriptor_names, axis=1, inplace=True)
+
         # drop invalid columns
+        self.storeMols = self.storeMols or self.molCol in self._df.columns
         if drop_invalids:
             self.dropInvalids()
+        elif self.storeMols and self.molCol not in self._df.columns:
+            self.cleanMolecules(standardize=False, sanitize=False)
 
     def __len__(self):
         """
         Returns:
             int: Number of molecules in the data set.
         """
-        return len(self.df)
+        return len(self._df)
+
+    @property
+    def df(self) -> pd.DataFrame:
+        """The data frame this instance manages. Columns whose loading was deferred (see `lazy`) are loaded
+        from disk first."""
+        if self._deferredColumns:
+            self.loadColumns(self._deferredColumns)
+        return self._df
+
+    @df.setter
+    def df(self, df: pd.DataFrame):
+        self._df = df
+        self._deferredColumns = []
+
+    def loadColumns(self, columns: List[str]) -> pd.DataFrame:
+        """
+        Get columns of the data frame. Columns whose loading was deferred are read from disk and added to the
+        data frame, the rest of the deferred columns stays on disk.
+
+        Args:
+            columns (list): names of the columns
+
+        Returns:
+            pd.DataFrame: data frame with the selected columns
+        """
+
+        to_load = [col for col in columns if col in self._deferredColumns]
+        if to_load:
+            logger.debug(f"Loading {len(to_load)} deferred columns of {self.name} from {self.storePath}.")
+            loaded = self.storage.load(columns=to_load).reindex(self._df.index)
+            df = self._df.join(loaded, how='left')
+            # keep the order of the stored columns so that the data frame is the same as if loaded at once
+            order = [col for col in self._storedColumns if col in df.columns]
+            self._df = df[order + [col for col in df.columns if col not in self._storedColumns]]
+            self._deferredColumns = [col for col in self._deferredColumns if col not in to_load]
+        return self._df[columns]
+
+    def getColumnNames(self) -> List[str]:
+        """
+        Get the names of all columns of the data frame without loading deferred columns.
+
+        Returns:
+            list: names of the columns
+        """
+
+        if not self._deferredColumns:
+            return self._df.columns.to_list()
+        columns = self._df.columns.to_list() + self._deferredColumns
+        order = [col for col in self._storedColumns if col in columns]
+        return order + [col for col in columns if col not in self._storedColumns]
 
     def getDF(self):
         """
@@ -161,7 +265,7 @@ class MoleculeTable(MoleculeDataSet):
 
     def _isInStore(self, name):
         """
-        Check if a pickled file with the given suffix exists.
+        Check if a stored file with the given suffix exists.
 
         Args:
             name (str): Suffix of the file to check.
@@ -169,7 +273,7 @@ class MoleculeTable(MoleculeDataSet):
         Returns:
             bool: `True` if the file exists, `False` otherwise.
         """
-        return os.path.exists(self.storePath) and self.storePath.endswith(f'_{name}.pkl')
+        return self.storage.exists() and self.storePath.endswith(f'_{name}.{self.storage.extension}')
 
     def save(self):
         """
@@ -180,10 +284,14 @@ class MoleculeTable(MoleculeDataSet):
         """
 
         # save data frame
-        self.df.to_pickle(self.storePath)
+        self.storage.save(self.df)
+        if self.descriptorMatrix is not None and self.descriptorMatrix.values is not None:
+            self.descriptorMatrix.saveIndex()
 
         # save descriptor calculator
-        if self.descriptorCalculator:
+        if isinstance(self.descriptorCalculator, DescriptorsCalculator):
+            self.descriptorCalculator.toFile(self.descriptorCalculatorPath, self.descriptorProvenance)
+        elif self.descriptorCalculator:
             self.descriptorCalculator.toFile(self.descriptorCalculatorPath)
 
         return self.storePath
@@ -193,25 +301,41 @@ class MoleculeTable(MoleculeDataSet):
         Remove all files associated with this data set from disk.
         """
 
-        for file in [f for f in os.listdir(self.storeDir) if f.endswith('.pkl') or f.endswith('.json')]:
+        for file in [f for f in os.listdir(self.storeDir) if f.endswith('.pkl') or f.endswith('.json') or f.endswith('.npy')]:
             if file.startswith(self.name):
                 os.remove(f'{self.storeDir}/{file}')
+        for store_format in STORAGE_BACKENDS:
+            get_storage(store_format, self.storePrefix).clear()
 
     def reload(self):
-        """Reload the data table from disk."""
+        """Reload the data table from disk. If `lazy` is set and the storage backend is columnar, only the property
+        columns are read and loading of the other columns is deferred."""
 
-        self.df = pd.read_pickle(self.storePath)
+        if self.lazy and self.storage.columnar:
+            self.df = self.storage.load(groups=["properties"])
+            self._storedColumns = self.storage.getColumns()
+            self._deferredColumns = [col for col in self._storedColumns if col not in self._df.columns]
+        else:
+            self.df = self.storage.load()
+        matrix = DescriptorMatrix(self.storePrefix)
+        if matrix.exists():
+            self.descriptorMatrix = matrix.load()
+            self.memmapDescriptors = True
         if os.path.exists(self.descriptorCalculatorPath):
             self.descriptorCalculator = DescriptorsCalculator.fromFile(self.descriptorCalculatorPath)
+            self.descriptorProvenance = DescriptorsCalculator.readProvenance(self.descriptorCalculatorPath)
 
     @staticmethod
     def fromFile(filename, *args, **kwargs) -> 'MoleculeTable':
         """
-        Create a `MoleculeTable` instance from by providing a direct path to the pickled data frame in storage.
+        Create a `MoleculeTable` instance from by providing a direct path to the stored data frame
+        (i.e. `{name}_df.pkl` or `{name}_df.parquet`).
         """
 
+        filename = filename.rstrip('/')
         store_dir = os.path.dirname(filename)
-        name = os.path.basename(filename).split('.')[0]
+        name = os.path.basename(filename).rsplit('_', 1)[0]
+        kwargs.setdefault('store_format', get_store_format_from_path(filename))
         return MoleculeTable(name=name, store_dir=store_dir, *args, **kwargs)
 
     @staticmethod
@@ -234,6 +358,7 @@ class MoleculeTable(MoleculeDataSet):
     def fromTableFile(name, filename, sep="\t", *args, **kwargs):
         """
         Create a `MoleculeTable` instance from a file containing a table of molecules (i.e. a CSV file).
+        The whole file is read into memory, use `StreamingTableBuilder` for files that do not fit into memory.
 
         Args:
             name (str): Name of the data set.
@@ -267,11 +392,19 @@ class MoleculeTable(MoleculeDataSet):
             prefix (str): Prefix of the column names to select.
         """
 
-        if self.df.columns.str.startswith(prefix).any():
-            return self.df[self.df.columns[self.df.columns.str.startswith(prefix)]]
+        subset = None
+        columns = [col for col in self.getColumnNames() if col.startswith(prefix)]
+        if len(columns) > 0:
+            subset = self.loadColumns(columns)
+        if self.descriptorMatrix is not None:
+            descriptors = [col for col in self.getDescriptorNames() if col.startswith(prefix)]
+            if len(descriptors) > 0:
+                descriptors = self.getDescriptors(columns=descriptors)
+                subset = descriptors if subset is None else subset.join(descriptors)
+        return subset
 
     def apply(self, func, func_args=None, func_kwargs=None, axis=0, raw=False,
-              result_type='expand', subset=None):
+              result_type='expand', subset=None, index=None):
         """
         Apply a function to the data frame. In addition to the arguments of `pandas.DataFrame.apply`, this method also
         supports parallelization using `multiprocessing.Pool`.
@@ -284,20 +417,23 @@ class MoleculeTable(MoleculeDataSet):
             raw (bool): Whether to pass the data frame as-is to the function or to pass each row/column as a Series to the function.
             result_type (str): Whether to expand the result of the function to columns or to leave it as a Series.
             subset (list): List of column names if only a subset of the data should be used (reduces memory consumption).
+            index (pd.Index): Labels of the rows to apply the function to, all rows if `None`.
         """
         n_cpus = self.nJobs
         chunk_size = self.chunkSize
         if n_cpus and n_cpus > 1:
-            return self.papply(func, func_args, func_kwargs, axis, raw, result_type, subset, n_cpus, chunk_size)
+            return self.papply(func, func_args, func_kwargs, axis, raw, result_type, subset, n_cpus, chunk_size, index)
         else:
-            df_sub = self.df[subset if subset else self.df.columns]
+            df_sub = self.loadColumns(subset) if subset else self.df
+            df_sub = df_sub if index is None else df_sub.loc[index]
             return df_sub.apply(func, raw=raw, axis=axis, result_type=result_type,
-                                args=func_args, **func_kwargs if func_kwargs else {})
+                                args=func_args if func_args else (), **func_kwargs if func_kwargs else {})
 
     def papply(self, func, func_args=None, func_kwargs=None, axis=0, raw=False,
-               result_type='expand', subset=None, n_cpus=1, chunk_size=1000):
+               result_type='expand', subset=None, n_cpus=1, chunk_size=1000, index=None):
         """
-        Parallelized version of `MoleculeTable.apply`.
+        Parallelized version of `MoleculeTable.apply`. The chunks are processed by the persistent worker pool
+        of this data set (see `MoleculeTable.getWorkerPool`) and are handed to the workers as soon as they are free.
 
         Args:
             func (callable): Function to apply to the data frame.
@@ -309,32 +445,44 @@ class MoleculeTable(MoleculeDataSet):
             subset (list): List of column names if only a subset of the data should be used (reduces memory consumption).
             n_cpus (int): Number of CPUs to use for parallelization.
             chunk_size (int): Number of rows to process in each chunk.
-            n_cpus (int): Number of CPUs to use for parallelization.
-            chunk_size (int): Number of rows to process in each chunk.
+            index (pd.Index): Labels of the rows to apply the function to, all rows if `None`.
         """
 
         n_cpus = n_cpus if n_cpus else os.cpu_count()
-        df_sub = self.df[subset if subset else self.df.columns]
+        df_sub = self.loadColumns(subset) if subset else self.df
+        df_sub = df_sub if index is None else df_sub.loc[index]
         data = [df_sub[i: i + chunk_size] for i in range(0, len(df_sub), chunk_size)]
-        batch_size = n_cpus  # how many batches to prefetch into the process (more is faster, but uses more memory)
-        results = []
-        with concurrent.futures.ProcessPoolExecutor(max_workers=n_cpus) as executor:
-            batches = [data[i: i + batch_size] for i in range(0, len(data), batch_size)]
-            for batch in tqdm(batches,
-                              desc=f"Parallel apply in progress for {self.name}."):
-                wrapped = self.ParallelApplyWrapper(
-                    func,
-                    func_args=func_args,
-                    func_kwargs=func_kwargs,
-                    result_type=result_type,
-                    axis=axis,
-                    raw=raw,
-                )
-                for result in executor.map(wrapped, batch):
-                    results.append(result)
+        wrapped = self.ParallelApplyWrapper(
+            func,
+            func_args=func_args,
+            func_kwargs=func_kwargs,
+            result_type=result_type,
+            axis=axis,
+            raw=raw,
+        )
+        results = self.getWorkerPool(n_cpus).map(wrapped, data, desc=f"Parallel apply in progress for {self.name}.")
 
         return pd.concat(results, axis=0)
 
+    def getWorkerPool(self, n_workers: int = None) -> WorkerPool:
+        """
+        Get the pool of worker processes of this data set. The pool is kept alive between calls to `papply` so that
+        the workers are only started and initialized with the applied function once.
+
+        Args:
+            n_workers (int): Number of worker processes, `nJobs` by default.
+
+        Returns:
+            WorkerPool: The worker pool.
+        """
+
+        n_workers = n_workers if n_workers else self.nJobs
+        if self.workerPool is None or self.workerPool.nWorkers != n_workers:
+            if self.workerPool is not None:
+                self.workerPool.shutdown()
+            self.workerPool = WorkerPool(n_workers)
+        return self.workerPool
+
     def transform(self, targets, transformer, addAs=None):
         """
         Transform the data frame (or its part) using a list of transformers. Each transformer is a function that takes the data frame
@@ -350,11 +498,13 @@ class MoleculeTable(MoleculeDataSet):
             names in this list are used as column names for the new data.
         """
 
-        ret = self.df[targets]
+        # only the target columns are loaded, other deferred columns stay on disk (see `loadColumns`)
+        ret = self.loadColumns(targets)
         ret = transformer(ret)
 
         if addAs:
-            self.df[addAs] = ret
+            self._df[addAs] = ret
+            self._deferredColumns = [col for col in self._deferredColumns if col not in addAs]
         return ret
 
     def filter(self, table_filters: List[Callable]):
@@ -371,7 +521,7 @@ class MoleculeTable(MoleculeDataSet):
         if df_filtered is not None:
             self.df = df_filtered.copy()
 
-    def addDescriptors(self, calculator: Calculator, recalculate=False):
+    def addDescriptors(self, calculator: Calculator, recalculate=False, incremental=False):
         """
         Add descriptors to the data frame using a `Calculator` object.
 
@@ -379,36 +529,235 @@ class MoleculeTable(MoleculeDataSet):
             calculator (Calculator): Calculator object to use for descriptor calculation.
             recalculate (bool): Whether to recalculate descriptors even if they are already present in the data frame.
                 If `False`, existing descriptors are kept and no calculation takes place.
+            incremental (bool): Only calculate the descriptor sets of a `DescriptorsCalculator` that are missing and
+                the rows that have no values for the other sets yet (i.e. rows added after the descriptors were
+                calculated). The results are merged with the existing descriptors and the descriptor sets are added
+                to the current calculator of the data set. Rows for which all values of a set failed to calculate
+                are calculated again.
         """
 
         if recalculate:
-            self.df.drop(self.getDescriptorNames(), axis=1, inplace=True)
+            if self.descriptorMatrix is not None:
+                self.descriptorMatrix.clear()
+            else:
+                self.df.drop(self.getDescriptorNames(), axis=1, inplace=True)
+            self.descriptorProvenance = {}
+        elif incremental and self.hasDescriptors:
+            self.addMissingDescriptors(calculator)
+            return
         elif self.hasDescriptors:
             logger.warning(f"Descriptors already exist in {self.name}. Use `recalculate=True` to overwrite them.")
             return
 
-        descriptors = self.apply(
-            calculator,
-            axis=0,
-            subset=[
-                self.smilescol],
-            result_type='reduce'
-        )
-        descriptors = descriptors.to_list()
-        descriptors = pd.concat(descriptors, axis=0)
-        descriptors.index = self.df.index
-        self.df = self.df.join(descriptors, how='left')
+        if isinstance(calculator, DescriptorsCalculator):
+            calculator.failures.clear()
+        descriptors = self.calculateDescriptors(calculator)
+        if self.descriptorMatrix is not None:
+            self.descriptorMatrix.write(descriptors)
+        elif descriptors.index.equals(self.df.index):
+            # the calculated block already has the rows of the data frame, no join needed
+            self.df = pd.concat([self.df, descriptors], axis=1)
+        else:
+            self.df = self.df.join(descriptors, how='left')
+        if isinstance(calculator, DescriptorsCalculator):
+            self.recordDescriptorProvenance(calculator.descsets, len(descriptors), calculator.failures)
         self.descriptorCalculator = calculator
 
-    def getDescriptors(self):
+    def recordDescriptorProvenance(self, descsets: List[DescriptorSet], n_rows: int,
+                                   failures: Dict[str, Dict[str, int]] = None):
+        """
+        Record that descriptors of the given sets were calculated for a number of rows. The provenance of each set
+        is saved with the descriptor calculator of the data set.
+
+        Args:
+            descsets (list): the descriptor sets
+            n_rows (int): number of calculated rows
+            failures (dict): number of failed calculations by type of error by the name of the set
+                (see `DescriptorsCalculator.failures`), added to the failures of the set
+        """
+        now = time.strftime("%Y-%m-%dT%H:%M:%S")
+        failures = failures if failures is not None else {}
+        for descset in descsets:
+            record = self.descriptorProvenance.setdefault(str(descset), {"created": now, "rows_calculated": 0})
+            record.update({
+                "updated": now,
+                "rows_calculated": record["rows_calculated"] + n_rows,
+                "qsprpred": VERSION,
+                "rdkit": rdkit.__version__,
+            })
+            if str(descset) in failures:
+                counts = record.setdefault("failures", {})
+                for key, count in failures[str(descset)].items():
+                    counts[key] = counts.get(key, 0) + count
+
+    def calculateDescriptors(self, calculator: Calculator, index: pd.Index = None) -> pd.DataFrame:
+        """
+        Calculate descriptors for the molecules in the data frame without adding them. Failed calculations are
+        counted in `DescriptorsCalculator.failures`.
+
+        Args:
+            calculator (Calculator): Calculator object to use for descriptor calculation.
+            index (pd.Index): labels of the rows to calculate, all rows if `None`
+
+        Returns:
+            pd.DataFrame: the calculated descriptors with the index of the selected rows
+        """
+        mols = self.df[self.molInputCol] if index is None else self.df.loc[index, self.molInputCol]
+        if isinstance(calculator, DescriptorsCalculator) and not calculator.sparse:
+            # descriptors are calculated into one preallocated matrix
+            names = calculator.getDescriptorNames()
+            if self.nJobs > 1:
+                # workers write the descriptors directly to a shared matrix
+                values, codes = self.getWorkerPool().calculate(
+                    calculator.calculateMatrix,
+                    mols.to_list(),
+                    len(names),
+                    self.getDescriptorChunkSize(calculator, len(mols)),
+                    desc=f"Calculating descriptors for {self.name}.",
+                    dtype=calculator.dtype,
+                    n_codes=len(calculator.descsets)
+                )
+            else:
+                values, codes = calculator.calculateMatrix(mols.to_list())
+            calculator.recordFailures(codes)
+            return pd.DataFrame(values, index=mols.index, columns=names)
+        elif index is not None:
+            descriptors = calculator(mols)
+        else:
+            descriptors = self.apply(
+                calculator,
+                axis=0,
+                subset=[
+                    self.molInputCol],
+                result_type='reduce'
+            )
+            descriptors = descriptors.to_list()
+            descriptors = pd.concat(descriptors, axis=0)
+        descriptors.index = mols.index
+        return descriptors
+
+    def getDescriptorChunkSize(self, calculator: DescriptorsCalculator, n_mols: int) -> int:
+        """
+        Get the number of molecules per chunk used to calculate descriptors in parallel. Descriptor sets that call
+        external programs (i.e. PaDEL or Mold2) prefer larger chunks than `chunkSize`, which are reduced so that
+        all workers still get a chunk.
+
+        Args:
+            calculator (DescriptorsCalculator): the calculator
+            n_mols (int): number of molecules to calculate
+
+        Returns:
+            int: the chunk size
+        """
+        if not calculator.batchSize or calculator.batchSize <= self.chunkSize:
+            return self.chunkSize
+        per_worker = -(-n_mols // self.nJobs)
+        return max(self.chunkSize, min(calculator.batchSize, per_worker))
+
+    def getMissingDescriptorRows(self, columns: List[str]) -> pd.Index:
+        """
+        Get the rows of the data frame without values for any of the given descriptors.
+
+        Args:
+            columns (list): names of the descriptors
+
+        Returns:
+            pd.Index: labels of the rows with missing values in all columns, all rows if any of the columns is missing
+        """
+        if any(col not in self.getDescriptorNames() for col in columns):
+            return self.df.index
+        if self.descriptorMatrix is not None:
+            stored = self.df.index.isin(self.descriptorMatrix.rowMap.index)
+            values = self.descriptorMatrix.take(self.df.index[stored], columns)
+            missing = np.ones(len(self.df), dtype=bool)
+            missing[stored] = np.isnan(values).all(axis=1)
+            return self.df.index[missing]
+        return self.df.index[self.df[columns].isna().all(axis=1).values]
+
+    def addMissingDescriptors(self, calculator: DescriptorsCalculator):
+        """
+        Calculate only the blocks of descriptors that are missing from the data set (see `addDescriptors`
+        with `incremental=True`). Descriptor sets missing the same rows are calculated together.
+
+        Args:
+            calculator (DescriptorsCalculator): calculator with the requested descriptor sets
+        """
+        if not isinstance(calculator, DescriptorsCalculator):
+            raise ValueError(f"Incremental calculation of descriptors requires a DescriptorsCalculator, "
+                             f"got {type(calculator)}.")
+
+        # group descriptor sets by their missing rows
+        blocks = []
+        replaced = []
+        for descset in calculator.descsets:
+            columns = [f"Descriptor_{descset}_{name}" for name in descset.descriptors]
+            missing = self.getMissingDescriptorRows(columns)
+            logger.info(f"Descriptors {descset} missing for {len(missing)} of {len(self.df)} rows in {self.name}.")
+            if len(missing) == 0:
+                continue
+            if len(missing) == len(self.df):
+                replaced.append(str(descset))
+            for rows, descsets in blocks:
+                if rows.equals(missing):
+                    descsets.append(descset)
+                    break
+            else:
+                blocks.append((missing, [descset]))
+
+        current = self.descriptorCalculator
+        if not isinstance(current, DescriptorsCalculator):
+            current = DescriptorsCalculator([])
+        for rows, descsets in blocks:
+            block_calculator = DescriptorsCalculator(descsets, cache=calculator.cache, timeout=calculator.timeout)
+            self.mergeDescriptors(self.calculateDescriptors(block_calculator, rows))
+            self.recordDescriptorProvenance(descsets, len(rows), block_calculator.failures)
+
+        # add the requested sets to the current calculator, recalculated sets replace the old ones
+        names = [str(descset) for descset in current.descsets]
+        for descset in calculator.descsets:
+            if str(descset) not in names:
+                current.descsets.append(descset)
+            elif str(descset) in replaced:
+                current.descsets[names.index(str(descset))] = descset
+        self.descriptorCalculator = current
+
+    def mergeDescriptors(self, descriptors: pd.DataFrame):
+        """
+        Write descriptors of some rows to the data set. Existing values are replaced and new descriptors are added.
+
+        Args:
+            descriptors (pd.DataFrame): the descriptors, indexed by the labels of the rows in the data frame
+        """
+        if self.descriptorMatrix is not None:
+            self.descriptorMatrix.update(descriptors)
+        else:
+            new_columns = [col for col in descriptors.columns if col not in self.df.columns]
+            existing = [col for col in descriptors.columns if col in self.df.columns]
+            if existing:
+                self.df.loc[descriptors.index, existing] = descriptors[existing].values
+            if new_columns:
+                self.df = self.df.join(descriptors[new_columns], how='left')
+
+    def getDescriptors(self, index=None, columns: List[str] = None):
         """
-        Get the subset of the data frame that contains only descriptors.
+        Get the subset of the data frame that contains only descriptors. If the descriptors are kept in
+        a memory-mapped matrix, a view of the matrix is returned if the selected rows and columns allow it.
+
+        Args:
+            index (pd.Index): labels of the rows to select, all rows if `None`
+            columns (list): names of the descriptors to select, all descriptors if `None`
 
         Returns:
             pd.DataFrame: Data frame containing only descriptors.
         """
 
-        return self.df[self.getDescriptorNames()]
+        columns = columns if columns is not None else self.getDescriptorNames()
+        if self.descriptorMatrix is not None:
+            return self.descriptorMatrix.toFrame(self._df.index if index is None else index, columns)
+        elif index is None:
+            return self.loadColumns(columns)
+        else:
+            return self.loadColumns(columns).loc[index]
 
     def getDescriptorNames(self):
         """
@@ -417,7 +766,9 @@ class MoleculeTable(MoleculeDataSet):
         Returns:
             list: List of descriptor names.
         """
-        return [col for col in self.df.columns if col.startswith("Descriptor_")]
+        if self.descriptorMatrix is not None:
+            return list(self.descriptorMatrix.columns)
+        return [col for col in self.getColumnNames() if col.startswith("Descriptor_")]
 
     @property
     def hasDescriptors(self):
@@ -434,7 +785,7 @@ class MoleculeTable(MoleculeDataSet):
             list: List of property names.
         """
 
-        return self.df.columns
+        return pd.Index(self.getColumnNames())
 
     def hasProperty(self, name):
         """
@@ -446,7 +797,7 @@ class MoleculeTable(MoleculeDataSet):
         Returns:
             bool: Whether the property is present.
         """
-        return name in self.df.columns
+        return name in self.getColumnNames()
 
     def addProperty(self, name, data):
         """
@@ -491,7 +842,7 @@ class MoleculeTable(MoleculeDataSet):
             self.df[f"Scaffold_{scaffold}"] = self.apply(
                 self._scaffold_calculator, func_args=(
                     scaffold,), subset=[
-                    self.smilescol], axis=1, raw=True)
+                    self.molInputCol], axis=1, raw=True)
             if add_rdkit_scaffold:
                 PandasTools.AddMoleculeColumnToFrame(self.df, smilesCol=f"Scaffold_{scaffold}",
                                                      molCol=f"Scaffold_{scaffold}_RDMol")
@@ -504,7 +855,7 @@ class MoleculeTable(MoleculeDataSet):
             include_mols (bool): Whether to include the RDKit scaffold columns as well.
         """
 
-        return [col for col in self.df.columns if
+        return [col for col in self.getColumnNames() if
                 col.startswith("Scaffold_") and (include_mols or not col.endswith("_RDMol"))]
 
     def getScaffolds(self, includeMols=False):
@@ -516,9 +867,9 @@ class MoleculeTable(MoleculeDataSet):
         """
 
         if includeMols:
-            return self.df[[col for col in self.df.columns if col.startswith("Scaffold_")]]
+            return self.loadColumns([col for col in self.getColumnNames() if col.startswith("Scaffold_")])
         else:
-            return self.df[self.getScaffoldNames()]
+            return self.loadColumns(self.getScaffoldNames())
 
     @property
     def hasScaffolds(self):
@@ -561,8 +912,8 @@ class MoleculeTable(MoleculeDataSet):
             list: List of scaffold groups.
         """
 
-        return self.df[
-            self.df.columns[self.df.columns.str.startswith(f"ScaffoldGroup_{scaffold_name}_{mol_per_group}")][0]]
+        name = [col for col in self.getColumnNames() if col.startswith(f"ScaffoldGroup_{scaffold_name}_{mol_per_group}")][0]
+        return self.loadColumns([name])[name]
 
     @property
     def hasScaffoldGroups(self):
@@ -572,39 +923,242 @@ class MoleculeTable(MoleculeDataSet):
         Returns:
             bool: Whether the data frame contains scaffold groups.
         """
-        return len([col for col in self.df.columns if col.startswith("ScaffoldGroup_")]) > 0
+        return len([col for col in self.getColumnNames() if col.startswith("ScaffoldGroup_")]) > 0
 
-    def cleanMolecules(self, standardize: bool = True, sanitize: bool = True):
-        """Standardize and or sanitize SMILES sequences."""
-        if standardize:
-            self.standardize()
-        if sanitize:
-            self.sanitize()
+    @staticmethod
+    def _cleanSmiles(smiles: pd.Series, standardize: bool = True, sanitize: bool = True,
+                     store_mols: bool = False) -> pd.DataFrame:
+        """Helper function to clean a column of SMILES with `clean_smiles` in `MoleculeTable.apply`."""
+        cleaned = [clean_smiles(smi, standardize, sanitize, return_mol=store_mols) for smi in smiles]
+        if store_mols:
+            cleaned = [(smi, valid, to_binary(mol)) for smi, valid, mol in cleaned]
+        return pd.DataFrame(cleaned, index=smiles.index, columns=["SMILES", "Valid", "Mol"][:3 if store_mols else 2])
+
+    def cleanMolecules(self, standardize: bool = True, sanitize: bool = True, drop_invalids: bool = False,
+                       index: pd.Index = None):
+        """
+        Standardize and or sanitize SMILES sequences and check their validity in one step. Each molecule
+        is parsed only once and the work is distributed over `nJobs` processes in chunks of `chunkSize` molecules.
+        If `storeMols` is set, the binary molecules of the cleaned SMILES are updated as well.
+
+        Args:
+            standardize (bool): Standardize the molecules with the ChEMBL structure pipeline.
+            sanitize (bool): Sanitize the SMILES (see `sanitize_smiles`).
+            drop_invalids (bool): Remove invalid molecules from the data frame.
+            index (pd.Index): Labels of the rows to clean, all rows if `None`.
+
+        Returns:
+            pd.Series: Boolean mask of valid molecules for the cleaned rows before cleaning.
+        """
+
+        # only property columns are changed, deferred columns are not loaded (see `loadColumns`)
+        if len(self._df) == 0 or (index is not None and len(index) == 0):
+            return pd.Series(dtype=bool)
+        result = self.apply(
+            self._cleanSmiles,
+            func_kwargs={"standardize": standardize, "sanitize": sanitize, "store_mols": self.storeMols},
+            axis=0,
+            subset=[self.smilescol],
+            result_type='reduce',
+            index=index
+        )
+        result = pd.concat(result.to_list(), axis=0)
+        valid_mask = result["Valid"].astype(bool)
+        if index is None:
+            if standardize or sanitize:
+                self._df[self.smilescol] = result["SMILES"]
+            if self.storeMols:
+                self._df[self.molCol] = result["Mol"]
+        else:
+            if standardize or sanitize:
+                self._df.loc[result.index, self.smilescol] = result["SMILES"]
+            if self.storeMols:
+                if self.molCol not in self._df.columns:
+                    self._df[self.molCol] = None
+                self._df.loc[result.index, self.molCol] = result["Mol"]
+        if drop_invalids:
+            logger.info(
+                f"Removing invalid SMILES: {self._df.loc[result.index, self.smilescol][~valid_mask]}"
+            )
+            self._df = self._df.drop(result.index[~valid_mask.values])
+
+        return valid_mask
+
+    @property
+    def molInputCol(self) -> str:
+        """Name of the column with the molecules used to calculate scaffolds and descriptors, the column with
+        binary molecules if available and the SMILES column otherwise."""
+        return self.molCol if self.storeMols and self.molCol in self._df.columns else self.smilescol
 
     def standardize(self):
         """Standardize SMILES sequences."""
 
-        self.df[self.smilescol] = [chembl_smi_standardizer(smiles)[0] for smiles in self.df[self.smilescol]]
+        self.cleanMolecules(standardize=True, sanitize=False)
 
     def sanitize(self):
         """Sanitize SMILES sequences."""
 
-        self.df[self.smilescol] = [sanitize_smiles(smiles) for smiles in self.df[self.smilescol]]
+        self.cleanMolecules(standardize=False, sanitize=True)
 
     def shuffle(self, random_state=None):
         """Shuffle the internal data frame."""
-        self.df = self.df.sample(frac=1, random_state=random_state).reset_index(drop=True)
+        df = self.df.sample(frac=1, random_state=random_state)
+        if self.descriptorMatrix is not None and self.descriptorMatrix.values is not None:
+            self.descriptorMatrix.relabel(df.index, pd.RangeIndex(len(df)))
+        self.df = df.reset_index(drop=True)
 
     def dropInvalids(self):
         """Drop Invalid SMILES."""
 
-        invalid_mask = self.df[self.smilescol].apply(lambda smile: Chem.MolFromSmiles(smile) is not None)
-        logger.info(
-            f"Removing invalid SMILES: {self.df[self.smilescol][invalid_mask]}"
-        )
-        self.df = self.df[invalid_mask].copy()
+        return self.cleanMolecules(standardize=False, sanitize=False, drop_invalids=True)
+
+    @staticmethod
+    def _inchiKeys(mols: pd.Series) -> pd.Series:
+        """Helper function to calculate InChIKeys of a column of molecules in `MoleculeTable.apply`."""
+        return pd.Series([to_inchikey(mol) for mol in mols], index=mols.index, dtype=object)
+
+    def addInchiKeys(self, index: pd.Index = None):
+        """
+        Add InChIKeys of the molecules to the `InChIKey` column of the data frame.
+
+        Args:
+            index (pd.Index): Labels of the rows to calculate the InChIKeys for, all rows if `None`.
+        """
+        if len(self.df) == 0 or (index is not None and len(index) == 0):
+            return
+        keys = self.apply(self._inchiKeys, axis=0, subset=[self.molInputCol], result_type='reduce', index=index)
+        keys = pd.concat(keys.to_list(), axis=0)
+        if "InChIKey" not in self.df.columns:
+            self.df["InChIKey"] = None
+        self.df.loc[keys.index, "InChIKey"] = keys
+
+    def getNewLabels(self, n_rows: int) -> pd.Index:
+        """
+        Get unused row labels for rows added to an integer-indexed data frame.
+
+        Args:
+            n_rows (int): number of new rows
+
+        Returns:
+            pd.Index: labels following the largest label of the data frame and the descriptor matrix
+        """
+        used = [self.df.index]
+        if self.descriptorMatrix is not None:
+            used.append(self.descriptorMatrix.rowMap.index)
+        start = max((int(labels.max()) + 1 for labels in used if len(labels) > 0), default=0)
+        return pd.RangeIndex(start, start + n_rows)
+
+    def append(self, df: pd.DataFrame, standardize: bool = True, sanitize: bool = True,
+               save: bool = True) -> pd.Index:
+        """
+        Add new rows to the data set. Only the new rows are cleaned and invalid molecules among them are dropped.
+        If the data set has descriptors, they are calculated for the new rows with the current descriptor
+        calculator. Scaffolds of the new rows are not calculated.
+
+        Args:
+            df (pd.DataFrame): the new rows, must contain the SMILES column, other columns are optional
+            standardize (bool): standardize the new molecules
+            sanitize (bool): sanitize the new molecules
+            save (bool): write the new rows to the store (see `MoleculeTable.saveRows`)
 
-        return invalid_mask
+        Returns:
+            pd.Index: labels of the added rows
+        """
+        added, _ = self.upsert(df, key=None, standardize=standardize, sanitize=sanitize, save=save)
+        return added
+
+    def upsert(self, df: pd.DataFrame, key: str = "InChIKey", standardize: bool = True, sanitize: bool = True,
+               save: bool = True):
+        """
+        Update existing rows and add new rows to the data set. Rows are matched by the values of the key column
+        after cleaning. Matched rows are updated with the values of the columns in `df` and keep their labels,
+        descriptors are only recalculated for updated rows whose SMILES changed and for the added rows.
+
+        Args:
+            df (pd.DataFrame): the new or updated rows, must contain the SMILES column
+            key (str): column identifying the molecules. InChIKeys are calculated for the data set and the new rows
+                if the key is 'InChIKey' and the column is missing. All rows are added if `None`.
+            standardize (bool): standardize the new molecules
+            sanitize (bool): sanitize the new molecules
+            save (bool): write the added and updated rows to the store (see `MoleculeTable.saveRows`)
+
+        Returns:
+            tuple: labels of the added rows and labels of the updated rows
+        """
+        if key is not None and key not in self.df.columns:
+            if key != "InChIKey":
+                raise ValueError(f"Key column '{key}' not found in data set {self.name}.")
+            self.addInchiKeys()
+
+        # add the rows with new labels and clean them
+        df = df.copy()
+        if pd.api.types.is_integer_dtype(self.df.index):
+            df.index = self.getNewLabels(len(df))
+        elif df.index.isin(self.df.index).any():
+            raise ValueError(f"Labels of the new rows already exist in data set {self.name}.")
+        self.df = pd.concat([self.df, df], axis=0)
+        valid = self.cleanMolecules(standardize, sanitize, drop_invalids=True, index=df.index)
+        new = df.index[valid.values] if len(valid) > 0 else df.index[:0]
+
+        # update matched rows
+        updated = new[:0]
+        changed = new[:0]
+        if key is not None and len(new) > 0:
+            if key == "InChIKey" and key not in df.columns:
+                self.addInchiKeys(new)
+            existing = self.df.drop(new)
+            existing = pd.Series(existing.index, index=existing[key].values)
+            existing = existing[existing.index.notna() & ~existing.index.duplicated(keep="last")]
+            new_keys = self.df.loc[new, key]
+            matched = new[new_keys.isin(existing.index).values]
+            if len(matched) > 0:
+                updated = pd.Index(existing[new_keys[matched].values].values)
+                columns = [col for col in df.columns if col != key]
+                columns += [col for col in (self.smilescol, self.molCol) if col in self.df.columns and col not in columns]
+                changed = updated[
+                    self.df.loc[updated, self.smilescol].values != self.df.loc[matched, self.smilescol].values]
+                self.df.loc[updated, columns] = self.df.loc[matched, columns].values
+                self.df = self.df.drop(matched)
+                new = new.difference(matched, sort=False)
+        logger.info(f"Adding {len(new)} and updating {len(updated)} rows in {self.name}.")
+
+        # featurize added rows and updated rows with changed molecules
+        to_calculate = new.append(changed)
+        if self.hasDescriptors and len(to_calculate) > 0:
+            if isinstance(self.descriptorCalculator, DescriptorsCalculator):
+                self.descriptorCalculator.failures.clear()
+                self.mergeDescriptors(self.calculateDescriptors(self.descriptorCalculator, to_calculate))
+                self.recordDescriptorProvenance(
+                    self.descriptorCalculator.descsets, len(to_calculate), self.descriptorCalculator.failures)
+            else:
+                logger.warning(f"No descriptor calculator found for {self.name}, "
+                               f"descriptors of the new rows are missing.")
+
+        if save:
+            self.saveRows(new.append(updated))
+        return new, updated
+
+    def saveRows(self, index: pd.Index):
+        """
+        Write added or updated rows to disk. If the store supports it (see `TableStorage.appendable`) and the columns
+        of the data frame did not change, only the given rows are appended to the store. Otherwise,
+        the whole data set is saved.
+
+        Args:
+            index (pd.Index): labels of the rows to write
+        """
+        if not (self.storage.appendable and self.storage.exists()
+                and self.storage.getColumns() == self.df.columns.to_list()):
+            self.save()
+            return
+        if len(index) > 0:
+            self.storage.append(self.df.loc[index])
+        if self.descriptorMatrix is not None and self.descriptorMatrix.values is not None:
+            self.descriptorMatrix.saveIndex()
+        if isinstance(self.descriptorCalculator, DescriptorsCalculator):
+            self.descriptorCalculator.toFile(self.descriptorCalculatorPath, self.descriptorProvenance)
+        elif self.descriptorCalculator:
+            self.descriptorCalculator.toFile(self.descriptorCalculatorPath)
 
 
 class QSPRDataset(MoleculeTable):
@@ -627,6 +1181,7 @@ class QSPRDataset(MoleculeTable):
         y_ind (np.ndarray/pd.DataFrame) : m-l label array for independent set, where m is
             the number of samples and equals to row of X_ind, and l is the number of types.
         featureNames (list of str) : feature names
+        targetTransformer (Callable) : transformation of the target property, also applied to upserted rows
         feature_standardizers (list of FeatureStandardizers): methods used to standardize the data features.
     """
 
@@ -646,6 +1201,10 @@ class QSPRDataset(MoleculeTable):
         chunk_size: int = 50,
         drop_invalids: bool = True,
         drop_empty: bool = True,
+        store_format: str = "pickle",
+        memmap_descriptors: bool = False,
+        store_mols: bool = False,
+        lazy: bool = False,
     ):
         """Construct QSPRdata, also apply transformations of output property if specified.
 
@@ -655,6 +1214,7 @@ class QSPRDataset(MoleculeTable):
             df (pd.DataFrame, optional): input dataframe containing smiles and target property. Defaults to None.
             smilescol (str, optional): name of column in df containing SMILES. Defaults to "SMILES".
             add_rdkit (bool, optional): if true, column with rdkit molecules will be added to df. Defaults to False.
+                Deprecated, use `store_mols` instead.
             store_dir (str, optional): directory for saving the output data. Defaults to '.'.
             overwrite (bool, optional): if already saved data at output dir if should be overwritten. Defaults to False.
             task (Literal[ModelTasks.REGRESSION, ModelTasks.CLASSIFICATION], optional): Defaults to ModelTasks.REGRESSION.
@@ -666,13 +1226,23 @@ class QSPRDataset(MoleculeTable):
             chunk_size (int, optional): chunk size for parallel processing. Defaults to 50.
             drop_invalids (bool, optional): if true, invalid SMILES will be dropped. Defaults to True.
             drop_empty (bool, optional): if true, rows with empty target property will be removed.
+            store_format (str, optional): storage backend of the data frame ('pickle' or 'parquet'). Defaults to 'pickle'.
+            memmap_descriptors (bool, optional): keep descriptors in a memory-mapped `float32` matrix instead of the
+                data frame. Defaults to False.
+            store_mols (bool, optional): keep binary RDKit molecules in the data frame to avoid parsing the SMILES
+                again when calculating scaffolds and descriptors. Defaults to False.
+            lazy (bool, optional): load only the property columns of a data set saved in a columnar store and defer
+                loading of descriptors and scaffolds until they are accessed. Only the descriptors in `featureNames`
+                are read to populate the training and test splits. Defaults to False.
 
         Raises:
             ValueError: Raised if thershold given with non-classification task.
         """
-        super().__init__(name, df, smilescol, add_rdkit, store_dir, overwrite, n_jobs, chunk_size, drop_invalids)
+        super().__init__(name, df, smilescol, add_rdkit, store_dir, overwrite, n_jobs, chunk_size, drop_invalids,
+                         store_format, memmap_descriptors, store_mols, lazy)
         self.targetProperty = target_prop
         self.originalTargetProperty = target_prop
+        self.targetTransformer = target_transformer
         self.task = task
         self.metaInfo = None
         try:
@@ -705,12 +1275,14 @@ class QSPRDataset(MoleculeTable):
             else:
                 # if a precomputed target is expected, just check it
                 assert all(float(x).is_integer(
-                ) for x in self.df[self.targetProperty]), f"Target property ({self.targetProperty}) should be integer if used for classification. Or specify threshold for binning."
+                ) for x in self._df[self.targetProperty]), f"Target property ({self.targetProperty}) should be integer if used for classification. Or specify threshold for binning."
         elif self.task == ModelTasks.REGRESSION and th:
             raise ValueError(
                 f"Got regression task with specified thresholds: 'th={th}'. Use 'task=ModelType.CLASSIFICATION' in this case.")
 
         # populate feature matrix and target property array
+        self._featureCache = {}
+        self._fittedStandardizer = None
         self.X = None
         self.y = None
         self.X_ind = None
@@ -753,7 +1325,7 @@ class QSPRDataset(MoleculeTable):
 
     def dropEmpty(self):
         """Drop rows with empty target property value from the data set."""
-        self.df.dropna(subset=([self.smilescol, self.targetProperty]), inplace=True)
+        self._df.dropna(subset=([self.smilescol, self.targetProperty]), inplace=True)
 
     @property
     def hasFeatures(self):
@@ -798,7 +1370,7 @@ class QSPRDataset(MoleculeTable):
     def nClasses(self):
         """Return number of output classes for classification."""
         if self.task == ModelTasks.CLASSIFICATION:
-            return len(self.df[self.targetProperty].unique())
+            return len(self._df[self.targetProperty].unique())
         else:
             return 0
 
@@ -829,18 +1401,18 @@ class QSPRDataset(MoleculeTable):
             assert (
                 len(th) > 3
             ), "For multi-class classification, set more than 3 values as threshold."
-            assert max(self.df[self.originalTargetProperty]) <= max(
+            assert max(self._df[self.originalTargetProperty]) <= max(
                 th
             ), "Make sure final threshold value is not smaller than largest value of property"
-            assert min(self.df[self.originalTargetProperty]) >= min(
+            assert min(self._df[self.originalTargetProperty]) >= min(
                 th
             ), "Make sure first threshold value is not larger than smallest value of property"
-            self.df[f"{new_prop}_intervals"] = pd.cut(
-                self.df[self.originalTargetProperty], bins=th, include_lowest=True
+            self._df[f"{new_prop}_intervals"] = pd.cut(
+                self._df[self.originalTargetProperty], bins=th, include_lowest=True
             ).astype(str)
-            self.df[new_prop] = LabelEncoder().fit_transform(self.df[f"{new_prop}_intervals"])
+            self._df[new_prop] = LabelEncoder().fit_transform(self._df[f"{new_prop}_intervals"])
         else:
-            self.df[new_prop] = self.df[self.originalTargetProperty] > th[0]
+            self._df[new_prop] = self._df[self.originalTargetProperty] > th[0]
         self.task = ModelTasks.CLASSIFICATION
         self.targetProperty = new_prop
         self.th = th
@@ -876,9 +1448,11 @@ class QSPRDataset(MoleculeTable):
             QSPRDataset: loaded data set
         """
 
+        filename = filename.rstrip('/')
         store_dir = os.path.dirname(filename)
         name = os.path.basename(filename).rsplit('_', 1)[0]
         meta = QSPRDataset.loadMetadata(name, store_dir)
+        meta['init'].setdefault('store_format', get_store_format_from_path(filename))
         return QSPRDataset(*args, name=name, store_dir=store_dir, **meta['init'], **kwargs)
 
     @staticmethod
@@ -896,10 +1470,17 @@ class QSPRDataset(MoleculeTable):
             QSPRDataset: created data set
         """
         kwargs['store_dir'] = mol_table.storeDir if 'store_dir' not in kwargs else kwargs['store_dir']
+        kwargs.setdefault('store_format', mol_table.storeFormat)
+        kwargs.setdefault('store_mols', mol_table.storeMols)
         name = mol_table.name if name is None else name
-        return QSPRDataset(name, target_prop, mol_table.getDF(), **kwargs)
+        df = mol_table.getDF()
+        if mol_table.descriptorMatrix is not None and mol_table.hasDescriptors:
+            # descriptors are moved to the matrix of the new data set
+            kwargs.setdefault('memmap_descriptors', True)
+            df = df.join(mol_table.getDescriptors())
+        return QSPRDataset(name, target_prop, df, **kwargs)
 
-    def addDescriptors(self, calculator: Calculator, recalculate=False, featurize=True):
+    def addDescriptors(self, calculator: Calculator, recalculate=False, featurize=True, incremental=False):
         """
         Add descriptors to the data set. If descriptors are already present, they will be recalculated if `recalculate` is `True`.
         Featurization will be performed after adding descriptors if `featurize` is `True`. Featurazation
@@ -909,12 +1490,75 @@ class QSPRDataset(MoleculeTable):
             calculator (Calculator): calculator instance to use for descriptor calculation
             recalculate (bool, optional): whether to recalculate descriptors if they are already present. Defaults to `False`.
             featurize (bool, optional): whether to featurize the data set after adding descriptors. Defaults to `True`.
+            incremental (bool, optional): only calculate missing descriptor sets and rows, see
+                `MoleculeTable.addDescriptors`. Defaults to `False`.
         """
-        super().addDescriptors(calculator, recalculate)
+        super().addDescriptors(calculator, recalculate, incremental)
         self.featureNames = self.getFeatureNames()
         if featurize:
             self.featurizeSplits()
 
+    def append(self, df: pd.DataFrame, split: str = "train", standardize: bool = True, sanitize: bool = True,
+               save: bool = True) -> pd.Index:
+        """
+        Add new rows to the data set without changing the existing training and test sets, see
+        `MoleculeTable.append`. Rows without a value of the target property are skipped.
+
+        Args:
+            df (pd.DataFrame): the new rows, must contain the SMILES and the (untransformed) target property
+            split (str): set the new rows are added to, either 'train' or 'test'
+            standardize (bool): standardize the new molecules
+            sanitize (bool): sanitize the new molecules
+            save (bool): write the new rows to the store (see `MoleculeTable.saveRows`)
+
+        Returns:
+            pd.Index: labels of the added rows
+        """
+        added, _ = self.upsert(df, key=None, split=split, standardize=standardize, sanitize=sanitize, save=save)
+        return added
+
+    def upsert(self, df: pd.DataFrame, key: str = "InChIKey", split: str = "train", standardize: bool = True,
+               sanitize: bool = True, save: bool = True):
+        """
+        Update existing rows and add new rows to the data set, see `MoleculeTable.upsert`. Updated rows stay in
+        their training or test set and added rows are assigned to the given set.
+
+        Args:
+            df (pd.DataFrame): the new or updated rows, must contain the SMILES and the (untransformed) target property
+            key (str): column identifying the molecules, all rows are added if `None`
+            split (str): set the added rows are added to, either 'train' or 'test'
+            standardize (bool): standardize the new molecules
+            sanitize (bool): sanitize the new molecules
+            save (bool): write the added and updated rows to the store (see `MoleculeTable.saveRows`)
+
+        Returns:
+            tuple: labels of the added rows and labels of the updated rows
+        """
+        if split not in ("train", "test"):
+            raise ValueError(f"Unknown split: {split}. Use 'train' or 'test'.")
+        target = self.originalTargetProperty
+        if target not in df.columns:
+            raise ValueError(f"Target property '{target}' not found in the new rows.")
+        df = df.dropna(subset=[self.smilescol, target])
+
+        self.saveSplit()
+        added, updated = super().upsert(df, key=key, standardize=standardize, sanitize=sanitize, save=False)
+        if self.targetTransformer and not self.th:
+            rows = added.append(updated)
+            transformed = self.targetTransformer(self.df.loc[rows, [target]])
+            self.df.loc[rows, self.targetProperty] = np.asarray(transformed).reshape(-1)
+        self.df.loc[added, "Split_IsTrain"] = split == "train"
+        self.df["Split_IsTrain"] = self.df["Split_IsTrain"].astype(bool)
+        if self.th:
+            self.makeClassification(self.th)
+        else:
+            self.restoreTrainingData()
+
+        if save:
+            self.saveRows(added.append(updated))
+            self.saveMetadata()
+        return added, updated
+
     def saveSplit(self):
         """
         Save split data to the managed data frame.
@@ -946,6 +1590,7 @@ class QSPRDataset(MoleculeTable):
         if hasattr(split, "hasDataSet") and hasattr(split, "setDataSet") and not split.hasDataSet:
             split.setDataSet(self)
 
+        self.clearFeatureCache()
         folds = Folds(split)
         self.X, self.X_ind, self.y, self.y_ind, train_index, test_index = next(
             folds.iterFolds(self.df, self.df[self.targetProperty]))
@@ -987,23 +1632,27 @@ class QSPRDataset(MoleculeTable):
         set will be regarded as the training set and the test set will have zero length.
         """
 
-        self.X = self.df
-        self.y = self.df[[self.targetProperty]]
+        self.clearFeatureCache()
+        self.X = self._df
+        self.y = self._df[[self.targetProperty]]
 
         # split data into training and independent sets if saved previously
-        if "Split_IsTrain" in self.df.columns:
-            self.X = self.df[self.df["Split_IsTrain"] == True]
-            self.X_ind = self.df[self.df["Split_IsTrain"] == False]
+        if "Split_IsTrain" in self._df.columns:
+            self.X = self._df[self._df["Split_IsTrain"] == True]
+            self.X_ind = self._df[self._df["Split_IsTrain"] == False]
             self.y = self.X[[self.targetProperty]]
             self.y_ind = self.X_ind[[self.targetProperty]]
         else:
             self.X_ind = self.X.drop(self.X.index)
             self.y_ind = self.y.drop(self.y.index)
-    def loadDescriptorsToSplits(self):
+    def loadDescriptorsToSplits(self, columns: List[str] = None):
         """
         Loads all available descriptors into the train and test splits. If no descriptors are available, an exception
         will be raised.
 
+        Args:
+            columns (List[str], optional): names of the descriptors to load, all descriptors if `None`
+
         Raises:
             ValueError: if no descriptors are available
         """
@@ -1011,13 +1660,13 @@ class QSPRDataset(MoleculeTable):
         if not self.hasDescriptors:
             raise ValueError("No descriptors available. Cannot load descriptors to splits.")
 
-        descriptors = self.getDescriptors()
-        self.X = descriptors.loc[self.X.index, :]
-        self.y = self.df.loc[self.y.index, [self.targetProperty]]
+        self.clearFeatureCache()
+        self.X = self.getDescriptors(self.X.index, columns)
+        self.y = self._df.loc[self.y.index, [self.targetProperty]]
 
         if self.X_ind is not None and self.y_ind is not None:
-            self.X_ind = descriptors.loc[self.X_ind.index, :]
-            self.y_ind = self.df.loc[self.y_ind.index, [self.targetProperty]]
+            self.X_ind = self.getDescriptors(self.X_ind.index, columns)
+            self.y_ind = self._df.loc[self.y_ind.index, [self.targetProperty]]
         else:
             self.X_ind = pd.DataFrame(columns=self.X.columns)
             self.y_ind = pd.DataFrame(columns=[self.targetProperty])
@@ -1033,9 +1682,7 @@ class QSPRDataset(MoleculeTable):
 
         """
         if self.featureNames:
-            self.loadDescriptorsToSplits()
-            self.X = self.X[self.featureNames]
-            self.X_ind = self.X_ind[self.featureNames]
+            self.loadDescriptorsToSplits(self.featureNames)
         else:
             self.X = self.X.drop(self.X.columns, axis=1)
             self.X_ind = self.X_ind.drop(self.X_ind.columns, axis=1)
@@ -1050,7 +1697,13 @@ class QSPRDataset(MoleculeTable):
             columns (List[str], optional): columns to fill missing values in. Defaults to None.
         """
 
+        self.clearFeatureCache()
         columns = columns if columns else self.getDescriptorNames()
+        if self.descriptorMatrix is not None:
+            descriptors = [col for col in columns if col in self.descriptorMatrix.columns]
+            if len(descriptors) > 0 and not pd.isna(fill_value):
+                self.descriptorMatrix.fill(fill_value, descriptors)
+            columns = [col for col in columns if col not in descriptors]
         self.df[columns] = self.df[columns].fillna(fill_value)
         logger.warning('Missing values filled with %s' % fill_value)
 
@@ -1071,6 +1724,7 @@ class QSPRDataset(MoleculeTable):
             for featurefilter in feature_filters:
                 self.X = featurefilter(self.X, self.y)
 
+            self.clearFeatureCache()
             self.featureNames = self.X.columns.to_list()
             if self.X_ind is not None:
                 self.X_ind = self.X_ind[self.featureNames]
@@ -1090,6 +1744,7 @@ class QSPRDataset(MoleculeTable):
         if not hasattr(feature_standardizer, 'toFile'):
             feature_standardizer = SKLearnStandardizer(feature_standardizer)
         self.feature_standardizer = feature_standardizer
+        self.clearFeatureCache()
 
     def prepareDataset(
         self,
@@ -1202,12 +1857,71 @@ class QSPRDataset(MoleculeTable):
         elif self.X.shape[0] == 0:
             raise ValueError("X has no rows.")
 
+    def clearFeatureCache(self):
+        """
+        Clear the cached folds and feature matrices (see `createFolds` and `getFeatures`). The cache is cleared
+        automatically when the splits, the features or the feature standardizer of the data set change.
+        """
+        self._featureCache = {}
+        self._fittedStandardizer = None
+
+    @staticmethod
+    def _standardizerKey(standardizer):
+        """Identify a feature standardizer by its type and settings, the fitted state is not considered."""
+        if not standardizer:
+            return None
+        if isinstance(standardizer, SKLearnStandardizer):
+            standardizer = standardizer.getInstance()
+        if hasattr(standardizer, 'get_params'):
+            return type(standardizer).__name__, repr(sorted(standardizer.get_params().items()))
+        return repr(standardizer)
+
+    def _getCached(self, name, key, func):
+        """
+        Get a cached value or create it with `func` and cache it. Only the last value under each name is kept.
+        The value is also recreated after the current splits (`X`, `X_ind` and `y`) were replaced, the cached entry
+        keeps references to them so that they are compared by identity.
+
+        Args:
+            name (Hashable): name of the cached value
+            key (tuple): settings the value depends on
+            func (Callable): creates the value if it is not cached under the same key
+
+        Returns:
+            the (cached) value
+        """
+        splits = (self.X, self.X_ind, self.y)
+        key = (tuple(self.featureNames),) + key
+        cached = self._featureCache.get(name)
+        if cached is not None and all(a is b for a, b in zip(cached[0], splits)) and cached[1] == key:
+            return cached[2]
+        value = func()
+        self._featureCache[name] = (splits, key, value)
+        return value
+
+    @staticmethod
+    def _makeReadOnly(folds):
+        """Make the arrays of the cached folds read-only, they are shared by all calls of `createFolds`."""
+        for fold in folds:
+            for arr in fold:
+                if isinstance(arr, np.ndarray):
+                    arr.setflags(write=False)
+        return folds
+
     def createFolds(self, split: datasplit = None):
         """
         Create folds for cross validation.
 
+        The standardized folds are cached for the current fold splitter, feature standardizer and features, so that
+        repeated cross-validation (i.e. in each trial of a hyperparameter optimization) does not split the data and
+        refit the standardizers again. The arrays of the cached folds are read-only. Shuffled splits without a random
+        state also return the same folds until the cache is cleared (see `clearFeatureCache`).
+
         Args:
             split (datasplit, optional): split to use for creating folds. Defaults to None.
+
+        Returns:
+            iterator: folds as tuples of (X_train, X_test, y_train, y_test, train_index, test_index)
         """
 
         self.checkFeatures()
@@ -1217,7 +1931,12 @@ class QSPRDataset(MoleculeTable):
         elif split is not None:
             self.fold_generator = Folds(split, self.feature_standardizer)
 
-        return self.fold_generator.iterFolds(self.X, self.y)
+        folds = self._getCached(
+            'folds',
+            (repr(self.fold_generator.split), self._standardizerKey(self.fold_generator.featureStandardizer)),
+            lambda: self._makeReadOnly(self.fold_generator.getFolds(self.X, self.y))
+        )
+        return iter(folds)
 
     def fitFeatureStandardizer(self):
         """
@@ -1227,9 +1946,9 @@ class QSPRDataset(MoleculeTable):
             X (pd.DataFrame): standardized training set
         """
         if self.hasDescriptors:
-            X = self.getDescriptors()
-            if self.featureNames is not None:
-                X = X[self.featureNames]
+            # the cached feature matrices were standardized with the previous fit
+            self.clearFeatureCache()
+            X = self.getDescriptors(columns=self.featureNames)
             return apply_feature_standardizer(self.feature_standardizer, X, fit=True)[0]
 
     def getFeatures(self, inplace=False, concat=False, raw=False):
@@ -1242,15 +1961,56 @@ class QSPRDataset(MoleculeTable):
             concat (bool): If `True`, the training and test feature matrices will be concatenated into a single matrix. This is useful for
                 training models that do not require separate training and test sets (i.e. the final optimized models).
             raw (bool): If `True`, the raw feature matrices will be returned without any standardization applied.
+
+        Returns:
+            tuple: training and test feature matrices, or only the concatenated matrix if `concat` is `True`. Unless
+                `inplace` is `True`, the matrices are cached until the splits, the features or the feature
+                standardizer change and must not be modified, the values of standardized matrices are read-only.
         """
         self.checkFeatures()
 
+        if inplace:
+            features = self._getFeatures(concat, raw)
+            if concat:
+                self.X, self.X_ind = features, None
+            else:
+                self.X, self.X_ind = features
+            self.clearFeatureCache()
+            return features
+
+        if raw or not self.feature_standardizer:
+            return self._getCached(('features', concat, raw), (), lambda: self._getFeatures(concat, raw))
+
+        name = ('features', concat, raw)
+
+        def create():
+            features = self._getFeatures(concat, raw, read_only=True)
+            self._fittedStandardizer = (name, self.feature_standardizer)
+            return features, copy.deepcopy(self.feature_standardizer.getInstance())
+
+        features, fitted = self._getCached(name, (self._standardizerKey(self.feature_standardizer),), create)
+        if self._fittedStandardizer is None or self._fittedStandardizer[0] != name \
+                or self._fittedStandardizer[1] is not self.feature_standardizer:
+            # the standardizer was fitted on other features since, it is replaced by a copy of the fit of these
+            self.feature_standardizer = SKLearnStandardizer(copy.deepcopy(fitted))
+            self._fittedStandardizer = (name, self.feature_standardizer)
+        return features
+
+    def _getFeatures(self, concat, raw, read_only=False):
+        """Create the feature matrices returned by `getFeatures`, standardized matrices are made read-only if
+        `read_only` is set (i.e. when they are cached)."""
         if concat:
-            df_X = pd.concat([self.X[self.featureNames], self.X_ind[self.featureNames]], axis=0)
+            df_X = pd.concat([self._selectFeatures(self.X), self._selectFeatures(self.X_ind)], axis=0)
             df_X_ind = None
         else:
-            df_X = self.X[self.featureNames]
-            df_X_ind = self.X_ind[self.featureNames]
+            df_X = self._selectFeatures(self.X)
+            df_X_ind = self._selectFeatures(self.X_ind)
+
+        if has_sparse(df_X) and (raw or not self.feature_standardizer):
+            # sparse features are not densified, models convert them to a sparse matrix
+            return (df_X, df_X_ind) if not concat else df_X
+        df_X = densify(df_X)
+        df_X_ind = densify(df_X_ind) if df_X_ind is not None else None
 
         X = df_X.values
         X_ind = df_X_ind.values if df_X_ind is not None else None
@@ -1266,17 +2026,25 @@ class QSPRDataset(MoleculeTable):
                     df_X_ind,
                     fit=False
                 )
+            if read_only:
+                # the standardized values are not shared with the data set, the data frames are views of them
+                for arr in (X, X_ind):
+                    if isinstance(arr, np.ndarray):
+                        arr.setflags(write=False)
 
         X = pd.DataFrame(X, index=df_X.index, columns=df_X.columns)
         if X_ind is not None:
             X_ind = pd.DataFrame(X_ind, index=df_X_ind.index, columns=df_X_ind.columns)
 
-        if inplace:
-            self.X = X
-            self.X_ind = X_ind
-
         return (X, X_ind) if not concat else X
 
+    def _selectFeatures(self, df: pd.DataFrame):
+        """Select the current features from a data frame. The data frame is returned as is if it already
+        contains exactly the selected features so that no copy is made."""
+        if df.columns.to_list() == list(self.featureNames):
+            return df
+        return df[self.featureNames]
+
     def getTargetProperties(self, concat=False):
         """
         Get the response values (training and test) for the set target property.
@@ -1338,6 +2106,7 @@ class QSPRDataset(MoleculeTable):
             'task': self.task.name,
             'smilescol': self.smilescol,
             'th': self.th,
+            'store_format': self.storeFormat,
         }
         ret = {
             'init': meta_init,
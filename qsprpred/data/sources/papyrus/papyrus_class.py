@@ -12,6 +12,7 @@ from papyrus_scripts.download import download_papyrus
 
 from qsprpred.data.data import MoleculeTable
 from qsprpred.data.sources.papyrus.papyrus_filter import papyrus_filter
+from qsprpred.data.utils.streaming import StreamingTableBuilder
 
 class Papyrus:
     DEFAULT_DIR = os.path.join(Path.home(), '.Papyrus')
@@ -69,6 +70,8 @@ class Papyrus:
             drop_duplicates: bool = False,
             chunk_size : int = 1e5,
             use_existing : bool = True,
+            streaming : bool = False,
+            n_jobs : int = 1,
     ):
         """
         Get the data from the Papyrus database as a `DataSetTSV` instance.
@@ -81,6 +84,9 @@ class Papyrus:
             drop_duplicates: remove duplicates after filtering
             chunk_size: data is read in chunks of this size (see `papyrus_filter`)
             use_existing: if the data is already present, use it instead of extracting it again
+            streaming: neither the filtered data nor the created data set are held in memory during extraction,
+                the data set is built chunk by chunk with `StreamingTableBuilder` and can be resumed if interrupted
+            n_jobs: number of processes used to build the data set if `streaming` is `True`
         Returns:
 
         """
@@ -100,5 +106,16 @@ class Papyrus:
             stereo=self.stereo,
             plusplus=self.plusplus,
             papyrus_dir=self.data_dir,
+            stream=streaming,
         )
+        if streaming:
+            builder = StreamingTableBuilder(
+                name,
+                store_dir=output_dir,
+                standardize=False,
+                sanitize=False,
+                n_jobs=n_jobs,
+                overwrite=not use_existing,
+            )
+            return builder.fromTableFile(path)
         return MoleculeTable.fromTableFile(name, path, store_dir=output_dir)
\ No newline at end of file
@@ -5,7 +5,7 @@ from papyrus_scripts.reader import read_papyrus
 from papyrus_scripts.preprocess import keep_quality, keep_accession
 from papyrus_scripts.preprocess import consume_chunks
 
-def papyrus_filter(acc_key: list, quality: str, outdir : str, prefix : str = None, drop_duplicates: bool = True, chunk_size : int = 1e5, use_existing : bool = True, stereo : bool = False, plusplus : bool = False, papyrus_dir : str = None):
+def papyrus_filter(acc_key: list, quality: str, outdir : str, prefix : str = None, drop_duplicates: bool = True, chunk_size : int = 1e5, use_existing : bool = True, stereo : bool = False, plusplus : bool = False, papyrus_dir : str = None, stream : bool = False):
     """
     Filters the downloaded papyrus dataset for quality and accession key (UniProt) and outputs a .tsv file of all compounds fulfilling these requirements.
 
@@ -20,6 +20,8 @@ def papyrus_filter(acc_key: list, quality: str, outdir : str, prefix : str = Non
         stereo: if `True`, read stereochemistry data (if available)
         plusplus: if `True`, read high quality Papyrus++ data (if available)
         papyrus_dir: path to the location of Papyrus database
+        stream: if `True`, filtered chunks are written to the output file one by one and the filtered dataset
+            is not kept in memory (`None` is returned instead of the data frame)
     Output:
         dataset: pandas `DataFrame` with the filtered dataset
     """
@@ -30,7 +32,7 @@ def papyrus_filter(acc_key: list, quality: str, outdir : str, prefix : str = Non
 
     if use_existing and os.path.exists(outfile):
         print(f"Using existing data from {outfile}...")
-        return pd.read_table(outfile, sep="\t", header=0), outfile
+        return (pd.read_table(outfile, sep="\t", header=0) if not stream else None), outfile
 
     # read data
     print(f"Reading data from {papyrus_dir}...")
@@ -42,6 +44,9 @@ def papyrus_filter(acc_key: list, quality: str, outdir : str, prefix : str = Non
     filter2 = keep_accession(data=filter1, accession=acc_key)
     print("Initialized filters.")
 
+    if stream:
+        return stream_chunks(filter2, outfile, drop_duplicates), outfile
+
     # filter data per chunk
     filtered_data = consume_chunks(generator=filter2)
     print(f"Number of compounds:{filtered_data.shape[0]}")
@@ -62,3 +67,32 @@ def papyrus_filter(acc_key: list, quality: str, outdir : str, prefix : str = Non
 
 
 
+
+
+def stream_chunks(chunks, outfile : str, drop_duplicates: bool = True):
+    """
+    Write filtered chunks of the Papyrus dataset to a .tsv file without keeping them in memory.
+
+    Args:
+        chunks: generator of filtered chunks
+        outfile: path to the output file
+        drop_duplicates: boolean to drop duplicate molecules (only the InChIKeys of the written molecules are kept in memory)
+    """
+    seen = set()
+    n_written = 0
+    n_chunks = 0
+    tmpfile = f"{outfile}.tmp"
+    for idx, chunk in enumerate(chunks):
+        if drop_duplicates:
+            chunk = chunk.drop_duplicates(subset=["InChIKey"])
+            chunk = chunk[~chunk["InChIKey"].isin(seen)]
+            seen.update(chunk["InChIKey"])
+        chunk.to_csv(tmpfile, sep="\t", index=False, mode="w" if idx == 0 else "a", header=idx == 0)
+        n_written += len(chunk)
+        n_chunks += 1
+    if n_chunks == 0:
+        # no chunks to write, the output only contains the header of the identifiers
+        pd.DataFrame(columns=["SMILES", "InChIKey"]).to_csv(tmpfile, sep="\t", index=False)
+    # only replace the output once all chunks were written so that incomplete files are not reused
+    os.replace(tmpfile, outfile)
+    print(f"Wrote {n_written} compounds to file '{outfile}'.")
@@ -5,18 +5,26 @@ import itertools
 import logging
 import os
 import shutil
+import time
 from unittest import TestCase
 
 import mordred
 import numpy as np
 import pandas as pd
+import scipy.sparse
 from mordred import descriptors as mordreddescriptors
 from parameterized import parameterized
 
-from qsprpred.data.data import QSPRDataset
+from qsprpred.data.data import MoleculeTable, QSPRDataset
+from qsprpred.data.sources.papyrus.papyrus_filter import stream_chunks
 from qsprpred.data.utils.datafilters import CategoryFilter
 from qsprpred.data.utils.datasplitters import randomsplit, scaffoldsplit, temporalsplit
+from qsprpred.data.utils.benchmark import compare_benchmarks, get_benchmark_smiles, run_benchmarks
+from qsprpred.data.utils.descriptor_cache import DescriptorCache
 from qsprpred.data.utils.descriptorcalculator import DescriptorsCalculator
+from qsprpred.data.utils.descriptor_utils.external import calculate_isolated
+from qsprpred.data.utils.descriptor_utils.fingerprints import pack_fingerprints, unpack_fingerprints
+from qsprpred.data.utils.descriptor_utils.similarity import TanimotoIndex
 from qsprpred.data.utils.descriptorsets import (
     DrugExPhyschem,
     FingerprintSet,
@@ -34,17 +42,61 @@ from qsprpred.data.utils.featurefilters import (
     lowVarianceFilter,
 )
 from qsprpred.data.utils.scaffolds import Murcko, BemisMurcko
+from qsprpred.data.utils.smiles_standardization import chembl_smi_standardizer, sanitize_smiles
+from qsprpred.data.utils.sparse_features import to_matrix
+from qsprpred.data.utils.storage import get_storage, migrate_storage
+from qsprpred.data.utils.streaming import StreamingTableBuilder
+from qsprpred.data.utils.supervision import CalculationError
 from qsprpred.logs.stopwatch import StopWatch
 from qsprpred.models.models import QSPRsklearn
 from qsprpred.models.tasks import ModelTasks
-from rdkit import Chem
-from rdkit.Chem import Descriptors
+from rdkit import Chem, DataStructs
+from rdkit.Chem import AllChem, Descriptors
 from sklearn.preprocessing import MinMaxScaler, StandardScaler
 
 N_CPU = 2
 CHUNK_SIZE = 100
 logging.basicConfig(level=logging.DEBUG)
 
+
+class UnreliableDescriptorSet(DescriptorSet):
+    """Descriptor set that hangs on one molecule and fails on another, used to test supervised calculations."""
+
+    def __init__(self, hang: str, fail: str):
+        self.hang = hang
+        self.fail = fail
+
+    def __call__(self, mols):
+        values = []
+        for mol in self.iterMols(mols):
+            smiles = Chem.MolToSmiles(mol)
+            if smiles == self.hang:
+                time.sleep(60)
+            if smiles == self.fail:
+                raise ValueError(f"Failed on {smiles}")
+            values.append([mol.GetNumAtoms()])
+        return np.array(values)
+
+    @property
+    def descriptors(self):
+        return ["NumAtoms"]
+
+    @descriptors.setter
+    def descriptors(self, value):
+        pass
+
+    @property
+    def is_fp(self):
+        return False
+
+    @property
+    def settings(self):
+        return {"hang": self.hang, "fail": self.fail}
+
+    def __str__(self):
+        return "Unreliable"
+
+
 class PathMixIn:
     """
     Mix-in class that provides paths to test files and directories and handles their creation and deletion.
@@ -437,6 +489,300 @@ class TestDataSetCreationSerialization(DataSetsMixIn, TestCase):
         dataset_new = QSPRDataset.fromFile(dataset.storePath)
         check_regression(dataset_new)
 
+    def test_parquet_storage(self):
+        dataset = QSPRDataset(
+            "test_parquet_storage",
+            "CL",
+            df=self.getSmallDF(),
+            store_dir=self.qsprdatapath,
+            n_jobs=N_CPU,
+            chunk_size=CHUNK_SIZE,
+            store_format="parquet",
+        )
+        dataset.prepareDataset(
+            feature_calculator=DescriptorsCalculator([FingerprintSet(fingerprint_type="MorganFP", radius=2, nBits=128)]),
+            split=randomsplit(0.1)
+        )
+        dataset.addScaffolds([Murcko()])
+        dataset.save()
+        self.assertTrue(dataset.storePath.endswith("_df.parquet"))
+        self.assertTrue(os.path.isdir(dataset.storePath))
+
+        # column groups can be loaded separately
+        self.assertEqual(dataset.storage.load(groups=["descriptors"]).shape[1], 128)
+        self.assertListEqual(dataset.storage.load(groups=["scaffolds"]).columns.to_list(), ["Scaffold_Murcko"])
+        self.assertListEqual(dataset.storage.getColumns(), dataset.df.columns.to_list())
+
+        dataset_new = QSPRDataset.fromFile(dataset.storePath)
+        self.assertEqual(dataset_new.storeFormat, "parquet")
+        self.assertTrue(dataset_new.df.equals(dataset.df))
+        self.assertListEqual(dataset_new.featureNames, dataset.featureNames)
+        self.assertEqual(len(dataset_new.X_ind), len(dataset.X_ind))
+
+        # migration from the pickle format
+        dataset = self.create_small_dataset(name="test_parquet_migration")
+        dataset.save()
+        path = migrate_storage("test_parquet_migration", self.qsprdatapath)
+        self.assertFalse(os.path.exists(dataset.storePath))
+        dataset_new = QSPRDataset.fromFile(dataset.storePath)
+        self.assertEqual(dataset_new.storePath, path)
+        self.assertTrue(dataset_new.df.equals(dataset.df))
+
+    def test_lazy_loading(self):
+        dataset = QSPRDataset(
+            "test_lazy_loading",
+            "CL",
+            df=self.getSmallDF(),
+            store_dir=self.qsprdatapath,
+            store_format="parquet",
+        )
+        dataset.prepareDataset(
+            feature_calculator=DescriptorsCalculator([FingerprintSet(fingerprint_type="MorganFP", radius=2, nBits=128)]),
+            split=randomsplit(0.1),
+            feature_filters=[lowVarianceFilter(0.05)],
+        )
+        dataset.addScaffolds([Murcko()])
+        dataset.save()
+        self.assertLess(len(dataset.featureNames), 128)
+
+        # only the selected features are read to populate the splits
+        dataset_new = QSPRDataset.fromFile(dataset.storePath, lazy=True)
+        loaded = dataset_new._df.columns
+        self.assertTrue(set(dataset_new.featureNames).issubset(loaded))
+        self.assertFalse(any(col in loaded for col in dataset.getDescriptorNames() if col not in dataset.featureNames))
+        self.assertNotIn("Scaffold_Murcko", loaded)
+        self.assertListEqual(dataset_new.getColumnNames(), dataset.df.columns.to_list())
+        dataset_eager = QSPRDataset.fromFile(dataset.storePath)
+        self.assertTrue(dataset_new.getFeatures(concat=True).equals(dataset_eager.getFeatures(concat=True)))
+
+        # transforming the target property does not load the other columns
+        dataset_transformed = QSPRDataset.fromFile(dataset.storePath, lazy=True, target_transformer=lambda x: x * 2)
+        self.assertNotIn("Scaffold_Murcko", dataset_transformed._df.columns)
+        self.assertTrue(np.allclose(dataset_transformed._df["CL_transformed"], dataset_transformed._df["CL"] * 2))
+
+        # deferred columns are read on first access
+        self.assertTrue(dataset_new.getScaffolds().equals(dataset.getScaffolds()))
+        self.assertIn("Scaffold_Murcko", dataset_new._df.columns)
+        self.assertTrue(dataset_new.df.equals(dataset.df))
+
+    def test_memmap_descriptors(self):
+        prep = self.get_default_prep()
+        prep["split"] = scaffoldsplit(Murcko(), 0.1)  # shuffles the data set
+        dataset = QSPRDataset(
+            "test_memmap_descriptors",
+            "CL",
+            df=self.getBigDF(),
+            store_dir=self.qsprdatapath,
+            n_jobs=N_CPU,
+            chunk_size=CHUNK_SIZE,
+            memmap_descriptors=True,
+        )
+        dataset.prepareDataset(**prep)
+        self.assertFalse(any(col.startswith("Descriptor_") for col in dataset.df.columns))
+        self.assertTrue(os.path.exists(dataset.descriptorMatrix.path))
+        self.assertEqual(len(dataset.getDescriptorNames()), 1024)
+        self.assertTrue(all(dataset.X.dtypes == np.float32))
+        self.assertListEqual(dataset.X.columns.to_list(), dataset.featureNames)
+
+        # descriptors still belong to the same molecules after shuffling
+        reference = DescriptorsCalculator([FingerprintSet(fingerprint_type="MorganFP", radius=3, nBits=1024)])(
+            dataset.df[dataset.smilescol].iloc[0:5]
+        )
+        self.assertTrue(np.array_equal(reference.values, dataset.getDescriptors().iloc[0:5].values))
+
+        # writing to the matrix keeps the labels of the shuffled rows
+        dataset.fillMissing(0)
+        dataset.featurizeSplits()
+        X = dataset.getFeatures(raw=True)[0]
+        reference = DescriptorsCalculator([FingerprintSet(fingerprint_type="MorganFP", radius=3, nBits=1024)])(
+            dataset.df.loc[X.index[0:5], dataset.smilescol]
+        )
+        self.assertTrue(np.array_equal(reference[X.columns].values, X.iloc[0:5].values))
+
+        # contiguous rows and columns are served as views of the matrix
+        matrix = dataset.descriptorMatrix
+        labels = matrix.rowMap.sort_values().index[10:20]
+        self.assertTrue(np.shares_memory(matrix.toFrame(labels, matrix.columns[5:10]).values, matrix.values))
+        self.assertFalse(np.shares_memory(matrix.toFrame(labels[::2]).values, matrix.values))
+
+        dataset.save()
+        dataset_new = QSPRDataset.fromFile(dataset.storePath)
+        self.assertTrue(dataset_new.memmapDescriptors)
+        self.assertTrue(dataset_new.X.sort_index().equals(dataset.X.sort_index()))
+        self.assertTrue(dataset_new.X_ind.sort_index().equals(dataset.X_ind.sort_index()))
+        self.assertEqual(len(dataset_new.createFolds().__next__()), 6)
+
+    def test_clean_molecules(self):
+        df = self.getBigDF()
+        df.loc[0, "SMILES"] = "not a SMILES"
+        dataset = MoleculeTable("test_clean_molecules", df, store_dir=self.qsprdatapath, n_jobs=N_CPU,
+                                chunk_size=CHUNK_SIZE, drop_invalids=False)
+        expected = [
+            Chem.MolToSmiles(Chem.MolFromSmiles(sanitize_smiles(chembl_smi_standardizer(smi)[0])))
+            for smi in dataset.df.SMILES if Chem.MolFromSmiles(smi) is not None
+        ]
+        valid = dataset.cleanMolecules(drop_invalids=True)
+        self.assertFalse(valid[0])
+        self.assertEqual(valid.sum(), len(expected))
+        self.assertListEqual(dataset.df.SMILES.to_list(), expected)
+
+    @parameterized.expand([("pickle",), ("parquet",)])
+    def test_store_mols(self, store_format):
+        calculator = DescriptorsCalculator([DrugExPhyschem(), FingerprintSet(fingerprint_type="MorganFP", radius=3, nBits=1000)])
+        df = self.getSmallDF()
+        expected = MoleculeTable("test_store_mols_expected", df.copy(), store_dir=self.qsprdatapath,
+                                 n_jobs=N_CPU, chunk_size=CHUNK_SIZE)
+        dataset = MoleculeTable("test_store_mols", df.copy(), store_dir=self.qsprdatapath, n_jobs=N_CPU,
+                                chunk_size=CHUNK_SIZE, store_format=store_format, store_mols=True)
+        self.assertIn(dataset.molCol, dataset.df.columns)
+        for table in (expected, dataset):
+            table.cleanMolecules()
+            table.addScaffolds([Murcko()])
+            table.addDescriptors(calculator)
+        self.assertListEqual(
+            [Chem.MolToSmiles(Chem.Mol(mol)) for mol in dataset.df[dataset.molCol]], dataset.df.SMILES.to_list())
+        self.assertTrue(dataset.getScaffolds().equals(expected.getScaffolds()))
+        self.assertTrue(dataset.getDescriptors().equals(expected.getDescriptors()))
+
+        dataset.save()
+        dataset = MoleculeTable.fromFile(dataset.storePath)
+        self.assertTrue(dataset.storeMols)
+        self.assertIsInstance(dataset.df[dataset.molCol].iloc[0], bytes)
+
+    @parameterized.expand([(False,), (True,)])
+    def test_incremental_descriptors(self, memmap):
+        df = self.getSmallDF()
+        physchem = DrugExPhyschem()
+        morgan = FingerprintSet(fingerprint_type="MorganFP", radius=2, nBits=128)
+        expected = MoleculeTable("test_incremental_expected", df.copy(), store_dir=self.qsprdatapath,
+                                 memmap_descriptors=memmap)
+        expected.addDescriptors(DescriptorsCalculator([physchem, morgan]))
+
+        # descriptors for the first rows only, the remaining rows are added later
+        dataset = MoleculeTable("test_incremental", df.iloc[:6].copy(), store_dir=self.qsprdatapath,
+                                memmap_descriptors=memmap)
+        dataset.addDescriptors(DescriptorsCalculator([physchem]))
+        dataset.df = pd.concat([dataset.df, df.iloc[6:]])
+        dataset.addDescriptors(DescriptorsCalculator([physchem, morgan]), incremental=True)
+        self.assertListEqual(dataset.getDescriptorNames(), expected.getDescriptorNames())
+        self.assertTrue(np.allclose(dataset.getDescriptors(), expected.getDescriptors(), equal_nan=True))
+        provenance = dataset.descriptorProvenance
+        self.assertEqual(provenance[str(physchem)]["rows_calculated"], len(df))
+        self.assertEqual(provenance[str(morgan)]["rows_calculated"], len(df))
+
+        # nothing is calculated if all descriptors are present
+        dataset.addDescriptors(DescriptorsCalculator([morgan]), incremental=True)
+        self.assertEqual(provenance[str(morgan)]["rows_calculated"], len(df))
+        dataset.save()
+        dataset = MoleculeTable.fromFile(dataset.storePath)
+        self.assertEqual(dataset.descriptorProvenance, provenance)
+        self.assertEqual(len(dataset.descriptorCalculator.descsets), 2)
+
+    @parameterized.expand([(False,), (True,)])
+    def test_append_upsert(self, memmap):
+        df = pd.read_csv(f'{self.datapath}/test_data.tsv', sep='\t')
+        calculator = DescriptorsCalculator([FingerprintSet(fingerprint_type="MorganFP", radius=2, nBits=128)])
+        dataset = QSPRDataset("test_append", "CL", df=df.iloc[:6].copy(), store_dir=self.qsprdatapath,
+                              store_format="parquet", memmap_descriptors=memmap)
+        dataset.prepareDataset(feature_calculator=calculator, split=randomsplit(0.3))
+        dataset.save()
+        train, test = sorted(dataset.X.index), sorted(dataset.X_ind.index)
+
+        # new rows are added to the test set and only they are featurized
+        added = dataset.append(df.iloc[6:8], split="test")
+        self.assertEqual(len(added), 2)
+        self.assertListEqual(sorted(dataset.X.index), train)
+        self.assertListEqual(sorted(dataset.X_ind.index), test + added.to_list())
+        self.assertEqual(dataset.descriptorProvenance[str(calculator.descsets[0])]["rows_calculated"], len(dataset))
+        self.assertTrue(any(".part" in path for path in os.listdir(dataset.storePath)))
+
+        # matching molecules are updated, the others are added
+        df_update = df.iloc[7:10].copy()
+        df_update["CL"] = 100
+        last = added[-1]
+        added, updated = dataset.upsert(df_update)
+        self.assertEqual(len(added), 2)
+        self.assertListEqual(updated.to_list(), [last])
+        self.assertEqual(len(dataset), len(train) + len(test) + 4)
+        self.assertTrue((dataset.df.loc[added.append(updated), "CL"] == 100).all())
+        self.assertFalse(dataset.getFeatures(concat=True).isna().any().any())
+
+        dataset_new = QSPRDataset.fromFile(dataset.storePath)
+        self.assertTrue(dataset_new.df.equals(dataset.df))
+        self.assertTrue(np.allclose(dataset_new.getFeatures(concat=True), dataset.getFeatures(concat=True)))
+        self.assertListEqual(sorted(dataset_new.X.index), train + added.to_list())
+
+    def test_upsert_transformed(self):
+        df = pd.read_csv(f'{self.datapath}/test_data.tsv', sep='\t')
+        dataset = QSPRDataset("test_upsert_transformed", "CL", df=df.iloc[:6].copy(), store_dir=self.qsprdatapath,
+                              target_transformer=lambda x: x * 2)
+        self.assertEqual(dataset.targetProperty, "CL_transformed")
+
+        # the new rows contain the untransformed target property, the transformed one is calculated
+        df_update = df.iloc[5:8].copy()
+        df_update["CL"] = 100
+        added, updated = dataset.upsert(df_update, save=False)
+        self.assertEqual(len(added), 2)
+        self.assertEqual(len(updated), 1)
+        self.assertTrue((dataset.df.loc[added.append(updated), "CL_transformed"] == 200).all())
+        self.assertTrue(np.allclose(dataset.df["CL_transformed"], dataset.df["CL"] * 2))
+        self.assertFalse(dataset.y.isna().any().any())
+
+    def test_streaming_builder(self):
+        calculator = DescriptorsCalculator([DrugExPhyschem()])
+        path = f'{self.datapath}/test_data_large.tsv'
+        builder = StreamingTableBuilder(
+            "test_streaming", self.qsprdatapath, calculator=calculator, n_jobs=N_CPU, chunk_size=CHUNK_SIZE // 4)
+
+        # interrupt the build after two chunks
+        checkpoint = builder.start(os.path.abspath(path))
+        chunks = pd.read_table(path, chunksize=builder.rowsPerChunk)
+        builder.consume(itertools.islice(chunks, 2), checkpoint)
+        checkpoint = builder.readCheckpoint()
+        self.assertEqual(checkpoint["last_chunk"], 1)
+        self.assertEqual(checkpoint["rows_read"], 2 * builder.rowsPerChunk)
+        self.assertTrue(checkpoint["finished"])
+
+        # resumed build continues after the last stored chunk
+        checkpoint["finished"] = False
+        builder.writeCheckpoint(checkpoint)
+        dataset = builder.fromTableFile(path)
+        checkpoint = builder.readCheckpoint()
+        self.assertTrue(checkpoint["finished"])
+        self.assertEqual(checkpoint["rows_read"], len(self.getBigDF()))
+
+        # the built data set is returned without loading its descriptors
+        self.assertEqual(builder.chunkSize, dataset.chunkSize)
+        self.assertTrue(len(dataset.getDescriptorNames()) > 0)
+        self.assertFalse(any(col in dataset._df.columns for col in dataset.getDescriptorNames()))
+
+        # same result as building the data set in memory
+        expected = MoleculeTable("test_streaming_expected", self.getBigDF(), store_dir=self.qsprdatapath)
+        expected.cleanMolecules()
+        expected.dropInvalids()
+        expected.addDescriptors(calculator)
+        self.assertEqual(len(dataset), checkpoint["rows_stored"])
+        self.assertListEqual(dataset.df.index.to_list(), expected.df.index.to_list())
+        self.assertListEqual(dataset.df[dataset.smilescol].to_list(), expected.df[expected.smilescol].to_list())
+        self.assertTrue(np.allclose(dataset.getDescriptors().values, expected.getDescriptors().values, equal_nan=True))
+        self.assertEqual(str(dataset.descriptorCalculator), str(calculator))
+
+    def test_stream_chunks_empty(self):
+        outfile = f"{self.qsprdatapath}/test_stream_chunks_empty.tsv"
+        df = self.getSmallDF()
+        df["InChIKey"] = [f"KEY{idx}" for idx in range(len(df))]
+
+        # filters that match nothing still yield empty chunks with the columns of the data
+        stream_chunks((df.iloc[:0] for _ in range(2)), outfile)
+        self.assertListEqual(pd.read_table(outfile).columns.to_list(), df.columns.to_list())
+        self.assertEqual(len(pd.read_table(outfile)), 0)
+
+        # no chunks at all
+        stream_chunks(iter([]), outfile)
+        self.assertEqual(len(pd.read_table(outfile)), 0)
+        self.assertFalse(os.path.exists(f"{outfile}.tmp"))
+
+
 class TestDataSplitters(DataSetsMixIn, TestCase):
     """
     Small tests to only check if the data splitters work on their own. The tests here should be used to check for all their specific parameters and edge cases.
@@ -543,6 +889,49 @@ class TestFoldSplitters(DataSetsMixIn, TestCase):
 
         self.validate_folds(dataset, more=check_min_max)
 
+    def test_cache(self):
+        dataset = self.create_large_dataset()
+        dataset.addDescriptors(DescriptorsCalculator(
+            [FingerprintSet(fingerprint_type="MorganFP", radius=3, nBits=1024)]))
+        dataset.prepareDataset(split=randomsplit(0.1), feature_standardizer=StandardScaler())
+
+        # folds and features are reused until the data set changes
+        X, X_ind = dataset.getFeatures()
+        scaler = dataset.feature_standardizer.getInstance()
+        mean = scaler.mean_.copy()
+        folds = list(dataset.createFolds())
+        self.assertTrue(all(x is y for x, y in zip(folds[0], next(dataset.createFolds()))))
+        self.assertFalse(folds[0][0].flags.writeable)
+        self.assertIs(dataset.getFeatures()[0], X)
+        self.assertFalse(X.values.flags.writeable)
+        # the standardizer is only replaced if it was fitted on other features since
+        standardizer = dataset.feature_standardizer
+        dataset.getFeatures()
+        self.assertIs(dataset.feature_standardizer, standardizer)
+        # the folds are standardized with copies of the standardizer
+        np.testing.assert_array_equal(scaler.mean_, mean)
+        for X_train, X_test, y_train, y_test, train_index, test_index in folds:
+            np.testing.assert_allclose(X_train.mean(axis=0), 0, atol=1e-6)
+
+        # the standardizer is restored to the fit of the requested features
+        dataset.getFeatures(concat=True)
+        self.assertFalse(np.array_equal(dataset.feature_standardizer.getInstance().mean_, mean))
+        self.assertIs(dataset.getFeatures()[0], X)
+        np.testing.assert_array_equal(dataset.feature_standardizer.getInstance().mean_, mean)
+
+        # replaced splits invalidate the cache, even if the new objects have the same shape
+        dataset.y = dataset.y.copy()
+        self.assertIsNot(next(dataset.createFolds())[0], folds[0][0])
+
+        # changes of the standardizer, the features or the splits invalidate the cache
+        dataset.prepareDataset(feature_standardizer=MinMaxScaler())
+        self.assertIsNot(next(dataset.createFolds())[0], folds[0][0])
+        self.assertIsNot(dataset.getFeatures()[0], X)
+        folds = list(dataset.createFolds())
+        dataset.restoreTrainingData()
+        self.assertIsNot(next(dataset.createFolds())[0], folds[0][0])
+        self.assertEqual(len(list(dataset.createFolds())), 5)
+
 
 class TestDataFilters(DataSetsMixIn, TestCase):
     """
@@ -642,6 +1031,116 @@ class TestDescriptorCalculation(DataSetsMixIn, TestCase):
             fill_value=np.nan
         )
 
+    def test_parallel(self):
+        calculator = DescriptorsCalculator([FingerprintSet(fingerprint_type="MorganFP", radius=3, nBits=256),
+                                            DrugExPhyschem()])
+        serial = MoleculeTable("test_serial", self.getBigDF(), store_dir=self.qsprdatapath, n_jobs=1)
+        serial.addDescriptors(calculator)
+        self.dataset.addDescriptors(calculator, featurize=False)
+        self.assertListEqual(self.dataset.getDescriptorNames(), serial.getDescriptorNames())
+        self.assertTrue(np.allclose(self.dataset.getDescriptors().values, serial.getDescriptors().values,
+                                    equal_nan=True))
+
+        # the same worker processes are used for all calls
+        executor = self.dataset.workerPool.executor
+        self.dataset.addScaffolds([Murcko()])
+        n_funcs = len(self.dataset.workerPool._funcs)
+        self.dataset.addDescriptors(calculator, recalculate=True, featurize=False)
+        self.assertIs(self.dataset.workerPool.executor, executor)
+        self.assertEqual(len(self.dataset.workerPool._funcs), n_funcs)
+
+    def test_matrix(self):
+        calculator = DescriptorsCalculator([FingerprintSet(fingerprint_type="MorganFP", radius=3, nBits=256),
+                                            DrugExPhyschem()])
+        mols = list(self.dataset.df[self.dataset.smilescol][:20]) + ["not a molecule"]
+        values, codes = calculator.calculateMatrix(mols)
+        self.assertEqual(values.shape, (len(mols), len(calculator.getDescriptorNames())))
+        self.assertEqual(values.dtype, calculator.dtype)
+        self.assertTrue(np.allclose(values, calculator(mols).values, equal_nan=True))
+        self.assertListEqual(codes[:, 0].tolist(), [0] * 20 + [CalculationError.INVALID])
+
+        # the descriptors are added to the data frame as one block
+        self.dataset.addDescriptors(calculator, featurize=False)
+        self.assertListEqual(self.dataset.getDescriptorNames(), calculator.getDescriptorNames())
+        self.assertEqual(len(self.dataset.df), len(self.dataset.getDescriptors()))
+
+    def test_benchmark(self):
+        smiles = get_benchmark_smiles(20)
+        self.assertListEqual(smiles, get_benchmark_smiles(20))
+        self.assertEqual(len(get_benchmark_smiles(500)), 500)
+
+        output = f"{self.qsprdatapath}/benchmark.json"
+        results = run_benchmarks({"DrugExPhyschem": DrugExPhyschem}, sizes=[20], n_cpus=[1, 2], chunk_size=5,
+                                 output=output)
+        self.assertTrue(os.path.exists(output))
+        self.assertListEqual([result["n_cpus"] for result in results["results"]], [1, 2])
+        for result in results["results"]:
+            self.assertNotIn("error", result)
+            self.assertGreater(result["mols_per_sec"], 0)
+        self.assertEqual(results["results"][0]["speedup"], 1)
+
+        comparison = compare_benchmarks(output, results)
+        self.assertEqual(len(comparison), 2)
+        self.assertTrue(np.allclose(comparison["ratio"], 1))
+        self.assertFalse(comparison["regression"].any())
+
+    def test_supervised(self):
+        descset = UnreliableDescriptorSet(hang="c1ccccc1", fail="CCN")
+        calculator = DescriptorsCalculator([descset, DrugExPhyschem()], timeout=2)
+        mols = ["CCO", "c1ccccc1", "CCN", "CC(=O)O", "not a molecule"]
+        start = time.time()
+        values, codes = calculator.calculateWithErrors(mols)
+        self.assertLess(time.time() - start, 30)
+        self.assertListEqual(codes[:, 0].tolist(), [
+            CalculationError.NONE, CalculationError.TIMEOUT, CalculationError.ERROR, CalculationError.NONE,
+            CalculationError.INVALID
+        ])
+        self.assertListEqual(codes[:, 1].tolist(), [0, 0, 0, 0, CalculationError.INVALID])
+        self.assertListEqual(values.iloc[:, 0].tolist()[:1] + values.iloc[:, 0].tolist()[3:4], [3, 4])
+        self.assertTrue(values.iloc[[1, 2, 4], 0].isna().all())
+        self.assertFalse(values.iloc[:4, 1:].isna().any().any())
+
+        # failures are counted per descriptor set and saved in the provenance of the data set
+        calculator.recordFailures(codes)
+        self.assertDictEqual(calculator.failures[str(descset)], {"invalid": 1, "error": 1, "timeout": 1})
+        dataset = MoleculeTable("test_supervised", pd.DataFrame({"SMILES": mols[:4]}), store_dir=self.qsprdatapath,
+                                n_jobs=N_CPU, chunk_size=2)
+        dataset.addDescriptors(calculator)
+        self.assertDictEqual(dataset.descriptorProvenance[str(descset)]["failures"],
+                             {"invalid": 0, "error": 1, "timeout": 1})
+
+    def test_cache(self):
+        descsets = [FingerprintSet(fingerprint_type="MorganFP", radius=3, nBits=256), DrugExPhyschem()]
+        mols = list(self.dataset.df[self.dataset.smilescol])
+        expected = DescriptorsCalculator(descsets)(mols)
+
+        cache = DescriptorCache(f"{self.qsprdatapath}/descriptor_cache.db")
+        calculator = DescriptorsCalculator(descsets, cache=cache)
+        self.assertTrue(calculator(mols).equals(expected))
+        n_cached = len(cache)
+        self.assertEqual(n_cached, len(set(cache.getMolKey(mol) for mol in mols)) * len(descsets))
+
+        # cached molecules are not calculated again
+        keys = [cache.getMolKey(mol) for mol in mols[:10]]
+        for descset in descsets:
+            self.assertEqual(len(cache.get(keys, cache.getDescsetKey(descset))), len(set(keys)))
+        values = DescriptorsCalculator(descsets, cache=cache)(mols[:10])
+        self.assertTrue(np.allclose(values.values, expected.values[:10], equal_nan=True))
+        self.assertEqual(len(cache), n_cached)
+
+        # a selection of fingerprint bits is taken from the cached fingerprints
+        calculator.keepDescriptors(expected.columns[:10:2])
+        values = calculator(mols)
+        self.assertListEqual(values.columns.to_list(), expected.columns[:10:2].to_list())
+        self.assertTrue(np.allclose(values.values, expected[values.columns].values, equal_nan=True))
+        self.assertEqual(len(cache), n_cached)
+
+        # least recently used values are removed beyond the size limit
+        cache.maxSize = cache.getSize() // 2
+        cache.evict()
+        self.assertLessEqual(cache.getSize(), 0.9 * cache.maxSize)
+        self.assertGreater(len(cache), 0)
+
 
 class TestDescriptorsets(DataSetsMixIn, TestCase):
 
@@ -674,13 +1173,82 @@ class TestDescriptorsets(DataSetsMixIn, TestCase):
         self.assertEqual(self.dataset.X.shape, (len(self.dataset), 1000))
         self.assertTrue(self.dataset.X.any().any())
         self.assertTrue(self.dataset.X.any().sum() > 1)
+        self.assertTrue(all(self.dataset.X.dtypes == np.uint8))
+
+        # fingerprints are the same as the bit vectors of the legacy RDKit function
+        mols = [Chem.AddHs(Chem.MolFromSmiles(smiles)) for smiles in self.dataset.df[self.dataset.smilescol]]
+        expected = np.array([list(AllChem.GetMorganFingerprintAsBitVect(mol, 3, nBits=1000)) for mol in mols])
+        self.assertTrue(np.array_equal(self.dataset.getDescriptors().values, expected))
+
+        # bit-packed fingerprints
+        packed = pack_fingerprints(expected)
+        self.assertEqual(packed.shape, (len(mols), 125))
+        self.assertTrue(np.array_equal(unpack_fingerprints(packed, 1000), expected))
+
+    def test_sparse_fingerprints(self):
+        dense = DescriptorsCalculator([FingerprintSet(fingerprint_type="MorganFP", radius=3, nBits=1000)])
+        sparse = DescriptorsCalculator([FingerprintSet(fingerprint_type="MorganFP", radius=3, nBits=1000, sparse=True)])
+        expected = dense(self.dataset.df[self.dataset.smilescol]).values
+        self.dataset.addDescriptors(sparse)
+        self.assertTrue(all(isinstance(dtype, pd.SparseDtype) for dtype in self.dataset.getDescriptors().dtypes))
+        self.assertTrue(np.array_equal(self.dataset.getDescriptors().sparse.to_dense().values, expected))
+
+        # features and folds stay sparse
+        X = self.dataset.getFeatures(concat=True)
+        self.assertTrue(all(isinstance(dtype, pd.SparseDtype) for dtype in X.dtypes))
+        X_train = next(self.dataset.createFolds())[0]
+        self.assertTrue(scipy.sparse.issparse(X_train))
+
+        # sparse feature filters give the same result as the dense ones
+        X, y = self.dataset.X, self.dataset.y
+        X_dense = X.sparse.to_dense()
+        lv = lowVarianceFilter(0.05)
+        self.assertListEqual(lv(X, y).columns.to_list(), lv(X_dense, y).columns.to_list())
+        with np.errstate(divide="ignore", invalid="ignore"):
+            expected = np.corrcoef(X_dense.values.astype(float).T)
+        correlation = highCorrelationFilter.sparseCorrelation(to_matrix(X))
+        self.assertTrue(np.allclose(correlation, expected, equal_nan=True))
+
+        # sparse columns survive storage
+        for store_format in ("pickle", "parquet"):
+            self.dataset.storeFormat = store_format
+            self.dataset.storage = get_storage(store_format, self.dataset.storePrefix)
+            self.dataset.storePath = self.dataset.storage.path
+            self.dataset.save()
+            dataset = QSPRDataset.fromFile(self.dataset.storePath)
+            self.assertTrue(all(isinstance(dtype, pd.SparseDtype) for dtype in dataset.getDescriptors().dtypes))
+            self.assertTrue(dataset.descriptorCalculator.descsets[0].sparse)
 
     def test_TanimotoDistances(self):
         list_of_smiles = ["C", "CC", "CCC", "CCCC", "CCCCC", "CCCCCC", "CCCCCCC"]
-        desc_calc = DescriptorsCalculator(
-            [TanimotoDistances(list_of_smiles=list_of_smiles, fingerprint_type="MorganFP", radius=3, nBits=1000)])
+        descset = TanimotoDistances(list_of_smiles=list_of_smiles, fingerprint_type="MorganFP", radius=3, nBits=1000)
+        desc_calc = DescriptorsCalculator([descset])
         self.dataset.addDescriptors(desc_calc)
 
+        # distances are the same as the ones of RDKit
+        refs = [AllChem.GetMorganFingerprintAsBitVect(Chem.MolFromSmiles(smiles), 3, nBits=1000)
+                for smiles in list_of_smiles]
+        mols = [Chem.MolFromSmiles(smiles) for smiles in self.dataset.df[self.dataset.smilescol]]
+        expected = np.array([DataStructs.BulkTanimotoSimilarity(
+            AllChem.GetMorganFingerprintAsBitVect(mol, 3, nBits=1000), refs) for mol in mols])
+        self.assertTrue(np.allclose(self.dataset.getDescriptors().values, 1 - expected))
+
+        # results do not depend on the method and the block size
+        fps = descset.get_fingerprint(mols)
+        for method in ("popcount", "blas"):
+            index = TanimotoIndex(descset.get_fingerprint([Chem.MolFromSmiles(smiles) for smiles in list_of_smiles]),
+                                  method=method, max_memory=1)
+            self.assertTrue(np.allclose(index.similarity(fps), expected))
+            self.assertTrue(np.allclose(index.similarity(scipy.sparse.csr_matrix(fps)), expected))
+            indices, similarities = index.nearest(fps, k=2)
+            self.assertTrue(np.allclose(similarities, -np.sort(-expected, axis=1)[:, :2]))
+            self.assertTrue(np.allclose(np.take_along_axis(expected, indices, axis=1), similarities))
+
+        # references can be replaced
+        descset.descriptors = list_of_smiles[:3]
+        self.assertEqual(len(descset.index), 3)
+        self.assertEqual(descset(mols).shape, (len(mols), 3))
+
     def test_Mordred(self):
         desc_calc = DescriptorsCalculator([Mordred()])
         self.dataset.addDescriptors(desc_calc)
@@ -691,6 +1259,15 @@ class TestDescriptorsets(DataSetsMixIn, TestCase):
         self.assertTrue(self.dataset.X.any().any())
         self.assertTrue(self.dataset.X.any().sum() > 1)
 
+        # a trimmed set calculates the same values in the order of its names, also with several processes
+        names = ["SLogP", "ABC", "nAcid"]
+        mols = self.dataset.df[self.dataset.smilescol]
+        for n_jobs in (1, 2):
+            values = Mordred(descs=names, n_jobs=n_jobs)(mols)
+            self.assertTrue(np.allclose(
+                values.astype(float), self.dataset.X[[f"Descriptor_Mordred_{name}" for name in names]].values,
+                equal_nan=True))
+
     def test_Mold2(self):
         desc_calc = DescriptorsCalculator([Mold2()])
         self.dataset.addDescriptors(desc_calc)
@@ -733,6 +1310,63 @@ class TestDescriptorsets(DataSetsMixIn, TestCase):
         self.assertTrue(dataset.X.any().any())
         self.assertTrue(dataset.X.any().sum() > 1)
 
+    @parameterized.expand([
+        ("MorganCountFP", {"radius": 3, "nBits": 1024}),
+        ("FeatureMorganCountFP", {"radius": 2, "nBits": 512}),
+        ("AtomPairCountFP", {"maxDistance": 10, "nBits": 2048}),
+        ("TopologicalTorsionCountFP", {"nBits": 256}),
+    ])
+    def test_count_fingerprints(self, fp_type, settings):
+        descset = FingerprintSet(fingerprint_type=fp_type, **settings)
+        self.assertEqual(descset.dtype, np.uint16)
+        mols = [Chem.AddHs(Chem.MolFromSmiles(smiles)) for smiles in self.dataset.df[self.dataset.smilescol]]
+        fps = descset.get_fingerprint(mols)
+        self.assertEqual(fps.shape, (len(mols), settings["nBits"]))
+        self.assertEqual(fps.dtype, np.uint16)
+        self.assertTrue((fps > 1).any())
+        self.assertTrue(np.array_equal(descset.get_fingerprint.getSparseFingerprints(mols).toarray(), fps))
+
+        # counts of the unfolded features are summed in the folded columns
+        elements = descset.get_fingerprint.generator.GetSparseCountFingerprint(mols[0]).GetNonzeroElements()
+        expected = np.zeros(settings["nBits"], dtype=np.int64)
+        for key, count in elements.items():
+            expected[key % settings["nBits"]] += count
+        self.assertTrue(np.array_equal(fps[0], expected))
+
+        # the fingerprint settings are saved with the calculator
+        desc_calc = DescriptorsCalculator([descset])
+        self.dataset.addDescriptors(desc_calc)
+        self.assertEqual(self.dataset.X.shape, (len(self.dataset), settings["nBits"]))
+        desc_calc.toFile(f"{self.qsprdatapath}/test_calc.json")
+        loaded = DescriptorsCalculator.fromFile(f"{self.qsprdatapath}/test_calc.json")
+        self.assertDictEqual(loaded.descsets[0].settings, descset.settings)
+        self.assertTrue(np.array_equal(loaded(mols).values, desc_calc(mols).values))
+
+    def test_isolated_failures(self):
+        mols = [Chem.MolFromSmiles(smiles) for smiles in self.dataset.df[self.dataset.smilescol]]
+        bad = mols[3]
+        mols[5] = None
+
+        def calculate(batch):
+            if any(mol is bad for mol in batch):
+                raise RuntimeError("external program failed")
+            return np.array([[mol.GetNumAtoms(), 1] for mol in batch])
+
+        values = calculate_isolated(calculate, mols, 2, batch_size=4)
+        self.assertEqual(values.shape, (len(mols), 2))
+        self.assertTrue(np.isnan(values[[3, 5]]).all())
+        valid = [idx for idx in range(len(mols)) if idx not in (3, 5)]
+        self.assertTrue(np.array_equal(values[valid, 0], [mols[idx].GetNumAtoms() for idx in valid]))
+
+        # sets that call external programs are calculated in larger chunks, but all workers still get one
+        calculator = DescriptorsCalculator([PaDEL(), rdkit_descs()])
+        self.assertEqual(calculator.batchSize, PaDEL.batchSize)
+        self.dataset.nJobs = 2
+        self.assertEqual(self.dataset.getDescriptorChunkSize(calculator, 10000), PaDEL.batchSize)
+        self.assertEqual(self.dataset.getDescriptorChunkSize(calculator, 200), max(self.dataset.chunkSize, 100))
+        self.assertEqual(
+            self.dataset.getDescriptorChunkSize(DescriptorsCalculator([rdkit_descs()]), 10000), self.dataset.chunkSize)
+
     def test_DrugExPhyschem(self):
         desc_calc = DescriptorsCalculator([DrugExPhyschem()])
         self.dataset.addDescriptors(desc_calc)
@@ -753,6 +1387,22 @@ class TestDescriptorsets(DataSetsMixIn, TestCase):
         desc_calc = DescriptorsCalculator([rdkit_descs(compute_3Drdkit=True)])
         self.dataset.addDescriptors(desc_calc, recalculate=True)
         self.assertEqual(self.dataset.X.shape, (len(self.dataset), len(Descriptors._descList) + 10))
+        descriptors_3d = [f"Descriptor_RDkit_{name}" for name in ("NPR1", "RadiusOfGyration")]
+        self.assertTrue(self.dataset.getDescriptors()[descriptors_3d].notna().all().all())
+
+        # a trimmed calculator only calculates the kept descriptors and gives the same values
+        full = self.dataset.getDescriptors()
+        kept = ["Descriptor_RDkit_MolLogP", "Descriptor_RDkit_TPSA", "Descriptor_RDkit_NPR1"]
+        desc_calc.keepDescriptors(kept)
+        self.assertEqual(len(desc_calc.descsets[0]._calculator._functions), len(kept))
+        trimmed = desc_calc(self.dataset.df[self.dataset.smilescol])
+        self.assertListEqual(trimmed.columns.to_list(), kept)
+        self.assertTrue(np.allclose(trimmed.values, full[kept].values, equal_nan=True))
+
+        # the settings of the set can be saved and loaded without duplicating the 3D descriptors
+        desc_calc.toFile(f"{self.qsprdatapath}/test_calc.json")
+        self.assertListEqual(DescriptorsCalculator.fromFile(f"{self.qsprdatapath}/test_calc.json").getDescriptorNames(),
+                             kept)
 
 
 class TestScaffolds(DataSetsMixIn, TestCase):
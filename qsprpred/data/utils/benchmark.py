@@ -0,0 +1,258 @@
+"""Benchmarks of the descriptor calculation throughput.
+
+Descriptor sets and calculators are run on fixed sets of molecules sampled from the bundled test data. Each case
+is run in a fresh process so that its peak memory use can be measured, and the descriptors are calculated with
+`MoleculeTable.papply` for an increasing number of worker processes to measure the scaling with the number of cores.
+Results are saved as JSON files that can be compared between runs with `compare_benchmarks`.
+"""
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Sequence, Union
+
+import numpy as np
+import pandas as pd
+import rdkit
+from qsprpred import VERSION
+from qsprpred.data.data import MoleculeTable
+from qsprpred.data.utils.descriptorcalculator import DescriptorsCalculator
+from qsprpred.data.utils.descriptorsets import (
+    DescriptorSet,
+    DrugExPhyschem,
+    FingerprintSet,
+    Mold2,
+    Mordred,
+    PaDEL,
+    PredictorDesc,
+    TanimotoDistances,
+    rdkit_descs,
+)
+from qsprpred.data.utils.descriptor_utils.fingerprints import _FingerprintRetriever
+from qsprpred.logs import logger
+from rdkit import Chem
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+BENCHMARK_SIZES = (1000, 10000, 100000)
+BENCHMARK_DATA = f"{os.path.dirname(__file__)}/../test_files/data/test_data_large.tsv"
+BENCHMARK_PREDICTOR = (
+    f"{os.path.dirname(__file__)}/../test_files/test_predictor/qspr/models/SVC_CLASSIFICATION/"
+    "SVC_CLASSIFICATION_meta.json"
+)
+
+
+def get_benchmark_smiles(n_mols: int, seed: int = 42, path: str = BENCHMARK_DATA,
+                         smilescol: str = "SMILES") -> List[str]:
+    """Get a fixed set of valid SMILES sampled from the bundled test data. Molecules are sampled with replacement
+    if more molecules are requested than the data contains.
+
+    Args:
+        n_mols (int): number of molecules
+        seed (int): random seed of the sample, the same seed always gives the same molecules
+        path (str): tab separated file with the molecules
+        smilescol (str): name of the column with the SMILES
+
+    Returns:
+        list: canonical SMILES
+    """
+    smiles = pd.read_table(path)[smilescol].dropna()
+    mols = [Chem.MolFromSmiles(smi) for smi in smiles]
+    smiles = [Chem.MolToSmiles(mol) for mol in mols if mol is not None]
+    rng = np.random.default_rng(seed)
+    indices = rng.choice(len(smiles), size=n_mols, replace=n_mols > len(smiles))
+    return [smiles[idx] for idx in indices]
+
+
+def get_benchmark_descsets() -> Dict[str, Callable[[], DescriptorSet]]:
+    """Get the descriptor sets that are benchmarked by default, one for each fingerprint type.
+
+    Returns:
+        dict: functions that create the descriptor sets by the name of the benchmark
+    """
+    descsets = {
+        f"FingerprintSet_{name[len('get_'):]}":
+            (lambda fp_type=name[len('get_'):]: FingerprintSet(fingerprint_type=fp_type))
+        for name in dir(_FingerprintRetriever) if name.startswith("get_") and name != "get_fingerprint"
+    }
+    descsets.update({
+        "rdkit_descs": rdkit_descs,
+        "DrugExPhyschem": DrugExPhyschem,
+        "Mordred": Mordred,
+        "Mold2": Mold2,
+        "PaDEL": PaDEL,
+        "TanimotoDistances": lambda: TanimotoDistances(
+            list_of_smiles=get_benchmark_smiles(100, seed=0), fingerprint_type="MorganFP", radius=3, nBits=2048),
+        "PredictorDesc": lambda: PredictorDesc(BENCHMARK_PREDICTOR),
+        "DescriptorsCalculator": lambda: DescriptorsCalculator(
+            [FingerprintSet(fingerprint_type="MorganFP", radius=3, nBits=2048), DrugExPhyschem(), rdkit_descs()]),
+    })
+    return descsets
+
+
+def peak_rss() -> Optional[int]:
+    """Get the peak resident set size of the current process and of its terminated child processes.
+
+    Returns:
+        int: the largest peak of a single process in bytes, `None` if it cannot be measured on this platform
+    """
+    if resource is None:
+        return None
+    peak = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    )
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _calculate(mols: pd.Series, calculator: Union[DescriptorSet, DescriptorsCalculator]):
+    """Calculate the descriptors of a chunk of molecules in a worker process."""
+    return calculator(list(mols))
+
+
+def _benchmark_process(conn, calculator, smiles: List[str], n_cpus: Sequence[int], chunk_size: int):
+    """Run the benchmark of one calculator and set of molecules and send the results to the parent process."""
+    try:
+        results = []
+        with tempfile.TemporaryDirectory() as store_dir:
+            table = MoleculeTable(
+                "benchmark", pd.DataFrame({"SMILES": smiles}), store_dir=store_dir, drop_invalids=False)
+            for n in n_cpus:
+                # the first chunk starts the workers and prepares the calculator (i.e. loads models or Java)
+                table.papply(_calculate, func_args=(calculator,), subset=["SMILES"], result_type="reduce",
+                             n_cpus=n, chunk_size=chunk_size, index=table.df.index[:chunk_size])
+                start = time.perf_counter()
+                table.papply(_calculate, func_args=(calculator,), subset=["SMILES"], result_type="reduce",
+                             n_cpus=n, chunk_size=chunk_size)
+                seconds = time.perf_counter() - start
+                table.getWorkerPool(n).shutdown()
+                table.workerPool = None
+                results.append({
+                    "n_cpus": n,
+                    "seconds": seconds,
+                    "mols_per_sec": len(smiles) / seconds,
+                    "peak_rss": peak_rss(),
+                })
+        conn.send(("ok", results))
+    except Exception as exp:
+        conn.send(("error", repr(exp)))
+    finally:
+        conn.close()
+
+
+def benchmark_calculator(calculator: Union[DescriptorSet, DescriptorsCalculator], smiles: List[str],
+                         n_cpus: Sequence[int] = (1,), chunk_size: int = 1000) -> List[dict]:
+    """Measure the throughput of a descriptor set or calculator.
+
+    The benchmark runs in a new process and the descriptors are calculated by `MoleculeTable.papply` in chunks of
+    molecules, after a first chunk that starts the worker processes and is not timed.
+
+    Args:
+        calculator (DescriptorSet, DescriptorsCalculator): the benchmarked calculator
+        smiles (list): the molecules
+        n_cpus (list): numbers of worker processes to run the benchmark with
+        chunk_size (int): number of molecules per chunk
+
+    Returns:
+        list: one result per number of worker processes with the time (`seconds`), the throughput (`mols_per_sec`),
+            the peak memory use of the largest process in bytes (`peak_rss`) and the speedup over the first number
+            of worker processes (`speedup`)
+    """
+    conn, child_conn = multiprocessing.Pipe()
+    process = multiprocessing.Process(
+        target=_benchmark_process, args=(child_conn, calculator, smiles, list(n_cpus), chunk_size))
+    process.start()
+    child_conn.close()
+    try:
+        status, payload = conn.recv()
+    except EOFError:
+        status, payload = "error", f"benchmark process exited with code {process.exitcode}"
+    process.join()
+    if status != "ok":
+        raise RuntimeError(f"Benchmark of {calculator} failed: {payload}")
+    for result in payload:
+        result["speedup"] = payload[0]["seconds"] / result["seconds"]
+    return payload
+
+
+def run_benchmarks(descsets: Dict[str, Callable[[], Union[DescriptorSet, DescriptorsCalculator]]] = None,
+                   sizes: Sequence[int] = BENCHMARK_SIZES, n_cpus: Sequence[int] = None, chunk_size: int = 1000,
+                   output: str = None) -> dict:
+    """Benchmark descriptor sets on sets of molecules of different sizes.
+
+    Args:
+        descsets (dict): functions that create the benchmarked calculators by name, `get_benchmark_descsets` by
+            default
+        sizes (list): numbers of molecules
+        n_cpus (list): numbers of worker processes, powers of two up to the number of cores by default
+        chunk_size (int): number of molecules per chunk
+        output (str): path of a JSON file to save the results to
+
+    Returns:
+        dict: the environment of the run (`meta`) and the results of each case (`results`), failed cases have an
+            `error` entry instead of measurements
+    """
+    descsets = descsets if descsets is not None else get_benchmark_descsets()
+    if n_cpus is None:
+        n_cpus = [2 ** i for i in range(int(np.log2(os.cpu_count())) + 1)]
+    ret = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(),
+            "qsprpred": VERSION,
+            "rdkit": rdkit.__version__,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "chunk_size": chunk_size,
+        },
+        "results": [],
+    }
+    for size in sizes:
+        smiles = get_benchmark_smiles(size)
+        for name, create in descsets.items():
+            case = {"name": name, "n_mols": size}
+            try:
+                for result in benchmark_calculator(create(), smiles, n_cpus, chunk_size):
+                    ret["results"].append({**case, **result})
+                    logger.info(f"Benchmark {name} ({size} molecules, {result['n_cpus']} CPUs): "
+                                f"{result['mols_per_sec']:.1f} molecules/s")
+            except Exception as exp:
+                logger.warning(f"Benchmark {name} ({size} molecules) failed: {exp}")
+                ret["results"].append({**case, "error": str(exp)})
+    if output is not None:
+        with open(output, "w") as fh:
+            json.dump(ret, fh, indent=4)
+    return ret
+
+
+def compare_benchmarks(baseline: Union[str, dict], current: Union[str, dict], tolerance: float = 0.1) -> pd.DataFrame:
+    """Compare the throughput of two benchmark runs.
+
+    Args:
+        baseline (str, dict): results of the reference run or path to their JSON file
+        current (str, dict): results of the new run or path to their JSON file
+        tolerance (float): relative loss of throughput that is still not considered a regression
+
+    Returns:
+        pd.DataFrame: throughput and peak memory use of the cases found in both runs, with the ratio of the
+            throughputs (`ratio`, current / baseline) and whether the case regressed (`regression`)
+    """
+    runs = []
+    for run in (baseline, current):
+        if isinstance(run, str):
+            with open(run) as fh:
+                run = json.load(fh)
+        df = pd.DataFrame([result for result in run["results"] if "error" not in result])
+        runs.append(df.set_index(["name", "n_mols", "n_cpus"])[["mols_per_sec", "peak_rss"]])
+    ret = runs[0].join(runs[1], how="inner", lsuffix="_baseline", rsuffix="_current")
+    ret["ratio"] = ret["mols_per_sec_current"] / ret["mols_per_sec_baseline"]
+    ret["regression"] = ret["ratio"] < 1 - tolerance
+    return ret
@@ -0,0 +1,294 @@
+"""Persistent cache of calculated descriptor values shared between data sets and models."""
+import copy
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from typing import Callable, Dict, List, Optional, Union
+
+import numpy as np
+import pandas as pd
+import rdkit
+from qsprpred import VERSION
+from qsprpred.data.utils.molecules import to_mol
+from qsprpred.logs import logger
+from rdkit import Chem
+from rdkit.Chem import Mol
+
+
+class DescriptorCache:
+    """Content-addressed cache of descriptor values backed by an SQLite database.
+
+    Values are stored per molecule and descriptor set. Molecules are identified by their canonical SMILES or InChIKey
+    and descriptor sets by a hash of their name, settings, selected descriptors and the versions of QSPRpred and
+    RDKit. Sets that always calculate all values and only keep a selection of them (`keepindices`, i.e. fingerprints
+    and Mold2) store all values, so that data sets with different selections share the cached values. Only cache
+    misses are passed to the descriptor set for calculation. The least recently used entries are removed once the
+    cache grows beyond `max_size`.
+
+    The database connection is opened lazily in each process so the cache can be shipped to worker processes
+    together with the `DescriptorsCalculator` that uses it.
+
+    Attributes:
+        path (str): path to the SQLite database
+        maxSize (int): maximum size of the stored values in bytes, no limit if `None`
+        keyType (str): molecule identifier, either 'smiles' (canonical SMILES) or 'inchikey'
+    """
+
+    batchSize = 500  # number of keys queried at once
+
+    def __init__(self, path: str, max_size: Optional[int] = None, key_type: str = "smiles"):
+        """Initialize the cache. The database is created if it does not exist.
+
+        Args:
+            path (str): path to the SQLite database
+            max_size (int): maximum size of the stored values in bytes, no limit if `None`
+            key_type (str): molecule identifier, either 'smiles' (canonical SMILES) or 'inchikey'
+        """
+        if key_type not in ("smiles", "inchikey"):
+            raise ValueError(f"Unknown key type: {key_type}. Use 'smiles' or 'inchikey'.")
+        self.path = path
+        self.maxSize = max_size
+        self.keyType = key_type
+        self._connection = None
+        self._size = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_connection"] = None
+        state["_size"] = None
+        return state
+
+    def __str__(self):
+        return f"{self.__class__.__name__}({self.path})"
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """Connection to the database of this process."""
+        if self._connection is None:
+            dirname = os.path.dirname(self.path)
+            if dirname and not os.path.exists(dirname):
+                os.makedirs(dirname)
+            self._connection = sqlite3.connect(self.path, timeout=60)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS descriptors ("
+                "mol TEXT NOT NULL, descset TEXT NOT NULL, dtype TEXT NOT NULL, value BLOB NOT NULL, "
+                "size INTEGER NOT NULL, accessed REAL NOT NULL, PRIMARY KEY (mol, descset))"
+            )
+            self._connection.execute("CREATE INDEX IF NOT EXISTS idx_accessed ON descriptors (accessed)")
+            self._connection.commit()
+        return self._connection
+
+    def close(self):
+        """Close the database connection of this process."""
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    @staticmethod
+    def getUntrimmed(descset) -> tuple:
+        """Get the descriptor set that calculates all values of a set that only keeps a selection of them.
+
+        Args:
+            descset (DescriptorSet): the descriptor set
+
+        Returns:
+            tuple: the set without selection and the indices of the kept values, the set itself and `None` if it
+                does not select values from a full calculation (no `keepindices`)
+        """
+        keep = getattr(descset, "keepindices", None)
+        if keep is None:
+            return descset, None
+        untrimmed = copy.copy(descset)
+        if untrimmed.is_fp:
+            untrimmed.keepindices = None
+        else:
+            untrimmed.descriptors = None
+        return untrimmed, keep
+
+    @staticmethod
+    def getDescsetKey(descset) -> str:
+        """Get the key identifying the values calculated by a descriptor set.
+
+        Args:
+            descset (DescriptorSet): the descriptor set
+
+        Returns:
+            str: hash of the name, settings and descriptors of the set and the library versions, sets that select
+                values from a full calculation are identified by the set without selection (see `getUntrimmed`)
+        """
+        descset, _ = DescriptorCache.getUntrimmed(descset)
+        content = json.dumps({
+            "descset": str(descset),
+            "settings": descset.settings,
+            "descriptors": list(descset.descriptors),
+            "qsprpred": VERSION,
+            "rdkit": rdkit.__version__,
+        }, sort_keys=True, default=str)
+        return hashlib.sha1(content.encode()).hexdigest()
+
+    def getMolKey(self, mol: Union[str, bytes, Mol]) -> Optional[str]:
+        """Get the key identifying a molecule.
+
+        Args:
+            mol (str, bytes, Mol): SMILES, binary molecule or RDKit molecule
+
+        Returns:
+            str: canonical SMILES or InChIKey of the molecule, `None` if the molecule is invalid
+        """
+        mol = to_mol(mol)
+        if mol is None:
+            return None
+        key = Chem.MolToSmiles(mol) if self.keyType == "smiles" else Chem.MolToInchiKey(mol)
+        return key if key else None
+
+    def get(self, keys: List[str], descset_key: str) -> Dict[str, np.ndarray]:
+        """Get cached values.
+
+        Args:
+            keys (list): molecule keys
+            descset_key (str): descriptor set key
+
+        Returns:
+            dict: values of the found molecules by molecule key
+        """
+        found = {}
+        keys = list(set(keys))
+        for i in range(0, len(keys), self.batchSize):
+            batch = keys[i:i + self.batchSize]
+            rows = self.connection.execute(
+                f"SELECT mol, dtype, value FROM descriptors WHERE descset = ? AND mol IN ({','.join('?' * len(batch))})",
+                [descset_key, *batch]
+            ).fetchall()
+            for mol, dtype, value in rows:
+                found[mol] = np.frombuffer(value, dtype=np.dtype(dtype))
+        if found:
+            now = time.time()
+            self.connection.executemany(
+                "UPDATE descriptors SET accessed = ? WHERE mol = ? AND descset = ?",
+                [(now, mol, descset_key) for mol in found]
+            )
+            self.connection.commit()
+        return found
+
+    def put(self, values: Dict[str, np.ndarray], descset_key: str):
+        """Store values in the cache.
+
+        Args:
+            values (dict): values to store by molecule key
+            descset_key (str): descriptor set key
+        """
+        if not values:
+            return
+        now = time.time()
+        rows = []
+        for mol, value in values.items():
+            value = np.ascontiguousarray(value)
+            rows.append((mol, descset_key, value.dtype.str, value.tobytes(), value.nbytes, now))
+        self.connection.executemany("INSERT OR REPLACE INTO descriptors VALUES (?, ?, ?, ?, ?, ?)", rows)
+        self.connection.commit()
+        if self.maxSize is not None:
+            self._size = (self._size if self._size is not None else self.getSize()) + sum(row[4] for row in rows)
+            if self._size > self.maxSize:
+                self.evict()
+
+    def getSize(self) -> int:
+        """Get the total size of the cached values.
+
+        Returns:
+            int: size in bytes
+        """
+        return self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM descriptors").fetchone()[0]
+
+    def evict(self, target_size: int = None):
+        """Remove least recently used values until the size of the cache drops below the target size.
+
+        Args:
+            target_size (int): size in bytes to shrink the cache to, 90% of `maxSize` by default
+        """
+        target_size = int(0.9 * self.maxSize) if target_size is None else target_size
+        size = self.getSize()
+        removed = 0
+        while size > target_size:
+            rows = self.connection.execute(
+                "SELECT rowid, size FROM descriptors ORDER BY accessed LIMIT ?", (self.batchSize,)
+            ).fetchall()
+            if not rows:
+                break
+            to_remove = []
+            for rowid, row_size in rows:
+                to_remove.append((rowid,))
+                size -= row_size
+                if size <= target_size:
+                    break
+            self.connection.executemany("DELETE FROM descriptors WHERE rowid = ?", to_remove)
+            removed += len(to_remove)
+        self.connection.commit()
+        self._size = size
+        logger.debug(f"Removed {removed} entries from descriptor cache: {self.path}")
+
+    def clear(self):
+        """Remove all values from the cache."""
+        self.connection.execute("DELETE FROM descriptors")
+        self.connection.commit()
+        self._size = 0
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM descriptors").fetchone()[0]
+
+    def calculate(self, descset, mols: List[Union[str, bytes, Mol]], func: Callable = None) -> np.ndarray:
+        """Calculate descriptors with a descriptor set, but only for molecules that are not cached yet. Molecules
+        for which all values failed to calculate (`NaN`) are not cached.
+
+        Args:
+            descset (DescriptorSet): the descriptor set
+            mols (list): molecules as SMILES, binary molecules or RDKit molecules
+            func (callable): calculates the values of a descriptor set, called with the set and a list of the given
+                molecules instead of calling the descriptor set directly (i.e. a supervised calculation)
+
+        Returns:
+            np.ndarray: descriptor values of shape (n_mols, n_descriptors)
+        """
+        mols = list(mols)
+        func = func if func is not None else lambda calc_descset, calc_mols: calc_descset(calc_mols)
+        if not descset.cacheable:
+            return func(descset, mols)
+
+        # all values of sets that select from a full calculation are cached and the selection is taken afterwards
+        descset, keep = self.getUntrimmed(descset)
+        descset_key = self.getDescsetKey(descset)
+        keys = [self.getMolKey(mol) for mol in mols]
+        cached = self.get([key for key in keys if key is not None], descset_key)
+        missing = [idx for idx, key in enumerate(keys) if key not in cached]
+
+        calculated = None
+        if missing:
+            calculated = np.asarray(func(descset, [mols[idx] for idx in missing]))
+            # errors are replaced by nan values like in the calculator, numeric values are used as they are
+            if calculated.dtype == object:
+                calculated = pd.DataFrame(calculated).apply(pd.to_numeric, errors='coerce').values
+            if calculated.shape[1] > 0:
+                failed = np.isnan(calculated.astype(np.float64)).all(axis=1)
+            else:
+                failed = np.zeros(len(missing), dtype=bool)
+            self.put({
+                keys[idx]: calculated[row] for row, idx in enumerate(missing)
+                if keys[idx] is not None and not failed[row]
+            }, descset_key)
+        logger.debug(f"Descriptor cache hits for {descset}: {len(mols) - len(missing)}/{len(mols)}")
+
+        blocks = list(cached.values()) + ([calculated] if calculated is not None else [])
+        if not blocks:
+            return np.empty((0, descset.get_len() if keep is None else len(keep)))
+        ret = np.empty(
+            (len(mols), blocks[-1].shape[-1]),
+            dtype=np.result_type(*[block.dtype for block in blocks])
+        )
+        for idx, key in enumerate(keys):
+            if key in cached:
+                ret[idx] = cached[key]
+        if calculated is not None:
+            ret[missing] = calculated
+        return ret if keep is None else ret[:, keep]
@@ -39,8 +39,9 @@ class Property(Scorer):
             for j, prop in enumerate(self.props):
                 try:
                     scores[i, j] = self.prop_dict[prop](mol)
-                except:
-                    continue
+                except Exception:
+                    # failed properties are missing values instead of zeros
+                    scores[i, j] = np.nan
         return scores
 
     def getKey(self):
@@ -0,0 +1,69 @@
+"""Helpers for descriptors and fingerprints calculated by external programs (i.e. PaDEL/CDK and Mold2).
+
+The wrappers of these programs start a new Java virtual machine or executable for every call. Descriptor sets
+based on them therefore calculate large batches of molecules at once (see `DescriptorSet.batchSize`) and use
+`calculate_isolated` so that a molecule that makes the program fail does not cost the values of the whole batch.
+"""
+from typing import Callable, List
+
+import numpy as np
+import pandas as pd
+from qsprpred.logs import logger
+from rdkit.Chem import Mol
+
+
+def calculate_isolated(calculate: Callable, mols: List[Mol], n_cols: int, batch_size: int = None,
+                       name: str = None) -> np.ndarray:
+    """Calculate the values for batches of molecules and isolate the molecules on which the calculation fails.
+
+    If the calculation of a batch fails (it raises an exception or does not return one row per molecule),
+    the batch is split in halves that are calculated separately until the failing molecules are found. Values of
+    failing and missing (`None`) molecules are `NaN`.
+
+    Args:
+        calculate (callable): calculates the values for a list of molecules, returns an array-like or data frame
+            of shape (n_mols, n_cols)
+        mols (list): the RDKit molecules, `None` for missing molecules
+        n_cols (int): number of values calculated per molecule
+        batch_size (int): maximum number of molecules passed to `calculate` at once, all molecules if `None`
+        name (str): name of the calculated descriptors used in log messages
+
+    Returns:
+        np.ndarray: the values of shape (n_mols, n_cols)
+    """
+    ret = np.full((len(mols), n_cols), np.nan)
+    valid = [idx for idx, mol in enumerate(mols) if mol is not None]
+    batch_size = batch_size if batch_size else max(1, len(valid))
+    n_failed = 0
+    for start in range(0, len(valid), batch_size):
+        n_failed += _calculate_split(calculate, mols, valid[start:start + batch_size], ret)
+    if n_failed > 0:
+        logger.warning(f"Calculation of {name or 'descriptors'} failed for {n_failed} of {len(mols)} molecules.")
+    return ret
+
+
+def _calculate_split(calculate: Callable, mols: List[Mol], indices: List[int], out: np.ndarray) -> int:
+    """Calculate the values of the molecules at the given indices and write them to the output matrix,
+    splitting the molecules in halves on failure.
+
+    Returns:
+        int: number of molecules for which the calculation failed
+    """
+    if not indices:
+        return 0
+    try:
+        values = calculate([mols[idx] for idx in indices])
+        if isinstance(values, pd.DataFrame):
+            values = values.apply(pd.to_numeric, errors="coerce").values
+        values = np.asarray(values, dtype=np.float64)
+        if values.shape != (len(indices), out.shape[1]):
+            raise ValueError(f"Expected values of shape {(len(indices), out.shape[1])}, got {values.shape}.")
+        out[indices] = values
+        return 0
+    except Exception as exp:
+        if len(indices) == 1:
+            logger.debug(f"Calculation failed for molecule {indices[0]} of the batch: {exp}")
+            return 1
+        half = len(indices) // 2
+        return (_calculate_split(calculate, mols, indices[:half], out)
+                + _calculate_split(calculate, mols, indices[half:], out))
@@ -3,14 +3,21 @@
 from abc import ABC, abstractmethod
 
 import numpy as np
-from rdkit import DataStructs
-from rdkit.Chem import AllChem
+from rdkit.Chem import rdFingerprintGenerator
+from scipy import sparse
 from PaDEL_pywrapper import PaDEL as PaDEL_calculator
 import PaDEL_pywrapper.descriptor as cdk_fps
+from qsprpred.data.utils.descriptor_utils.external import calculate_isolated
 
 
 class fingerprint(ABC):
-    """Base class for fingerprints."""
+    """Base class for fingerprints.
+
+    Attributes:
+        dtype (np.dtype): data type of the calculated fingerprints
+    """
+
+    dtype = np.float64
 
     def __call__(self, mols):
         """Actual call method.
@@ -23,6 +30,17 @@ class fingerprint(ABC):
         """
         return self.getFingerprints(mols)
 
+    def getSparseFingerprints(self, mols):
+        """Return the fingerprints for the input molecules as a sparse matrix.
+
+        Args:
+            mols: molecules to obtain the fingerprints of
+
+        Returns:
+            fingerprint (sparse.csr_matrix): fingerprints of "mols" of shape (n_mols, len(self))
+        """
+        return sparse.csr_matrix(self.getFingerprints(mols))
+
     @abstractmethod
     def settings(self):
         """Return settings of fingerprint."""
@@ -40,11 +58,31 @@ class fingerprint(ABC):
 
 
 class MorganFP(fingerprint):
-    """Morgan fingerprint."""
+    """Morgan fingerprint.
+
+    Fingerprints are calculated with an RDKit fingerprint generator that is created once per process and written
+    directly into a preallocated `uint8` array (one byte per bit instead of the eight bytes of `float64`).
+    """
+
+    dtype = np.uint8
 
     def __init__(self, radius=2, nBits=2048):
         self.radius = radius
         self.nBits = nBits
+        self._generator = None
+
+    def __getstate__(self):
+        # RDKit fingerprint generators cannot be pickled, they are created again when needed
+        state = self.__dict__.copy()
+        state["_generator"] = None
+        return state
+
+    @property
+    def generator(self):
+        """The RDKit Morgan fingerprint generator with the settings of this fingerprint."""
+        if self._generator is None:
+            self._generator = rdFingerprintGenerator.GetMorganGenerator(radius=self.radius, fpSize=self.nBits)
+        return self._generator
 
     def getFingerprints(self, mols):
         """Return the Morgan fingerprints for the input molecules.
@@ -53,19 +91,33 @@ class MorganFP(fingerprint):
             mols: molecules to obtain the fingerprint of
 
         Returns:
-            fingerprint (list): `list` of fingerprints for "mols"
+            fingerprint (np.ndarray): `uint8` array of shape (n_mols, nBits) with the fingerprints of "mols"
         """
-        convertFP = DataStructs.ConvertToNumpyArray
-
-        ret = np.zeros((len(mols), len(self)))
+        generator = self.generator
+        ret = np.zeros((len(mols), len(self)), dtype=np.uint8)
         for idx, mol in enumerate(mols):
-            fp = AllChem.GetMorganFingerprintAsBitVect(mol, self.radius, nBits=self.nBits)
-            np_fp = np.zeros(len(fp))
-            convertFP(fp, np_fp)
-            ret[idx] = np_fp
+            ret[idx] = generator.GetFingerprintAsNumPy(mol)
 
         return ret
 
+    def getSparseFingerprints(self, mols):
+        """Return the Morgan fingerprints for the input molecules as a sparse matrix built from the on bits
+        without creating the dense fingerprints.
+
+        Args:
+            mols: molecules to obtain the fingerprint of
+
+        Returns:
+            fingerprint (sparse.csr_matrix): `uint8` matrix of shape (n_mols, nBits) with the fingerprints of "mols"
+        """
+        generator = self.generator
+        bits = [list(generator.GetFingerprint(mol).GetOnBits()) for mol in mols]
+        indptr = np.zeros(len(mols) + 1, dtype=np.int64)
+        np.cumsum([len(on) for on in bits], out=indptr[1:])
+        indices = np.fromiter((bit for on in bits for bit in on), dtype=np.int32, count=indptr[-1])
+        data = np.ones(len(indices), dtype=np.uint8)
+        return sparse.csr_matrix((data, indices, indptr), shape=(len(mols), len(self)))
+
     @property
     def settings(self):
         return {"radius": self.radius, "nBits": self.nBits}
@@ -77,55 +129,201 @@ class MorganFP(fingerprint):
         return "MorganFP"
 
 
-class CDKFP(fingerprint):
-    """CDK fingerprint."""
+class CountFingerprint(fingerprint):
+    """Base class for count fingerprints calculated natively with RDKit fingerprint generators.
 
-    def __init__(self, size=1024, searchDepth=7):
-        self.size = size
-        self.searchDepth = searchDepth
-        fp = cdk_fps.FP(size=size, searchDepth=searchDepth)
-        self._padel = PaDEL_calculator([fp])
+    The features of each molecule are hashed without folding (sparse count fingerprints) and folded to `nBits`
+    columns when the fingerprints are built, the counts of features that fold to the same column are summed.
+    Counts are stored as `uint16` and larger counts are clipped to the largest `uint16` value.
+
+    Attributes:
+        nBits (int): number of columns the hashed features are folded to
+    """
+
+    dtype = np.uint16
+
+    def __init__(self, nBits=2048):
+        self.nBits = nBits
+        self._generator = None
+
+    def __getstate__(self):
+        # RDKit fingerprint generators cannot be pickled, they are created again when needed
+        state = self.__dict__.copy()
+        state["_generator"] = None
+        return state
+
+    @property
+    def generator(self):
+        """The RDKit fingerprint generator with the settings of this fingerprint."""
+        if self._generator is None:
+            self._generator = self._createGenerator()
+        return self._generator
+
+    @abstractmethod
+    def _createGenerator(self):
+        """Create the RDKit fingerprint generator."""
+        pass
+
+    def getSparseFingerprints(self, mols):
+        """Return the folded count fingerprints for the input molecules as a sparse matrix.
+
+        Args:
+            mols: molecules to obtain the fingerprint of
+
+        Returns:
+            fingerprint (sparse.csr_matrix): `uint16` matrix of shape (n_mols, nBits) with the counts of "mols"
+        """
+        generator = self.generator
+        elements = [generator.GetSparseCountFingerprint(mol).GetNonzeroElements() for mol in mols]
+        lengths = [len(element) for element in elements]
+        rows = np.repeat(np.arange(len(mols)), lengths)
+        hashes = np.fromiter((key for element in elements for key in element), dtype=np.uint64, count=sum(lengths))
+        counts = np.fromiter(
+            (count for element in elements for count in element.values()), dtype=np.int64, count=sum(lengths))
+        # duplicate columns after folding are summed when the matrix is converted to CSR
+        ret = sparse.coo_matrix(
+            (counts, (rows, (hashes % np.uint64(self.nBits)).astype(np.int64))), shape=(len(mols), len(self))
+        ).tocsr()
+        np.clip(ret.data, 0, np.iinfo(np.uint16).max, out=ret.data)
+        return ret.astype(np.uint16)
 
     def getFingerprints(self, mols):
-        """Return the CDK fingerprint for the input molecules.
+        """Return the folded count fingerprints for the input molecules.
 
         Args:
             mols: molecules to obtain the fingerprint of
 
         Returns:
-            fingerprint (list): `list` of fingerprints for "mols"
+            fingerprint (np.ndarray): `uint16` array of shape (n_mols, nBits) with the counts of "mols"
         """
-        return self._padel.calculate(mols, show_banner=False).values
+        return self.getSparseFingerprints(mols).toarray()
+
+    def __len__(self):
+        return self.nBits
+
+
+class MorganCountFP(CountFingerprint):
+    """Morgan count fingerprint."""
+
+    def __init__(self, radius=2, nBits=2048):
+        super().__init__(nBits)
+        self.radius = radius
+
+    def _createGenerator(self):
+        return rdFingerprintGenerator.GetMorganGenerator(radius=self.radius)
 
     @property
     def settings(self):
-        return {"size": self.size, "searchDepth": self.searchDepth}
+        return {"radius": self.radius, "nBits": self.nBits}
 
-    def __len__(self):
-        return self.size
+    def getKey(self):
+        return "MorganCountFP"
+
+
+class FeatureMorganCountFP(MorganCountFP):
+    """Morgan count fingerprint with pharmacophoric feature invariants instead of atom invariants (FCFP)."""
+
+    def _createGenerator(self):
+        return rdFingerprintGenerator.GetMorganGenerator(
+            radius=self.radius, atomInvariantsGenerator=rdFingerprintGenerator.GetMorganFeatureAtomInvGen())
 
     def getKey(self):
-        return "CDKFP"
+        return "FeatureMorganCountFP"
 
 
-class CDKExtendedFP(fingerprint):
-    """CDK extended fingerprint with 25 additional ring features and isotopic masses."""
+class AtomPairCountFP(CountFingerprint):
+    """Atom pair count fingerprint."""
 
-    def __init__(self):
-        fp = cdk_fps.ExtendedFP
-        self._padel = PaDEL_calculator([fp])
+    def __init__(self, minDistance=1, maxDistance=30, nBits=2048):
+        super().__init__(nBits)
+        self.minDistance = minDistance
+        self.maxDistance = maxDistance
+
+    def _createGenerator(self):
+        return rdFingerprintGenerator.GetAtomPairGenerator(minDistance=self.minDistance, maxDistance=self.maxDistance)
+
+    @property
+    def settings(self):
+        return {"minDistance": self.minDistance, "maxDistance": self.maxDistance, "nBits": self.nBits}
+
+    def getKey(self):
+        return "AtomPairCountFP"
+
+
+class TopologicalTorsionCountFP(CountFingerprint):
+    """Topological torsion count fingerprint."""
+
+    def __init__(self, torsionAtomCount=4, nBits=2048):
+        super().__init__(nBits)
+        self.torsionAtomCount = torsionAtomCount
+
+    def _createGenerator(self):
+        return rdFingerprintGenerator.GetTopologicalTorsionGenerator(torsionAtomCount=self.torsionAtomCount)
+
+    @property
+    def settings(self):
+        return {"torsionAtomCount": self.torsionAtomCount, "nBits": self.nBits}
+
+    def getKey(self):
+        return "TopologicalTorsionCountFP"
+
+
+class CDKFingerprint(fingerprint):
+    """Base class for CDK fingerprints calculated with PaDEL.
+
+    Every call to PaDEL starts a Java virtual machine, so the fingerprints are calculated for large batches of
+    molecules (`batchSize`). Molecules for which PaDEL fails get `NaN` values instead of failing the whole batch.
+
+    Attributes:
+        batchSize (int): preferred number of molecules calculated at once
+    """
+
+    batchSize = 1000
 
     def getFingerprints(self, mols):
-        """Return the CDK extended fingerprint for the input molecules.
+        """Return the CDK fingerprints for the input molecules.
 
         Args:
             mols: molecules to obtain the fingerprint of
 
         Returns:
-            fingerprint (list): `list` of fingerprints for "mols"
+            fingerprint (np.ndarray): array of shape (n_mols, len(self)) with the fingerprints of "mols"
         """
+        return calculate_isolated(
+            self._calculateBatch, list(mols), len(self), batch_size=self.batchSize, name=self.getKey())
+
+    def _calculateBatch(self, mols):
+        """Calculate the fingerprints of a batch of molecules with one call to PaDEL."""
         return self._padel.calculate(mols, show_banner=False).values
 
+
+class CDKFP(CDKFingerprint):
+    """CDK fingerprint."""
+
+    def __init__(self, size=1024, searchDepth=7):
+        self.size = size
+        self.searchDepth = searchDepth
+        fp = cdk_fps.FP(size=size, searchDepth=searchDepth)
+        self._padel = PaDEL_calculator([fp])
+
+    @property
+    def settings(self):
+        return {"size": self.size, "searchDepth": self.searchDepth}
+
+    def __len__(self):
+        return self.size
+
+    def getKey(self):
+        return "CDKFP"
+
+
+class CDKExtendedFP(CDKFingerprint):
+    """CDK extended fingerprint with 25 additional ring features and isotopic masses."""
+
+    def __init__(self):
+        fp = cdk_fps.ExtendedFP
+        self._padel = PaDEL_calculator([fp])
+
     @property
     def settings(self):
         return {}
@@ -137,24 +335,13 @@ class CDKExtendedFP(fingerprint):
         return "CDKExtendedFP"
 
 
-class CDKEStateFP(fingerprint):
+class CDKEStateFP(CDKFingerprint):
     """CDK EState fingerprint."""
 
     def __init__(self):
         fp = cdk_fps.EStateFP
         self._padel = PaDEL_calculator([fp])
 
-    def getFingerprints(self, mols):
-        """Return the CDK extended fingerprint for the input molecules.
-
-        Args:
-            mols: molecules to obtain the fingerprint of
-
-        Returns:
-            fingerprint (list): `list` of fingerprints for "mols"
-        """
-        return self._padel.calculate(mols, show_banner=False).values
-
     @property
     def settings(self):
         return {}
@@ -166,7 +353,7 @@ class CDKEStateFP(fingerprint):
         return "CDKEStateFP"
 
 
-class CDKGraphOnlyFP(fingerprint):
+class CDKGraphOnlyFP(CDKFingerprint):
     """CDK fingerprint ignoring bond orders."""
 
     def __init__(self, size=1024, searchDepth=7):
@@ -175,17 +362,6 @@ class CDKGraphOnlyFP(fingerprint):
         fp = cdk_fps.GraphOnlyFP(size=size, searchDepth=searchDepth)
         self._padel = PaDEL_calculator([fp])
 
-    def getFingerprints(self, mols):
-        """Return the CDK graph only fingerprint for the input molecules.
-
-        Args:
-            mols: molecules to obtain the fingerprint of
-
-        Returns:
-            fingerprint (list): `list` of fingerprints for "mols"
-        """
-        return self._padel.calculate(mols, show_banner=False).values
-
     @property
     def settings(self):
         return {"size": self.size, "searchDepth": self.searchDepth}
@@ -197,24 +373,13 @@ class CDKGraphOnlyFP(fingerprint):
         return "CDKGraphOnlyFP"
 
 
-class CDKMACCSFP(fingerprint):
+class CDKMACCSFP(CDKFingerprint):
     """CDK MACCS fingerprint."""
 
     def __init__(self):
         fp = cdk_fps.MACCSFP
         self._padel = PaDEL_calculator([fp])
 
-    def getFingerprints(self, mols):
-        """Return the CDK MACCS fingerprint for the input molecules.
-
-        Args:
-            mols: molecules to obtain the fingerprint of
-
-        Returns:
-            fingerprint (list): `list` of fingerprints for "mols"
-        """
-        return self._padel.calculate(mols, show_banner=False).values
-
     @property
     def settings(self):
         return {}
@@ -226,24 +391,13 @@ class CDKMACCSFP(fingerprint):
         return "CDKMACCSFP"
 
 
-class CDKPubchemFP(fingerprint):
+class CDKPubchemFP(CDKFingerprint):
     """CDK PubChem fingerprint."""
 
     def __init__(self):
         fp = cdk_fps.PubchemFP
         self._padel = PaDEL_calculator([fp])
 
-    def getFingerprints(self, mols):
-        """Return the CDK PubChem fingerprint for the input molecules.
-
-        Args:
-            mols: molecules to obtain the fingerprint of
-
-        Returns:
-            fingerprint (list): `list` of fingerprints for "mols"
-        """
-        return self._padel.calculate(mols, show_banner=False).values
-
     @property
     def settings(self):
         return {}
@@ -255,7 +409,7 @@ class CDKPubchemFP(fingerprint):
         return "CDKPubchemFP"
 
 
-class CDKSubstructureFP(fingerprint):
+class CDKSubstructureFP(CDKFingerprint):
     """CDK Substructure fingerprint.
 
     Based on SMARTS patterns for functional group classification by Christian Laggner.
@@ -269,17 +423,6 @@ class CDKSubstructureFP(fingerprint):
             fp = cdk_fps.SubstructureFP
         self._padel = PaDEL_calculator([fp])
 
-    def getFingerprints(self, mols):
-        """Return the CDK Substructure fingerprint for the input molecules.
-
-        Args:
-            mols: molecules to obtain the fingerprint of
-
-        Returns:
-            fingerprint (list): `list` of fingerprints for "mols"
-        """
-        return self._padel.calculate(mols, show_banner=False).values
-
     @property
     def settings(self):
         return {'useCounts': self.useCounts}
@@ -293,7 +436,7 @@ class CDKSubstructureFP(fingerprint):
         return "CDKSubstructureFP"
 
 
-class CDKKlekotaRothFP(fingerprint):
+class CDKKlekotaRothFP(CDKFingerprint):
     """CDK Klekota & Roth fingerprint."""
 
     def __init__(self, useCounts: bool = False):
@@ -304,17 +447,6 @@ class CDKKlekotaRothFP(fingerprint):
             fp = cdk_fps.KlekotaRothFP
         self._padel = PaDEL_calculator([fp])
 
-    def getFingerprints(self, mols):
-        """Return the CDK Klekota & Roth fingerprint for the input molecules.
-
-        Args:
-            mols: molecules to obtain the fingerprint of
-
-        Returns:
-            fingerprint (list): `list` of fingerprints for "mols"
-        """
-        return self._padel.calculate(mols, show_banner=False).values
-
     @property
     def settings(self):
         return {'useCounts': self.useCounts}
@@ -328,7 +460,7 @@ class CDKKlekotaRothFP(fingerprint):
         return "CDKKlekotaRothFP"
 
 
-class CDKAtomPairs2DFP(fingerprint):
+class CDKAtomPairs2DFP(CDKFingerprint):
     """CDK atom pairs and topological fingerprint."""
 
     def __init__(self, useCounts: bool = False):
@@ -339,17 +471,6 @@ class CDKAtomPairs2DFP(fingerprint):
             fp = cdk_fps.AtomPairs2DFP
         self._padel = PaDEL_calculator([fp])
 
-    def getFingerprints(self, mols):
-        """Return the CDK atom pairs and topological fingerprint for the input molecules.
-
-        Args:
-            mols: molecules to obtain the fingerprint of
-
-        Returns:
-            fingerprint (list): `list` of fingerprints for "mols"
-        """
-        return self._padel.calculate(mols, show_banner=False).values
-
     @property
     def settings(self):
         return {'useCounts': self.useCounts}
@@ -363,6 +484,32 @@ class CDKAtomPairs2DFP(fingerprint):
         return "CDKAtomPairs2DFP"
 
 
+def pack_fingerprints(fps: np.ndarray) -> np.ndarray:
+    """Pack dense binary fingerprints into bits, eight bits per byte.
+
+    Args:
+        fps: array of shape (n_mols, n_bits) with values of 0 and 1 (or booleans)
+
+    Returns:
+        np.ndarray: `uint8` array of shape (n_mols, ceil(n_bits / 8))
+    """
+    return np.packbits(np.asarray(fps) > 0, axis=1)
+
+
+def unpack_fingerprints(packed: np.ndarray, n_bits: int, dtype=np.uint8) -> np.ndarray:
+    """Unpack fingerprints packed with `pack_fingerprints`.
+
+    Args:
+        packed: `uint8` array of shape (n_mols, ceil(n_bits / 8))
+        n_bits: number of bits of the fingerprints
+        dtype: data type of the returned array (i.e. `np.uint8` or `bool`)
+
+    Returns:
+        np.ndarray: array of shape (n_mols, n_bits)
+    """
+    return np.unpackbits(packed, axis=1, count=n_bits).astype(dtype, copy=False)
+
+
 class _FingerprintRetriever:
     """Based on recipe 8.21 of the book "Python Cookbook".
 
@@ -379,6 +526,18 @@ class _FingerprintRetriever:
     def get_MorganFP(self, *args, **kwargs):
         return MorganFP(*args, **kwargs)
 
+    def get_MorganCountFP(self, *args, **kwargs):
+        return MorganCountFP(*args, **kwargs)
+
+    def get_FeatureMorganCountFP(self, *args, **kwargs):
+        return FeatureMorganCountFP(*args, **kwargs)
+
+    def get_AtomPairCountFP(self, *args, **kwargs):
+        return AtomPairCountFP(*args, **kwargs)
+
+    def get_TopologicalTorsionCountFP(self, *args, **kwargs):
+        return TopologicalTorsionCountFP(*args, **kwargs)
+
     def get_CDKFP(self, *args, **kwargs):
         return CDKFP(*args, **kwargs)
 
@@ -1,36 +1,126 @@
+from collections import OrderedDict
+
 import numpy as np
 from qsprpred.data.utils.descriptor_utils.interfaces import Scorer
-from rdkit.Chem import Descriptors
-from rdkit.ML.Descriptors import MoleculeDescriptors
+from rdkit import Chem
+from rdkit.Chem import AllChem, Descriptors, Descriptors3D
+
+DESCRIPTORS_3D = [
+    "Asphericity",
+    "Eccentricity",
+    "InertialShapeFactor",
+    "NPR1",
+    "NPR2",
+    "PMI1",
+    "PMI2",
+    "PMI3",
+    "RadiusOfGyration",
+    "SpherocityIndex",
+]
 
 
 class RDKit_desc(Scorer):
+    """RDKit descriptors.
+
+    The functions of the selected descriptors are looked up once when the descriptors are set, so a calculator
+    trimmed to a few descriptors (i.e. by `DescriptorsCalculator.keepDescriptors`) only calculates those.
+    3D descriptors are calculated from a conformer of the molecule, which is embedded with ETKDG if the molecule
+    has none and kept for the last `conformerCacheSize` molecules.
+
+    Attributes:
+        randomSeed (int): random seed used to embed molecules
+        conformerCacheSize (int): number of embedded molecules kept in memory
+    """
+
+    randomSeed = 42
+    conformerCacheSize = 1000
+
     def __init__(self, rdkit_descriptors=None, compute_3Drdkit=False):
-        self.descriptors = (
-            rdkit_descriptors if rdkit_descriptors else [x[0] for x in Descriptors._descList]
-        )
+        descriptors = list(rdkit_descriptors) if rdkit_descriptors else [x[0] for x in Descriptors._descList]
         if compute_3Drdkit:
-            self.descriptors = self.descriptors + [
-                "Asphericity",
-                "Eccentricity",
-                "InertialShapeFactor",
-                "NPR1",
-                "NPR2",
-                "PMI1",
-                "PMI2",
-                "PMI3",
-                "RadiusOfGyration",
-                "SpherocityIndex",
-            ]
+            descriptors = descriptors + [name for name in DESCRIPTORS_3D if name not in descriptors]
+        self._conformers = OrderedDict()
+        self.descriptors = descriptors
+
+    def __getstate__(self):
+        # some descriptor functions are lambdas that cannot be pickled, they are looked up again after unpickling
+        state = self.__dict__.copy()
+        state["_functions"] = None
+        state["_conformers"] = OrderedDict()
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._functions = self._compile(self._descriptors)
+
+    @property
+    def descriptors(self):
+        return self._descriptors
+
+    @descriptors.setter
+    def descriptors(self, names):
+        self._functions = self._compile(names)
+        self._descriptors = list(names)
+
+    @staticmethod
+    def _compile(names):
+        """Look up the function of each descriptor.
+
+        Returns:
+            list: tuples of the descriptor function and whether it needs a conformer
+        """
+        functions_2d = dict(Descriptors._descList)
+        functions = []
+        for name in names:
+            if name in functions_2d:
+                functions.append((functions_2d[name], False))
+            elif name in DESCRIPTORS_3D:
+                functions.append((getattr(Descriptors3D, name), True))
+            else:
+                raise ValueError(f"{name} is not a valid RDKit descriptor name.")
+        return functions
+
+    def getConformer(self, mol):
+        """Get the molecule with hydrogens and a 3D conformer, embedded molecules are cached.
+
+        Args:
+            mol: RDKit molecule
+
+        Returns:
+            the molecule with a conformer, `None` if the molecule could not be embedded
+        """
+        if mol.GetNumConformers() > 0 and mol.GetConformer().Is3D():
+            return mol
+        key = Chem.MolToSmiles(mol)
+        if key in self._conformers:
+            self._conformers.move_to_end(key)
+            return self._conformers[key]
+        embedded = Chem.AddHs(mol)
+        params = AllChem.ETKDGv3()
+        params.randomSeed = self.randomSeed
+        if AllChem.EmbedMolecule(embedded, params) != 0:
+            embedded = None
+        self._conformers[key] = embedded
+        while len(self._conformers) > self.conformerCacheSize:
+            self._conformers.popitem(last=False)
+        return embedded
 
     def getScores(self, mols):
-        scores = np.zeros((len(mols), len(self.descriptors)))
-        calc = MoleculeDescriptors.MolecularDescriptorCalculator(self.descriptors)
-        for i, mol in enumerate(mols):
+        scores = np.full((len(mols), len(self._functions)), np.nan)
+        conformers = None
+        for j, (func, needs_conformer) in enumerate(self._functions):
+            if needs_conformer and conformers is None:
+                conformers = [self.getConformer(mol) if mol is not None else None for mol in mols]
+            inputs = conformers if needs_conformer else mols
             try:
-                scores[i] = calc.CalcDescriptors(mol)
-            except:
-                continue
+                scores[:, j] = [func(mol) for mol in inputs]
+            except Exception:
+                # calculate molecule by molecule, failed molecules are missing values instead of zeros
+                for i, mol in enumerate(inputs):
+                    try:
+                        scores[i, j] = func(mol)
+                    except Exception:
+                        continue
         return scores
 
     def getKey(self):
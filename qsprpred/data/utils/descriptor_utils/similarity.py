@@ -0,0 +1,174 @@
+"""Vectorized Tanimoto similarity of binary fingerprints.
+
+`TanimotoIndex` keeps reference fingerprints packed into `uint64` words and calculates the similarities or
+the nearest neighbors of query fingerprints in blocks of queries, so that the intermediate
+(n_queries, n_references) results never exceed a memory budget. The number of common bits is either counted
+with a popcount of the packed words (`method="popcount"`, small memory footprint) or with a matrix product of
+the unpacked fingerprints (`method="blas"`, faster for long fingerprints and many references).
+"""
+from typing import Iterator, Tuple
+
+import numpy as np
+from scipy.sparse import issparse
+
+_M1 = np.uint64(0x5555555555555555)
+_M2 = np.uint64(0x3333333333333333)
+_M4 = np.uint64(0x0F0F0F0F0F0F0F0F)
+_H01 = np.uint64(0x0101010101010101)
+
+
+def pack_bits64(fps) -> np.ndarray:
+    """Pack binary fingerprints into `uint64` words, the last word is padded with zeros.
+
+    Args:
+        fps: dense array or sparse matrix of shape (n_mols, n_bits), nonzero values are set bits
+
+    Returns:
+        np.ndarray: `uint64` array of shape (n_mols, ceil(n_bits / 64))
+    """
+    fps = fps.toarray() if issparse(fps) else np.asarray(fps)
+    packed = np.packbits(fps > 0, axis=1)
+    n_words = -(-fps.shape[1] // 64)
+    padded = np.zeros((fps.shape[0], n_words * 8), dtype=np.uint8)
+    padded[:, :packed.shape[1]] = packed
+    return padded.view(np.uint64)
+
+
+def popcount64(words: np.ndarray) -> np.ndarray:
+    """Count the set bits of each `uint64` word.
+
+    Args:
+        words: `uint64` array of any shape
+
+    Returns:
+        np.ndarray: `uint64` array with the number of set bits of each word
+    """
+    x = words - ((words >> np.uint64(1)) & _M1)
+    x = (x & _M2) + ((x >> np.uint64(2)) & _M2)
+    x = (x + (x >> np.uint64(4))) & _M4
+    return (x * _H01) >> np.uint64(56)
+
+
+class TanimotoIndex:
+    """Reference fingerprints for fast Tanimoto similarity and nearest neighbor queries.
+
+    The similarity of two empty fingerprints is 0.
+
+    Attributes:
+        nBits (int): number of bits of the fingerprints
+        method (str): 'popcount' or 'blas', how the common bits are counted
+        maxMemory (int): memory budget in bytes of the intermediate results of one block of queries
+    """
+
+    def __init__(self, fps, method: str = "popcount", max_memory: int = 2 ** 28):
+        """Create the index.
+
+        Args:
+            fps: reference fingerprints, dense array or sparse matrix of shape (n_references, n_bits)
+            method (str): 'popcount' to count common bits of packed fingerprints or 'blas' to use a matrix product
+                of the unpacked fingerprints (keeps a `float32` copy of the references)
+            max_memory (int): memory budget in bytes of the intermediate results of one block of queries
+        """
+        if method not in ("popcount", "blas"):
+            raise ValueError(f"Unknown method: {method}. Use 'popcount' or 'blas'.")
+        self.nBits = fps.shape[1]
+        self.method = method
+        self.maxMemory = max_memory
+        self.packed = pack_bits64(fps)
+        self.counts = popcount64(self.packed).sum(axis=1).astype(np.int64)
+        # word-major copy so that each word of all references is contiguous
+        self._wordsT = np.ascontiguousarray(self.packed.T)
+        self._dense = self._unpack(self.packed) if method == "blas" else None
+
+    def __len__(self):
+        return len(self.counts)
+
+    def _unpack(self, packed: np.ndarray) -> np.ndarray:
+        """Unpack `uint64` words into a `float32` matrix of bits."""
+        return np.unpackbits(packed.view(np.uint8), axis=1, count=self.nBits).astype(np.float32)
+
+    def _blockSize(self, n_queries: int) -> int:
+        """Number of queries per block that keeps the intermediate results within the memory budget."""
+        if self.method == "blas":
+            per_query = 4 * self.nBits + 24 * len(self)
+        else:
+            per_query = 48 * len(self)
+        return int(min(max(1, n_queries), max(1, self.maxMemory // max(1, per_query))))
+
+    def _intersections(self, packed: np.ndarray) -> np.ndarray:
+        """Count the common bits of packed queries and all references."""
+        if self.method == "blas":
+            return self._unpack(packed) @ self._dense.T
+        common = np.zeros((len(packed), len(self)), dtype=np.int64)
+        for word in range(packed.shape[1]):
+            common += popcount64(packed[:, word, None] & self._wordsT[None, word]).astype(np.int64)
+        return common
+
+    def iterSimilarities(self, queries) -> Iterator[Tuple[int, np.ndarray]]:
+        """Calculate Tanimoto similarities of the queries to the references block by block.
+
+        Args:
+            queries: query fingerprints, dense array or sparse matrix of shape (n_queries, n_bits)
+
+        Yields:
+            tuple: index of the first query of the block and the similarities of shape (n_block, n_references)
+        """
+        if queries.shape[1] != self.nBits:
+            raise ValueError(f"Expected fingerprints with {self.nBits} bits, got {queries.shape[1]}.")
+        block_size = self._blockSize(queries.shape[0])
+        for start in range(0, queries.shape[0], block_size):
+            packed = pack_bits64(queries[start:start + block_size])
+            counts = popcount64(packed).sum(axis=1).astype(np.int64)
+            common = self._intersections(packed).astype(np.float64)
+            union = counts[:, None] + self.counts[None, :] - common
+            yield start, np.divide(common, union, out=np.zeros_like(union), where=union > 0)
+
+    def similarity(self, queries) -> np.ndarray:
+        """Calculate the Tanimoto similarities of the queries to all references.
+
+        Args:
+            queries: query fingerprints, dense array or sparse matrix of shape (n_queries, n_bits)
+
+        Returns:
+            np.ndarray: similarities of shape (n_queries, n_references)
+        """
+        ret = np.empty((queries.shape[0], len(self)))
+        for start, block in self.iterSimilarities(queries):
+            ret[start:start + len(block)] = block
+        return ret
+
+    def distances(self, queries) -> np.ndarray:
+        """Calculate the Tanimoto distances (1 - similarity) of the queries to all references.
+
+        Args:
+            queries: query fingerprints, dense array or sparse matrix of shape (n_queries, n_bits)
+
+        Returns:
+            np.ndarray: distances of shape (n_queries, n_references)
+        """
+        return 1 - self.similarity(queries)
+
+    def nearest(self, queries, k: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+        """Find the most similar references of each query. Only one block of similarities is kept in memory.
+
+        Args:
+            queries: query fingerprints, dense array or sparse matrix of shape (n_queries, n_bits)
+            k (int): number of neighbors
+
+        Returns:
+            tuple: indices of the references and their similarities, both of shape (n_queries, k) and sorted by
+                decreasing similarity
+        """
+        k = min(k, len(self))
+        indices = np.empty((queries.shape[0], k), dtype=np.int64)
+        similarities = np.empty((queries.shape[0], k))
+        for start, block in self.iterSimilarities(queries):
+            if k < block.shape[1]:
+                top = np.argpartition(-block, k - 1, axis=1)[:, :k]
+            else:
+                top = np.tile(np.arange(block.shape[1]), (len(block), 1))
+            top_sims = np.take_along_axis(block, top, axis=1)
+            order = np.argsort(-top_sims, axis=1, kind="stable")
+            indices[start:start + len(block)] = np.take_along_axis(top, order, axis=1)
+            similarities[start:start + len(block)] = np.take_along_axis(top_sims, order, axis=1)
+        return indices, similarities
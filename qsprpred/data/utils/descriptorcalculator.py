@@ -1,11 +1,18 @@
 """This module is used for calculating molecular descriptors using descriptorsets."""
 import json
 from abc import ABC, abstractmethod
-from typing import List, Union
+from typing import Dict, List, Optional, Tuple, Union
 
+import numpy as np
 import pandas as pd
+from qsprpred.data.utils.descriptor_cache import DescriptorCache
 from qsprpred.data.utils.descriptorsets import DescriptorSet, get_descriptor
+from qsprpred.data.utils.molecules import to_mol
+from qsprpred.data.utils.sparse_features import from_matrix
+from qsprpred.data.utils.supervision import CalculationError, DescriptorSupervisor, count_errors
+from qsprpred.logs import logger
 from rdkit.Chem.rdchem import Mol
+from scipy.sparse import csr_matrix, issparse
 
 
 class Calculator(ABC):
@@ -53,11 +60,34 @@ class Calculator(ABC):
 
 
 class DescriptorsCalculator(Calculator):
-    """Calculator for molecule properties."""
+    """Calculator for molecule properties.
+
+    Attributes:
+        descsets (list): descriptor sets to calculate
+        cache (DescriptorCache): persistent cache of descriptor values
+        timeout (float): wall-clock budget in seconds to calculate one descriptor set for one molecule
+        supervisor (DescriptorSupervisor): supervised process used to calculate the sets if `timeout` is set
+        failures (dict): number of molecules with failed calculations (`invalid`, `error` and `timeout`) by the
+            name of the descriptor set, counted over all calls of this calculator in the current process
+    """
+
+    def __init__(self, descsets: List[DescriptorSet], cache: DescriptorCache = None, timeout: float = None) -> None:
+        """Set the descriptorsets to be calculated with this calculator.
 
-    def __init__(self, descsets: List[DescriptorSet]) -> None:
-        """Set the descriptorsets to be calculated with this calculator."""
+        Args:
+            descsets: descriptor sets to calculate
+            cache: persistent cache of descriptor values, only molecules missing from the cache are calculated. The
+                cache is not saved with the calculator.
+            timeout: wall-clock budget in seconds to calculate one descriptor set for one molecule. If set, the
+                descriptor sets are calculated in a supervised process that is restarted when a molecule exceeds
+                the budget, and its values are `NaN` (see `DescriptorSupervisor`). The timeout is not saved with
+                the calculator.
+        """
         self.descsets = list(descsets)
+        self.cache = cache
+        self.timeout = timeout
+        self.supervisor = DescriptorSupervisor(timeout) if timeout else None
+        self.failures = {}
 
     __in__ = __contains__ = lambda self, x: x in self.descsets
 
@@ -86,31 +116,180 @@ class DescriptorsCalculator(Calculator):
             descsets.append(descset)
         return DescriptorsCalculator(descsets)
 
-    def __call__(self, mols: List[Mol]) -> pd.DataFrame:
-        """Calculate descriptors for list of mols.
+    @staticmethod
+    def readProvenance(fname: str) -> Dict[str, dict]:
+        """Read the provenance of the descriptor sets saved with a calculator (see `DescriptorsCalculator.toFile`).
 
         Args:
-            mols: list of rdkit mols
+            fname: file name of json file with descriptor names and settings
+
+        Returns:
+            dict: provenance records by the name of the descriptor set
         """
-        df = pd.DataFrame()
-        for descset in self.descsets:
-            values = descset(mols)
-            values = pd.DataFrame(values, columns=descset.descriptors)
+        with open(fname, "r") as infile:
+            descset_dict = json.load(infile)
+        return {key: value["provenance"] for key, value in descset_dict.items() if "provenance" in value}
+
+    def __call__(self, mols: List[Union[Mol, str, bytes]]) -> pd.DataFrame:
+        """Calculate descriptors for list of mols. Failed calculations are added to `failures`.
+
+        Args:
+            mols: list of rdkit mols, smiles strings or binary molecules, each molecule is only parsed once
+                for all descriptor sets
+        """
+        df, codes = self.calculateWithErrors(mols)
+        self.recordFailures(codes)
+        return df
+
+    def calculateWithErrors(self, mols: List[Union[Mol, str, bytes]]) -> Tuple[pd.DataFrame, np.ndarray]:
+        """Calculate descriptors for list of mols and report the outcome of the calculation for each molecule.
+
+        Args:
+            mols: list of rdkit mols, smiles strings or binary molecules
+
+        Returns:
+            tuple: the descriptors and `CalculationError` codes of shape (n_mols, n_descsets), errors and timeouts
+                are only detected if the calculation is supervised (`timeout` is set)
+        """
+        if not self.sparse:
+            values, codes = self.calculateMatrix(mols)
+            return pd.DataFrame(values, columns=self.getDescriptorNames()), codes
+
+        # sparse sets are kept in sparse columns, so the sets are calculated as separate data frames
+        mols, codes = self._prepareMols(mols)
+        dfs = []
+        for idx, descset in enumerate(self.descsets):
+            values = self._calculateSet(descset, mols, codes[:, idx])
+            if issparse(values):
+                values = from_matrix(values, columns=descset.descriptors)
+            else:
+                values = pd.DataFrame(values, columns=descset.descriptors)
             if descset.is_fp:
                 values.add_prefix(f"{descset.fingerprint_type}_")
-            df = pd.concat([df, values.add_prefix(f"Descriptor_{descset}_")], axis=1)
+            dfs.append(values.add_prefix(f"Descriptor_{descset}_"))
+        df = pd.concat(dfs, axis=1) if dfs else pd.DataFrame()
 
-        # replace errors by nan values
-        df = df.apply(pd.to_numeric, errors='coerce')
+        # replace errors by nan values, numeric columns keep their data type (i.e. `uint8` fingerprints)
+        errors = df.columns[df.dtypes == object]
+        if len(errors) > 0:
+            df[errors] = df[errors].apply(pd.to_numeric, errors='coerce')
 
-        return df
+        return df, codes
 
-    def toFile(self, fname: str) -> None:
+    def calculateMatrix(self, mols: List[Union[Mol, str, bytes]]) -> Tuple[np.ndarray, np.ndarray]:
+        """Calculate descriptors for list of mols into one matrix. The matrix is allocated before the calculation
+        with the data type of the calculator (see `dtype`) and each descriptor set writes its values to its own
+        columns. Values that are not numeric (i.e. errors) are replaced by `NaN`. Not supported for sparse sets.
+
+        Args:
+            mols: list of rdkit mols, smiles strings or binary molecules
+
+        Returns:
+            tuple: the descriptors of shape (n_mols, n_descriptors) in the order of `getDescriptorNames` and
+                `CalculationError` codes of shape (n_mols, n_descsets) (see `calculateWithErrors`)
+        """
+        if self.sparse:
+            raise ValueError("Sparse descriptor sets cannot be calculated into a dense matrix.")
+        mols, codes = self._prepareMols(mols)
+        lengths = [len(descset.descriptors) for descset in self.descsets]
+        ret = np.empty((len(mols), sum(lengths)), dtype=self.dtype)
+        start = 0
+        for idx, (descset, length) in enumerate(zip(self.descsets, lengths)):
+            values = self._calculateSet(descset, mols, codes[:, idx])
+            if isinstance(values, pd.DataFrame):
+                values = values.values
+            values = np.asarray(values)
+            if values.dtype == object:
+                # replace errors by nan values in one pass over all values of the set
+                values = pd.to_numeric(values.ravel(), errors="coerce").reshape(values.shape)
+            ret[:, start:start + length] = values.reshape(len(mols), length)
+            start += length
+        return ret, codes
+
+    def _prepareMols(self, mols: List[Union[Mol, str, bytes]]) -> Tuple[List[Mol], np.ndarray]:
+        """Parse the molecules and create the error codes of the calculation, invalid molecules are marked."""
+        mols = [to_mol(mol) for mol in mols]
+        codes = np.zeros((len(mols), len(self.descsets)), dtype=np.int8)
+        codes[np.array([mol is None for mol in mols], dtype=bool)] = CalculationError.INVALID
+        return mols, codes
+
+    def _calculateSet(self, descset: DescriptorSet, mols: List[Mol], codes: np.ndarray):
+        """Calculate the values of a descriptor set and write its error codes to `codes`."""
+        if self.supervisor is not None:
+            return self._calculateSupervised(descset, mols, codes)
+        elif self.cache is None:
+            return descset(mols)
+        else:
+            return self.cache.calculate(descset, mols)
+
+    def _calculateSupervised(self, descset: DescriptorSet, mols: List[Mol], codes: np.ndarray):
+        """Calculate a descriptor set with the supervisor and write the error codes of the molecules to `codes`."""
+        positions = {id(mol): idx for idx, mol in enumerate(mols)}
+
+        def calculate(calc_descset, calc_mols):
+            values, calc_codes = self.supervisor.calculate(calc_descset, calc_mols)
+            # the cache passes on the same molecule objects for the molecules that it does not hold
+            codes[[positions[id(mol)] for mol in calc_mols]] = calc_codes
+            return values
+
+        values = calculate(descset, mols) if self.cache is None else self.cache.calculate(descset, mols, func=calculate)
+        if getattr(descset, "sparse", False):
+            return csr_matrix(values)
+        # keep the data type of the set (i.e. `uint8` fingerprints) if nothing failed
+        return values if np.isnan(values).any() else values.astype(descset.dtype)
+
+    def recordFailures(self, codes: np.ndarray):
+        """Add failed calculations to the failure counts of the descriptor sets (`failures`) and log them.
+
+        Args:
+            codes: `CalculationError` codes of shape (n_mols, n_descsets) as returned by `calculateWithErrors`
+        """
+        for idx, descset in enumerate(self.descsets):
+            counts = count_errors(codes[:, idx])
+            record = self.failures.setdefault(str(descset), dict.fromkeys(counts, 0))
+            for key, count in counts.items():
+                record[key] += count
+            if counts["error"] or counts["timeout"]:
+                logger.warning(f"Calculation of {descset} failed for {counts['error']} and timed out for "
+                               f"{counts['timeout']} of {len(codes)} molecules.")
+
+    @property
+    def sparse(self) -> bool:
+        """Whether any of the descriptor sets of this calculator returns sparse values."""
+        return any(getattr(descset, "sparse", False) for descset in self.descsets)
+
+    @property
+    def batchSize(self) -> Optional[int]:
+        """Preferred number of molecules calculated at once, the largest preference of the descriptor sets of this
+        calculator or `None` if none of them has a preference (see `DescriptorSet.batchSize`)."""
+        sizes = [descset.batchSize for descset in self.descsets if descset.batchSize]
+        return max(sizes) if sizes else None
+
+    @property
+    def dtype(self) -> np.dtype:
+        """Data type that can hold the values of all descriptor sets of this calculator."""
+        if not self.descsets or self.supervisor is not None:
+            # supervised calculations can return `NaN` for any set
+            return np.result_type(np.float64, *[descset.dtype for descset in self.descsets])
+        return np.result_type(*[descset.dtype for descset in self.descsets])
+
+    def getDescriptorNames(self) -> List[str]:
+        """Get the names of the calculated descriptors in the order of the columns returned by the calculator.
+
+        Returns:
+            list: descriptor names with the descriptor set prefix
+        """
+        return [f"Descriptor_{descset}_{name}" for descset in self.descsets for name in descset.descriptors]
+
+    def toFile(self, fname: str, provenance: Dict[str, dict] = None) -> None:
         """Save descriptorset to json file.
 
         Args:
             fname: file name of json file with descriptor names and settings
+            provenance: provenance of the values calculated with each descriptor set in a data set by the name of
+                the set, saved next to the settings of the set
         """
+        provenance = provenance if provenance is not None else {}
         descset_dict = {}
         for descset in self.descsets:
             if descset.is_fp:
@@ -123,6 +302,8 @@ class DescriptorsCalculator(Calculator):
                     "settings": descset.settings,
                     "descriptors": descset.descriptors,
                 }
+            if descset.__str__() in provenance:
+                descset_dict[descset.__str__()]["provenance"] = provenance[descset.__str__()]
         with open('%s' % fname, "w") as outfile:
             json.dump(descset_dict, outfile)
 
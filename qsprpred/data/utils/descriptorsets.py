@@ -5,8 +5,10 @@ To add a new descriptor or fingerprint calculator:
 * Add a function to retrieve your descriptor by name to the descriptor retriever class
 """
 import importlib
+import multiprocessing
 from abc import ABC, abstractmethod
-from typing import Optional, Union, List
+from functools import lru_cache
+from typing import Dict, Optional, Union, List
 
 import mordred
 import numpy as np
@@ -16,8 +18,11 @@ from Mold2_pywrapper import Mold2 as Mold2_calculator
 from PaDEL_pywrapper import PaDEL as PaDEL_calculator
 from PaDEL_pywrapper.descriptor import descriptors as PaDEL_descriptors
 from qsprpred.data.utils.descriptor_utils.drugexproperties import Property
+from qsprpred.data.utils.descriptor_utils.external import calculate_isolated
 from qsprpred.data.utils.descriptor_utils.rdkitdescriptors import RDKit_desc
-from rdkit import Chem, DataStructs
+from qsprpred.data.utils.descriptor_utils.similarity import TanimotoIndex
+from qsprpred.data.utils.molecules import to_mol
+from rdkit import Chem
 from rdkit.Chem import Mol
 
 
@@ -25,32 +30,43 @@ class DescriptorSet(ABC):
     """Abstract base class for descriptorsets.
 
     A descriptorset is a collection of descriptors that can be calculated for a molecule.
+
+    Attributes:
+        cacheable (bool): whether calculated values only depend on the molecule and the settings of the set
+            and can be stored in a `DescriptorCache`
+        dtype (np.dtype): data type of the calculated values
+        batchSize (int): preferred number of molecules calculated at once, `None` if the set has no preference.
+            Sets that call external programs prefer large batches to avoid starting the program for every chunk.
     """
 
+    cacheable = True
+    dtype = np.float64
+    batchSize = None
+
     @abstractmethod
-    def __call__(self, mols: List[Union[str, Mol]]):
+    def __call__(self, mols: List[Union[str, bytes, Mol]]):
         """
         Calculate the descriptor for a molecule.
 
         Args:
-            mols: list of molecules (SMILES `str` or RDKit Mol)
+            mols: list of molecules (SMILES `str`, binary molecule `bytes` or RDKit Mol)
 
         Returns:
             an array or data frame of descriptor values of shape (n_mols, n_descriptors)
         """
         pass
 
-    def iterMols(self, mols: List[Union[str, Mol]], to_list=False):
+    def iterMols(self, mols: List[Union[str, bytes, Mol]], to_list=False):
         """
-        Create a molecule iterator or list from RDKit molecules or SMILES.
+        Create a molecule iterator or list from RDKit molecules, binary molecules or SMILES.
 
         Args:
-            mols: list of molecules (SMILES `str` or RDKit Mol)
+            mols: list of molecules (SMILES `str`, binary molecule `bytes` or RDKit Mol)
 
         Returns:
             an array or data frame of descriptor values of shape (n_mols, n_descriptors)
         """
-        ret = (Chem.MolFromSmiles(mol) if isinstance(mol, str) else mol for mol in mols)
+        ret = (to_mol(mol) for mol in mols)
         if to_list:
             ret = list(ret)
         return ret
@@ -88,19 +104,26 @@ class DescriptorSet(ABC):
 
 
 class FingerprintSet(DescriptorSet):
-    """Generic fingerprint descriptorset can be used to calculate any fingerprint type defined in descriptorutils.fingerprints."""
+    """Generic fingerprint descriptorset can be used to calculate any fingerprint type defined in descriptorutils.fingerprints.
 
-    def __init__(self, fingerprint_type, *args, **kwargs):
+    Fingerprints can also be calculated as sparse matrices (`sparse=True`), which are then kept in sparse data frame
+    columns and passed to models that support sparse input without creating the dense matrix. Sparse fingerprints
+    are not stored in a `DescriptorCache`.
+    """
+
+    def __init__(self, fingerprint_type, *args, sparse=False, **kwargs):
         """
         Initialize the descriptor with the same arguments as you would pass to your fingerprint type of choice.
 
         Args:
             fingerprint_type: fingerprint type
             *args: fingerprint specific arguments
+            sparse: calculate the fingerprints as a sparse CSR matrix
             **kwargs: fingerprint specific arguments keyword arguments
         """
         self._is_fp = True
         self.fingerprint_type = fingerprint_type
+        self.sparse = sparse
         self.get_fingerprint = fingerprints.get_fingerprint(self.fingerprint_type, *args, **kwargs)
 
         self._keepindices = None
@@ -108,13 +131,21 @@ class FingerprintSet(DescriptorSet):
     def __call__(self, mols):
         """Calculate the fingerprint for a list of molecules."""
         mols = [Chem.AddHs(mol) for mol in self.iterMols(mols)]
-        ret = self.get_fingerprint(mols)
+        if self.sparse:
+            ret = self.get_fingerprint.getSparseFingerprints(mols)
+        else:
+            ret = self.get_fingerprint(mols)
 
         if self.keepindices:
             ret = ret[:,self.keepindices]
 
         return ret
 
+    @property
+    def cacheable(self):
+        """Return True if the fingerprints can be stored in a `DescriptorCache` (only dense fingerprints)."""
+        return not self.sparse
+
     @property
     def keepindices(self):
         """Return the indices of the fingerprint to keep."""
@@ -130,10 +161,23 @@ class FingerprintSet(DescriptorSet):
         """Return True if descriptorset is fingerprint."""
         return self._is_fp
 
+    @property
+    def dtype(self):
+        """Return the data type of the fingerprint."""
+        return self.get_fingerprint.dtype
+
+    @property
+    def batchSize(self):
+        """Return the preferred number of molecules calculated at once (i.e. for CDK fingerprints)."""
+        return getattr(self.get_fingerprint, "batchSize", None)
+
     @property
     def settings(self):
         """Return dictionary with arguments used to initialize the descriptorset."""
-        return {"fingerprint_type": self.fingerprint_type, **self.get_fingerprint.settings}
+        settings = {"fingerprint_type": self.fingerprint_type, **self.get_fingerprint.settings}
+        if self.sparse:
+            settings["sparse"] = True
+        return settings
 
     def get_len(self):
         """Return the length of the fingerprint."""
@@ -154,19 +198,33 @@ class FingerprintSet(DescriptorSet):
         self.keepindices(value)
 
 
+@lru_cache(maxsize=None)
+def get_mordred_descriptors() -> Dict[str, mordred.Descriptor]:
+    """Get the instances of all Mordred descriptors by their names. The instances are only created once per process.
+
+    Returns:
+        dict: descriptor instances by name in the default order of Mordred
+    """
+    return {str(desc): desc for desc in mordred.Calculator(mordreddescriptors).descriptors}
+
+
 class Mordred(DescriptorSet):
     """Descriptors from molecular descriptor calculation software Mordred.
 
     From https://github.com/mordred-descriptor/mordred.
 
+    The Mordred calculator is created for the selected descriptors when it is first needed, so Mordred only
+    calculates these and the descriptors they depend on.
+
     Args:
         descs (list): list of mordred descriptor names
         version (str): version of mordred
         ignore_3D (bool): ignore 3D information
         config (str): path to config file
+        nJobs (int): number of processes used by Mordred when the set is not calculated in a worker process
     """
 
-    def __init__(self, descs=None, version=None, ignore_3D=False, config=None):
+    def __init__(self, descs=None, version=None, ignore_3D=False, config=None, n_jobs=1):
         """
         Initialize the descriptor with the same arguments as you would pass to `Calculator` function of Mordred.
 
@@ -178,6 +236,8 @@ class Mordred(DescriptorSet):
             version (str): version of mordred
             ignore_3D (bool): ignore 3D information
             config (str): path to config file?
+            n_jobs (int): number of processes used by Mordred. Only used if the set is calculated in the main process
+                (i.e. not by `MoleculeTable` with `n_jobs > 1`), not saved with the settings of the set.
         """
         if descs:
             # if mordred descriptor module is passed, convert to list of descriptor instances
@@ -185,21 +245,34 @@ class Mordred(DescriptorSet):
                 descs = (mordred.Calculator(descs).descriptors)
         else:
             # use all mordred descriptors if no descriptors are specified
-            descs = mordred.Calculator(mordreddescriptors).descriptors
+            descs = list(get_mordred_descriptors())
 
         self.version = version
         self.ignore_3D = ignore_3D
         self.config = config
+        self.nJobs = n_jobs
 
         self._is_fp = False
 
         self._mordred = None
 
-        # convert to list of descriptor names if descriptor instances are passed and initiate mordred calulator
+        # convert to list of descriptor names if descriptor instances are passed
         self.descriptors = [str(d) for d in descs]
 
     def __call__(self, mols):
-        return self._mordred.pandas(self.iterMols(mols), quiet=True, nproc=1).values
+        # worker processes are already parallel and cannot always start their own processes
+        n_jobs = self.nJobs if multiprocessing.parent_process() is None else 1
+        return self.calculator.pandas(self.iterMols(mols, to_list=True), quiet=True, nproc=n_jobs).values
+
+    @property
+    def calculator(self) -> mordred.Calculator:
+        """The Mordred calculator of the selected descriptors in the order of `descriptors`."""
+        if self._mordred is None:
+            instances = get_mordred_descriptors()
+            self._mordred = mordred.Calculator(
+                [instances[name] for name in self._descriptors if name in instances],
+                version=self.version, ignore_3D=self.ignore_3D, config=self.config)
+        return self._mordred
 
     @property
     def is_fp(self):
@@ -215,18 +288,12 @@ class Mordred(DescriptorSet):
 
     @descriptors.setter
     def descriptors(self, names):
-        """Set the descriptors to calculate.
-
-        Converts a list of Mordred descriptor names to Mordred descriptor instances which is used to initialize the
-        a Mordred calculator with the specified descriptors.
+        """Set the descriptors to calculate. The Mordred calculator is created again when it is needed.
 
         Args:
             names: List of Mordred descriptor names.
         """
-        calc = mordred.Calculator(mordreddescriptors)
-        self._mordred = mordred.Calculator(
-            [d for d in calc.descriptors if str(d) in names],
-            version=self.version, ignore_3D=self.ignore_3D, config=self.config)
+        self._mordred = None
         self._descriptors = names
 
     def __str__(self):
@@ -319,6 +386,9 @@ class TanimotoDistances(DescriptorSet):
     """
     Calculate Tanimoto distances to a list of SMILES sequences.
 
+    The fingerprints of the SMILES sequences are kept in a `TanimotoIndex`, which calculates the distances
+    for blocks of molecules at once.
+
     Args:
         list_of_smiles (list of strings): list of SMILES sequences to calculate distance to
         fingerprint_type (str): fingerprint type to use
@@ -347,21 +417,15 @@ class TanimotoDistances(DescriptorSet):
         """Calculate the Tanimoto distances to the list of SMILES sequences.
 
         Args:
-            mols (List[str] or List[rdkit.Chem.rdchem.Mol]): SMILES sequences or RDKit molecules to calculate distances to
+            mols (List[str], List[bytes] or List[rdkit.Chem.rdchem.Mol]): SMILES sequences, binary molecules or RDKit
+                molecules to calculate distances to
         """
-        mols = [Chem.MolFromSmiles(mol) if isinstance(mol, str) else mol for mol in mols]
-        # Convert np.arrays to BitVects
-        fps = list(map(lambda x: DataStructs.CreateFromBitString(''.join(map(str, x))),
-                   self.get_fingerprint(mols)))
-        return [list(1 - np.array(DataStructs.BulkTanimotoSimilarity(fp, self.fps)))
-                for fp in fps]
+        mols = [to_mol(mol) for mol in mols]
+        return self.index.distances(self.get_fingerprint(mols))
 
     def calculate_fingerprints(self, list_of_smiles):
-        """Calculate the fingerprints for the list of SMILES sequences."""
-        # Convert np.arrays to BitVects
-        self.fps = list(map(lambda x: DataStructs.CreateFromBitString(''.join(map(str, x))),
-                            self.get_fingerprint([Chem.MolFromSmiles(smiles) for smiles in list_of_smiles])
-                            ))
+        """Calculate the fingerprints for the list of SMILES sequences and index them."""
+        self.index = TanimotoIndex(self.get_fingerprint([Chem.MolFromSmiles(smiles) for smiles in list_of_smiles]))
 
     @property
     def is_fp(self):
@@ -381,7 +445,7 @@ class TanimotoDistances(DescriptorSet):
         """Set new list of SMILES sequences to calculate distance to."""
         self._descriptors = list_of_smiles
         self.list_of_smiles = list_of_smiles
-        self.fps = self.calculate_fingerprints(self.list_of_smiles)
+        self.calculate_fingerprints(self.list_of_smiles)
 
     def __str__(self):
         return "TanimotoDistances"
@@ -393,8 +457,13 @@ class Mold2(DescriptorSet):
     From https://github.com/OlivierBeq/Mold2_pywrapper.
     Initialize the descriptor with no arguments.
     All descriptors are always calculated.
+
+    Mold2 is started for every call, so molecules are calculated in large batches (`batchSize`). Molecules for which
+    Mold2 fails get `NaN` values instead of failing the whole batch.
     """
 
+    batchSize = 1000
+
     def __init__(self, descs: Optional[List[str]] = None):
         """Initialize a PaDEL calculator.
 
@@ -409,10 +478,15 @@ class Mold2(DescriptorSet):
         self._keepindices = list(range(len(self._descriptors)))
 
     def __call__(self, mols):
-        values = self._mold2.calculate(self.iterMols(mols), show_banner=False)
+        return calculate_isolated(
+            self._calculateBatch, self.iterMols(mols, to_list=True), len(self._descriptors),
+            batch_size=self.batchSize, name=str(self))
+
+    def _calculateBatch(self, mols):
+        """Calculate the descriptors of a batch of molecules with one call to Mold2."""
+        values = self._mold2.calculate(mols, show_banner=False)
         # Drop columns
-        values = values[self._descriptors].values
-        return values
+        return values[self._descriptors]
 
     @property
     def is_fp(self):
@@ -422,6 +496,11 @@ class Mold2(DescriptorSet):
     def settings(self):
         return {'descs': self._descs}
 
+    @property
+    def keepindices(self):
+        """Return the indices of the kept descriptors in the output of Mold2."""
+        return self._keepindices
+
     @property
     def descriptors(self):
         return self._descriptors
@@ -454,8 +533,14 @@ class PaDEL(DescriptorSet):
     """Descriptors from molecular descriptor calculation software PaDEL.
 
     From https://github.com/OlivierBeq/PaDEL_pywrapper.
+
+    PaDEL starts a Java virtual machine for every call, so molecules are calculated in large batches (`batchSize`).
+    Molecules for which PaDEL fails get `NaN` values instead of failing the whole batch. The calculation time per
+    molecule can be limited with the `timeout` of `DescriptorsCalculator`.
     """
 
+    batchSize = 1000
+
     def __init__(self, descs: Optional[List[str]] = None, ignore_3D: bool = True):
         """Initialize a PaDEL calculator
 
@@ -485,11 +570,15 @@ class PaDEL(DescriptorSet):
             self.descriptors = descs
 
     def __call__(self, mols):
-        mols = [Chem.AddHs(mol) for mol in self.iterMols(mols)]
+        mols = [Chem.AddHs(mol) if mol is not None else None for mol in self.iterMols(mols)]
+        return calculate_isolated(
+            self._calculateBatch, mols, len(self._keep), batch_size=self.batchSize, name=str(self))
+
+    def _calculateBatch(self, mols):
+        """Calculate the descriptors of a batch of molecules with one call to PaDEL."""
         values = self._padel.calculate(mols, show_banner=False, njobs=1)
-        intersection = list(set(self._keep).intersection(values.columns))
-        values = values[intersection]
-        return values
+        # keep the order of the descriptor names, descriptors missing from the output are NaN
+        return values.reindex(columns=self._keep)
 
     @property
     def is_fp(self):
@@ -527,6 +616,8 @@ class PaDEL(DescriptorSet):
 class PredictorDesc(DescriptorSet):
     """DescriptorSet that uses a Predictor object to calculate the descriptors for a molecule."""
 
+    cacheable = False  # the model behind the meta file can change
+
     def __init__(self, model : Union["QSPRModel", str]):
         """
         Initialize the descriptorset with a `QSPRModel` object.
@@ -548,14 +639,14 @@ class PredictorDesc(DescriptorSet):
         Calculate the descriptor for a list of molecules.
 
         Args:
-            mols (list): list of smiles or rdkit molecules
+            mols (list): list of smiles, binary molecules or rdkit molecules
 
         Returns:
             an array of descriptor values
         """
         mols = list(mols)
         if type(mols[0]) != str:
-            mols = [Chem.MolToSmiles(mol) for mol in mols]
+            mols = [Chem.MolToSmiles(to_mol(mol)) for mol in mols]
         return self.model.predictMols(mols, use_probas=False)
 
     @property
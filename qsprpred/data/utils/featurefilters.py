@@ -7,6 +7,7 @@ import numpy as np
 import pandas as pd
 from boruta import BorutaPy
 from qsprpred.data.interfaces import featurefilter
+from qsprpred.data.utils.sparse_features import has_sparse, to_matrix
 from qsprpred.logs import logger
 from sklearn.ensemble import RandomForestRegressor
 from sklearn.preprocessing import MinMaxScaler
@@ -26,8 +27,11 @@ class lowVarianceFilter(featurefilter):
 
         # scale values between 0 and 1
         colnames = df.columns
-        data_scaled = MinMaxScaler().fit_transform(X=df.values)
-        variance = data_scaled.var(axis=0, ddof=1)
+        if has_sparse(df):
+            variance = self.sparseVariance(to_matrix(df))
+        else:
+            data_scaled = MinMaxScaler().fit_transform(X=df.values)
+            variance = data_scaled.var(axis=0, ddof=1)
 
         low_var_cols = np.where(variance < self.th)[0]
 
@@ -40,6 +44,27 @@ class lowVarianceFilter(featurefilter):
 
         return df
 
+    @staticmethod
+    def sparseVariance(X) -> np.ndarray:
+        """Variance of the columns of a sparse matrix after MinMax scaling without creating the dense matrix.
+
+        Args:
+            X (sparse.csr_matrix): the features
+
+        Returns:
+            np.ndarray: variance of each column (with `ddof=1`), the same as after `MinMaxScaler`
+        """
+        n_rows = X.shape[0]
+        mean = np.asarray(X.mean(axis=0), dtype=float).ravel()
+        mean_sq = np.asarray(X.multiply(X).mean(axis=0), dtype=float).ravel()
+        value_range = (X.max(axis=0).toarray().ravel() - X.min(axis=0).toarray().ravel()).astype(float)
+        variance = (mean_sq - mean ** 2) * n_rows / max(n_rows - 1, 1)
+        # constant columns are not scaled by MinMaxScaler and have zero variance
+        constant = value_range == 0
+        variance[constant] = 0
+        value_range[constant] = 1
+        return variance / value_range ** 2
+
 
 class highCorrelationFilter(featurefilter):
     """Remove features with correlation higher than a given threshold.
@@ -53,7 +78,10 @@ class highCorrelationFilter(featurefilter):
 
     def __call__(self, df: pd.DataFrame, y_col : pd.DataFrame = None) -> pd.DataFrame:
         # make absolute, because we also want to filter out large negative correlation
-        correlation = np.triu(np.abs(np.corrcoef(df.values.astype(float).T)), k=1)
+        if has_sparse(df):
+            correlation = np.triu(np.abs(self.sparseCorrelation(to_matrix(df))), k=1)
+        else:
+            correlation = np.triu(np.abs(np.corrcoef(df.values.astype(float).T)), k=1)
         high_corr = np.where(np.any(correlation > self.th, axis=0))
 
         logger.info(
@@ -64,6 +92,26 @@ class highCorrelationFilter(featurefilter):
 
         return df
 
+    @staticmethod
+    def sparseCorrelation(X) -> np.ndarray:
+        """Pearson correlation between the columns of a sparse matrix without creating the dense matrix.
+
+        Args:
+            X (sparse.csr_matrix): the features
+
+        Returns:
+            np.ndarray: correlation matrix of the columns, `nan` for constant columns like `np.corrcoef`
+        """
+        n_rows = X.shape[0]
+        X = X.astype(float)
+        mean = np.asarray(X.mean(axis=0)).ravel()
+        covariance = (np.asarray((X.T @ X).todense()) - n_rows * np.outer(mean, mean)) / max(n_rows - 1, 1)
+        std = np.sqrt(np.clip(np.diag(covariance), 0, None))
+        # constant columns have no defined correlation, rounding errors would otherwise give large values
+        std[(X.max(axis=0).toarray().ravel() - X.min(axis=0).toarray().ravel()) == 0] = np.nan
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return covariance / np.outer(std, std)
+
 
 class BorutaFilter(featurefilter):
     """Boruta filter from BorutaPy: find all features carrying information for prediction.
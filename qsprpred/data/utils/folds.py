@@ -5,36 +5,60 @@ Created by: Martin Sicho
 On: 23.01.23, 13:52
 """
 from qsprpred.data.interfaces import datasplit
-from qsprpred.data.utils.feature_standardization import apply_feature_standardizer
+from qsprpred.data.utils.feature_standardization import SKLearnStandardizer, apply_feature_standardizer
+from qsprpred.data.utils.sparse_features import to_matrix
+from qsprpred.data.utils.storage import positions_to_slice
+from sklearn.base import clone
 
 
 class Folds:
 
     @staticmethod
-    def toArrays(X, y):
+    def takeRows(arr, index):
         """
-        Convert data frames X and y to numpy arrays.
+        Select rows of an array. If the rows form a contiguous block, a view of the array is returned instead of a copy.
+
+        Arguments:
+            arr (np.ndarray): array to select from
+            index (np.ndarray): positions of the rows to select
+
+        Returns:
+            np.ndarray: the selected rows
+        """
+
+        rows = positions_to_slice(index)
+        return arr[rows] if rows is not None else arr[index]
+
+    @staticmethod
+    def toArrays(X, y, sparse_input=True):
+        """
+        Convert data frames X and y to numpy arrays. Data frames with a single data type are not copied.
+        Features with sparse columns are converted to a sparse CSR matrix.
 
         Arguments:
             X (pd.DataFrame): feature matrix as a DataFrame
             y (pd.Series): target values
+            sparse_input (bool): keep sparse features sparse, otherwise they are converted to a dense array
 
         Returns:
-            tuple: (X, y) as numpy arrays
+            tuple: (X, y) as numpy arrays (X as a CSR matrix if sparse)
         """
 
-        return X.values, y.values
+        return to_matrix(X, sparse_input), y.values
 
     def _standardize_folds(self, folds):
         """
         A generator that fits and applies feature standardizers to each fold returned. They are properly fitted on the training set
-        and applied to the test set.
+        and applied to the test set. Each fold is standardized with its own copy of the standardizer, so the standardizer
+        passed to the constructor is not refitted.
 
         """
 
+        scaler = self.featureStandardizer
+        if isinstance(scaler, SKLearnStandardizer):
+            scaler = scaler.getInstance()
         for X_train, X_test, y_train, y_test, train_index, test_index in folds:
-            X_train, standardizer = apply_feature_standardizer(
-                self.featureStandardizer, X_train, fit=True)
+            X_train, standardizer = apply_feature_standardizer(clone(scaler), X_train, fit=True)
             X_test, _ = apply_feature_standardizer(standardizer, X_test, fit=False)
             yield X_train, X_test, y_train, y_test, train_index, test_index
 
@@ -49,11 +73,13 @@ class Folds:
             generator: a generator that yields a tuple of (X_train, X_test, y_train, y_test, train_index, test_index)
         """
 
-        X_arr, y_arr = self.toArrays(X, y)
+        # feature standardizers need dense features
+        X_arr, y_arr = self.toArrays(X, y, sparse_input=not self.featureStandardizer)
         folds = self.split.split(X_arr, y_arr)
 
         for train_index, test_index in folds:
-            yield X_arr[train_index, :], X_arr[test_index, :], y_arr[train_index], y_arr[test_index], train_index, test_index
+            yield self.takeRows(X_arr, train_index), self.takeRows(X_arr, test_index), y_arr[train_index], \
+                y_arr[test_index], train_index, test_index
 
     def __init__(self, split : datasplit, feature_standardizer=None):
         self.split = split
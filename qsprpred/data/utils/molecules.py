@@ -0,0 +1,56 @@
+"""Conversion between the representations of molecules used in data sets.
+
+Molecules can be given as SMILES, RDKit molecules or RDKit binary molecules (`Mol.ToBinary`). Binary
+molecules are stored in the data frame of a `MoleculeTable` if `store_mols=True` so that they are parsed
+only once and can be sent to worker processes cheaply.
+"""
+from typing import Optional, Union
+
+from rdkit import Chem
+from rdkit.Chem import Mol
+
+
+def to_mol(mol: Union[str, bytes, Mol]) -> Optional[Mol]:
+    """Convert a molecule to an RDKit molecule.
+
+    Args:
+        mol (str, bytes, Mol): SMILES, binary molecule or RDKit molecule
+
+    Returns:
+        Mol: the RDKit molecule, `None` if the molecule is invalid or missing
+    """
+    if isinstance(mol, str):
+        return Chem.MolFromSmiles(mol)
+    elif isinstance(mol, bytes):
+        return Chem.Mol(mol)
+    elif isinstance(mol, Mol):
+        return mol
+    return None
+
+
+def to_binary(mol: Optional[Mol]) -> Optional[bytes]:
+    """Convert an RDKit molecule to its binary representation.
+
+    Args:
+        mol (Mol): the RDKit molecule
+
+    Returns:
+        bytes: the binary molecule, `None` if the molecule is `None`
+    """
+    return mol.ToBinary() if mol is not None else None
+
+
+def to_inchikey(mol: Union[str, bytes, Mol]) -> Optional[str]:
+    """Get the InChIKey of a molecule.
+
+    Args:
+        mol (str, bytes, Mol): SMILES, binary molecule or RDKit molecule
+
+    Returns:
+        str: the InChIKey, `None` if the molecule is invalid or missing
+    """
+    mol = to_mol(mol)
+    if mol is None:
+        return None
+    key = Chem.MolToInchiKey(mol)
+    return key if key else None
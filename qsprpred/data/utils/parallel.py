@@ -0,0 +1,330 @@
+"""Persistent worker pools used to parallelize operations on data sets."""
+import concurrent.futures
+import hashlib
+import os
+import pickle
+import sys
+from collections import OrderedDict
+from multiprocessing import shared_memory
+from typing import Any, Callable, Iterable, Iterator, List, Tuple, Union
+
+import numpy as np
+from tqdm.auto import tqdm
+
+# functions loaded by the current worker process by their key
+_worker_funcs = OrderedDict()
+_max_funcs = 8
+
+
+def _attach_shared_memory(name: str) -> shared_memory.SharedMemory:
+    """Attach to a shared memory block created by the main process without taking ownership of it.
+
+    From Python 3.13 on, the block is not registered with the resource tracker (`track=False`). Older versions
+    always register it, but the workers share the resource tracker of the main process, so the registration is
+    not added twice and the block is only unlinked by the main process. Unregistering the block in the worker
+    would remove the registration of the main process instead.
+
+    Args:
+        name (str): name of the block
+
+    Returns:
+        SharedMemory: the attached block
+    """
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    return shared_memory.SharedMemory(name=name)
+
+
+def _take_array(shm: shared_memory.SharedMemory, shape: Tuple[int, ...], dtype: np.dtype) -> np.ndarray:
+    """Turn a shared memory block into an array that owns its memory. The block is unlinked and its mapping is
+    handed over to the array, so that the values are not copied and the memory is released with the array.
+
+    Args:
+        shm (SharedMemory): the block created by this process, must not be used by other processes anymore
+        shape (tuple): shape of the array
+        dtype (np.dtype): data type of the array
+
+    Returns:
+        np.ndarray: the array
+    """
+    array = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    shm.unlink()
+    # the array keeps the buffer and the mapping alive, closing the block only closes its file descriptor
+    shm._buf = None
+    shm._mmap = None
+    shm.close()
+    return array
+
+
+def _get_worker_func(func_key: str, func_block: str, func_size: int) -> Callable:
+    """Get a function registered with the pool. The function is unpickled from shared memory only the first time
+    it is used by the worker.
+
+    Args:
+        func_key (str): key of the function
+        func_block (str): name of the shared memory block with the pickled function
+        func_size (int): size of the pickled function in bytes
+
+    Returns:
+        callable: the function
+    """
+    if func_key not in _worker_funcs:
+        shm = _attach_shared_memory(func_block)
+        try:
+            _worker_funcs[func_key] = pickle.loads(bytes(shm.buf[:func_size]))
+        finally:
+            shm.close()
+        while len(_worker_funcs) > _max_funcs:
+            _worker_funcs.popitem(last=False)
+    return _worker_funcs[func_key]
+
+
+def _apply_chunk(func_ref: Tuple[str, str, int], data: Any) -> Any:
+    """Apply a registered function to one chunk of data."""
+    return _get_worker_func(*func_ref)(data)
+
+
+def _calculate_chunk(func_ref: Tuple[str, str, int], start: int, end: int, input_name: str, offsets_name: str,
+                     n_mols: int, output_name: str, n_cols: int, binary: bool = False, dtype: str = "float64",
+                     codes_name: str = None, n_codes: int = 0) -> int:
+    """Apply a registered function to a range of molecules read from shared memory and write the results
+    directly to the shared output matrix.
+
+    Args:
+        func_ref (tuple): key, shared memory block and size of the function (see `WorkerPool.register`)
+        start (int): index of the first molecule
+        end (int): index after the last molecule
+        input_name (str): name of the shared memory block with the encoded molecules
+        offsets_name (str): name of the shared memory block with the offsets of each molecule in the input block
+        n_mols (int): total number of molecules
+        output_name (str): name of the shared memory block of the output matrix
+        n_cols (int): number of columns of the output matrix
+        binary (bool): the molecules are binary RDKit molecules instead of SMILES
+        dtype (str): data type of the output matrix
+        codes_name (str): name of the shared memory block of the `int8` status codes, if the function
+            returns the values together with status codes
+        n_codes (int): number of status codes per molecule
+
+    Returns:
+        int: number of processed molecules
+    """
+    input_shm = _attach_shared_memory(input_name)
+    offsets_shm = _attach_shared_memory(offsets_name)
+    output_shm = _attach_shared_memory(output_name)
+    codes_shm = _attach_shared_memory(codes_name) if codes_name else None
+    try:
+        offsets = np.ndarray((n_mols + 1,), dtype=np.int64, buffer=offsets_shm.buf)
+        encoded = bytes(input_shm.buf[offsets[start]:offsets[end]])
+        bounds = offsets[start:end + 1] - offsets[start]
+        mols = [encoded[bounds[i]:bounds[i + 1]] for i in range(end - start)]
+        # empty entries are missing molecules
+        mols = [(mol if binary else mol.decode()) if mol else None for mol in mols]
+        output = np.ndarray((n_mols, n_cols), dtype=dtype, buffer=output_shm.buf)
+        values = _get_worker_func(*func_ref)(mols)
+        if codes_shm is not None:
+            values, chunk_codes = values
+            codes = np.ndarray((n_mols, n_codes), dtype=np.int8, buffer=codes_shm.buf)
+            codes[start:end] = np.asarray(chunk_codes, dtype=np.int8).reshape(end - start, n_codes)
+            del codes
+        output[start:end] = np.asarray(values, dtype=dtype).reshape(end - start, n_cols)
+        del output, offsets
+    finally:
+        input_shm.close()
+        offsets_shm.close()
+        output_shm.close()
+        if codes_shm is not None:
+            codes_shm.close()
+    return end - start
+
+
+class WorkerPool:
+    """A pool of worker processes that is kept alive between calls.
+
+    Applied functions are pickled only once and shared with the workers via shared memory, each worker
+    unpickles a function the first time it needs it instead of receiving it with every chunk of data.
+    Chunks are submitted dynamically so that workers do not wait for slow chunks of other workers.
+
+    Attributes:
+        nWorkers (int): number of worker processes
+    """
+
+    def __init__(self, n_workers: int = None):
+        """Initialize the pool. No processes are started until the pool is used.
+
+        Args:
+            n_workers (int): number of worker processes, all available cores if `None`
+        """
+        self.nWorkers = n_workers if n_workers else os.cpu_count()
+        self._executor = None
+        self._funcs = OrderedDict()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_executor"] = None
+        state["_funcs"] = OrderedDict()
+        return state
+
+    def __del__(self):
+        self.shutdown(wait=False)
+
+    @property
+    def executor(self) -> concurrent.futures.ProcessPoolExecutor:
+        """The executor of the pool, started on first use."""
+        if self._executor is None:
+            self._executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.nWorkers)
+        return self._executor
+
+    def register(self, func: Callable) -> Tuple[str, str, int]:
+        """Share a function with the workers. The same function in the same state is only shared once.
+
+        Args:
+            func (callable): the function to apply, must be picklable
+
+        Returns:
+            tuple: key of the function, name of its shared memory block and size of the pickled function
+        """
+        func_bytes = pickle.dumps(func)
+        func_key = hashlib.sha1(func_bytes).hexdigest()
+        if func_key not in self._funcs:
+            shm = shared_memory.SharedMemory(create=True, size=len(func_bytes))
+            shm.buf[:len(func_bytes)] = func_bytes
+            self._funcs[func_key] = (shm, len(func_bytes))
+            while len(self._funcs) > _max_funcs:
+                _, (old_shm, _) = self._funcs.popitem(last=False)
+                old_shm.close()
+                old_shm.unlink()
+        else:
+            self._funcs.move_to_end(func_key)
+        shm, size = self._funcs[func_key]
+        return func_key, shm.name, size
+
+    def shutdown(self, wait: bool = True):
+        """Stop the worker processes and release the shared functions.
+
+        Args:
+            wait (bool): wait for the processes to finish
+        """
+        if getattr(self, "_executor", None) is not None:
+            self._executor.shutdown(wait=wait)
+            self._executor = None
+        for shm, _ in getattr(self, "_funcs", {}).values():
+            shm.close()
+            shm.unlink()
+        self._funcs = OrderedDict()
+
+    def submitAll(self, tasks: Iterable[Tuple], desc: str = None, total: int = None) -> Iterator[Tuple[int, Any]]:
+        """Submit tasks to the workers and yield their results as soon as they are done. Only a limited
+        number of tasks is pending at once to keep the memory usage bounded.
+
+        Args:
+            tasks (iterable): tuples of the submitted function and its arguments
+            desc (str): description of the progress bar
+            total (int): number of tasks
+
+        Yields:
+            tuple: index of the task and its result
+        """
+        max_pending = 2 * self.nWorkers
+        pending = {}
+        tasks = enumerate(tasks)
+        with tqdm(total=total, desc=desc) as progress:
+            while True:
+                for idx, task in tasks:
+                    pending[self.executor.submit(*task)] = idx
+                    if len(pending) >= max_pending:
+                        break
+                if not pending:
+                    break
+                done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    progress.update(1)
+                    yield pending.pop(future), future.result()
+
+    def map(self, func: Callable, chunks: List[Any], desc: str = None) -> List[Any]:
+        """Apply a function to each chunk of data.
+
+        Args:
+            func (callable): the function to apply, must be picklable
+            chunks (list): the chunks of data
+            desc (str): description of the progress bar
+
+        Returns:
+            list: results in the order of the chunks
+        """
+        func_ref = self.register(func)
+        results = [None] * len(chunks)
+        for idx, result in self.submitAll(
+                ((_apply_chunk, func_ref, chunk) for chunk in chunks), desc=desc, total=len(chunks)):
+            results[idx] = result
+        return results
+
+    def calculate(self, func: Callable, mols: List[Union[str, bytes]], n_cols: int, chunk_size: int,
+                  desc: str = None, dtype=np.float64,
+                  n_codes: int = 0) -> Union[np.ndarray, Tuple[np.ndarray, np.ndarray]]:
+        """Apply a function that calculates a fixed number of values per molecule (i.e. a `DescriptorsCalculator`)
+        to a list of SMILES or binary RDKit molecules. The molecules are sent to the workers via shared memory
+        and the workers write their results directly into a shared output matrix so that no data frames need
+        to be pickled. The returned matrix takes over the memory of the shared output matrix instead of copying it.
+
+        Args:
+            func (callable): the function to apply, takes a list of molecules and returns an array-like of shape
+                (n_mols, n_cols)
+            mols (list): the SMILES or binary molecules (`Mol.ToBinary`), missing molecules are passed as `None`
+            n_cols (int): number of values calculated per molecule
+            chunk_size (int): number of molecules in each chunk
+            desc (str): description of the progress bar
+            dtype: data type of the calculated values (i.e. `np.uint8` for fingerprints)
+            n_codes (int): number of `int8` status codes per molecule, if not 0 the function returns a tuple of
+                the values and the codes of shape (n_mols, n_codes) (i.e. `DescriptorsCalculator.calculateWithErrors`)
+
+        Returns:
+            np.ndarray: the calculated values as a matrix of shape (n_mols, n_cols), and the status codes as a matrix
+                of shape (n_mols, n_codes) if `n_codes` is not 0
+        """
+        dtype = np.dtype(dtype)
+        n_mols = len(mols)
+        if n_mols == 0:
+            output = np.empty((0, n_cols), dtype=dtype)
+            return (output, np.empty((0, n_codes), dtype=np.int8)) if n_codes else output
+        func_ref = self.register(func)
+        binary = any(isinstance(mol, bytes) for mol in mols)
+        encoded = [
+            (mol if isinstance(mol, bytes) else mol.encode()) if isinstance(mol, (str, bytes)) else b""
+            for mol in mols
+        ]
+        offsets = np.zeros(n_mols + 1, dtype=np.int64)
+        np.cumsum([len(mol) for mol in encoded], out=offsets[1:])
+        blocks = []
+        try:
+            input_shm = shared_memory.SharedMemory(create=True, size=max(1, int(offsets[-1])))
+            blocks.append(input_shm)
+            input_shm.buf[:offsets[-1]] = b"".join(encoded)
+            del encoded
+            offsets_shm = shared_memory.SharedMemory(create=True, size=offsets.nbytes)
+            blocks.append(offsets_shm)
+            np.ndarray(offsets.shape, dtype=offsets.dtype, buffer=offsets_shm.buf)[:] = offsets
+            output_shm = shared_memory.SharedMemory(create=True, size=max(1, n_mols * n_cols * dtype.itemsize))
+            blocks.append(output_shm)
+            codes_shm = None
+            if n_codes:
+                codes_shm = shared_memory.SharedMemory(create=True, size=max(1, n_mols * n_codes))
+                blocks.append(codes_shm)
+
+            starts = range(0, n_mols, chunk_size)
+            tasks = (
+                (_calculate_chunk, func_ref, start, min(start + chunk_size, n_mols), input_shm.name, offsets_shm.name,
+                 n_mols, output_shm.name, n_cols, binary, dtype.str, codes_shm.name if codes_shm else None, n_codes)
+                for start in starts
+            )
+            for _ in self.submitAll(tasks, desc=desc, total=len(starts)):
+                pass
+            blocks.remove(output_shm)
+            output = _take_array(output_shm, (n_mols, n_cols), dtype)
+            if codes_shm is not None:
+                blocks.remove(codes_shm)
+                codes = _take_array(codes_shm, (n_mols, n_codes), np.int8)
+        finally:
+            for block in blocks:
+                block.close()
+                block.unlink()
+        return (output, codes) if n_codes else output
@@ -6,6 +6,8 @@ On: 05.10.22, 10:07
 """
 from abc import ABC, abstractmethod
 
+from qsprpred.data.utils.molecules import to_mol
+
 class Scaffold(ABC):
     """
     Abstract base class for calculating molecular scaffolds of different kinds.
@@ -17,7 +19,7 @@ class Scaffold(ABC):
         Calculate the scaffold for a molecule.
 
         Args:
-            mol: smiles or rdkit molecule
+            mol: smiles, binary molecule or rdkit molecule
 
         Returns:
             smiles of the scaffold
@@ -35,7 +37,7 @@ class Murcko(Scaffold):
         Calculate the Murcko scaffold for a molecule.
 
         Args:
-            mol: SMILES as `str` or an instance of `Mol`
+            mol: SMILES as `str`, binary molecule as `bytes` or an instance of `Mol`
 
         Returns:
             SMILES of the Murcko scaffold as `str`
@@ -43,7 +45,7 @@ class Murcko(Scaffold):
 
         from rdkit import Chem
         from rdkit.Chem.Scaffolds import MurckoScaffold
-        mol = Chem.MolFromSmiles(mol) if isinstance(mol, str) else mol
+        mol = to_mol(mol)
         scaff = MurckoScaffold.GetScaffoldForMol(mol)
         return Chem.MolToSmiles(scaff)
 
@@ -91,14 +93,14 @@ class BemisMurcko(Scaffold):
         Calculate the Bemis-Murcko scaffold for a molecule.
 
         Args:
-            mol: SMILES as `str` or an instance of `Mol`
+            mol: SMILES as `str`, binary molecule as `bytes` or an instance of `Mol`
 
         Returns:
             SMILES of the Bemis-Murcko scaffold as `str`
         """
 
         from rdkit import Chem
-        mol = Chem.MolFromSmiles(mol) if isinstance(mol, str) else mol
+        mol = to_mol(mol)
         only_HA = Chem.rdmolops.RemoveHs(mol)
         rw_mol = Chem.RWMol(only_HA)
 
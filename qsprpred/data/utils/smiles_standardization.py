@@ -7,6 +7,25 @@ from rdkit import Chem
 from rdkit.Chem.SaltRemover import SaltRemover
 
 
+def chembl_standardize_mol(mol: Chem.Mol) -> tuple:
+    """Standardize an RDKit molecule with the 'chembl_structure_pipeline'.
+
+    Arguments:
+        mol: rdkit molecule to be standardized
+
+    Returns:
+        Tuple containing the parent molecule and a bool indicating if the standardizer
+        failed. If True -> standardizer failed..
+    """
+    standard_mol = standardizer.standardize_mol(mol)
+    result = standardizer.get_parent_mol(
+        standard_mol
+    )  # Tuple with molecule in #0 and Boolean in #1
+    # Boolean states whether there was an exclusion flag. For more details, check:
+    # https://github.com/chembl/ChEMBL_Structure_Pipeline/wiki/Exclusion-Flag
+    return result[0], bool(result[1])
+
+
 def chembl_smi_standardizer(smi: str) -> tuple:
     """Standardize a SMILES string.
     
@@ -22,20 +41,57 @@ def chembl_smi_standardizer(smi: str) -> tuple:
         failed. If True -> standardizer failed..
     """
     mol = Chem.MolFromSmiles(smi)
-    standard_mol = standardizer.standardize_mol(mol)
-    result = standardizer.get_parent_mol(
-        standard_mol
-    )  # Tuple with molecule in #0 and Boolean in #1
-    # Boolean states whether there was an exclusion flag. For more details, check:
-    # https://github.com/chembl/ChEMBL_Structure_Pipeline/wiki/Exclusion-Flag
-    parent_mol = result[0]
+    parent_mol, failed = chembl_standardize_mol(mol)
     parent_smi = Chem.MolToSmiles(
         parent_mol, kekuleSmiles=False, canonical=True, isomericSmiles=True
     )
-    if result[1]:
-        return parent_smi, True
-    else:
-        return parent_smi, False
+    return parent_smi, failed
+
+
+def clean_smiles(smi: str, standardize: bool = True, sanitize: bool = True, return_mol: bool = False) -> tuple:
+    """Standardize and/or sanitize a SMILES string and check if it is valid.
+
+    The molecule is parsed only once for all steps. It is only parsed again
+    if sanitization changes the SMILES or if the molecule of the cleaned SMILES
+    is requested to be reused in later steps.
+
+    Arguments:
+        smi: SMILES string to be cleaned.
+        standardize: standardize the molecule with the 'chembl_structure_pipeline'.
+        sanitize: sanitize the SMILES with `sanitize_smiles`.
+        return_mol: also return the RDKit molecule of the cleaned SMILES.
+
+    Returns:
+        Tuple containing the canonical cleaned SMILES and a bool indicating if the molecule
+        is valid (and the molecule itself if `return_mol` is set, `None` if invalid). The SMILES
+        is returned unchanged if it is invalid or if no cleaning is requested and it is `None`
+        if the molecule was rejected by sanitization.
+    """
+    def result(smi, mol):
+        return (smi, mol is not None, mol) if return_mol else (smi, mol is not None)
+
+    mol = Chem.MolFromSmiles(smi) if isinstance(smi, str) else None
+    if mol is None or (not standardize and not sanitize):
+        return result(smi, mol)
+    try:
+        if standardize:
+            mol = chembl_standardize_mol(mol)[0]
+        smi = Chem.MolToSmiles(mol, kekuleSmiles=False, canonical=True, isomericSmiles=True)
+        if sanitize:
+            sanitized = sanitize_smiles(smi, mol)
+            if sanitized is None:
+                return result(None, None)
+            if sanitized != smi:
+                mol = Chem.MolFromSmiles(sanitized)
+                if mol is None:
+                    return result(None, None)
+                smi = Chem.MolToSmiles(mol, kekuleSmiles=False, canonical=True, isomericSmiles=True)
+    except Exception:  # molecules the standardization pipeline cannot handle
+        return result(smi, None)
+    if return_mol:
+        # the returned molecule should be identical to the one parsed from the returned SMILES
+        mol = Chem.MolFromSmiles(smi)
+    return result(smi, mol)
 
 
 def neutralize_atoms(mol):
@@ -64,7 +120,7 @@ def neutralize_atoms(mol):
     return mol
 
 
-def sanitize_smiles(smi: str) -> str:
+def sanitize_smiles(smi: str, mol: Chem.Mol = None) -> str:
     """Sanitize a SMILES string.
 
     Removes sulfurs, extermal molecules and salts, neutralizes charges
@@ -72,6 +128,7 @@ def sanitize_smiles(smi: str) -> str:
     
     Arguments:
         smi: single SMILES string to be sanitized.
+        mol: the molecule of the SMILES if it is already parsed.
 
     Returns:
         sanitized SMILES string.
@@ -81,7 +138,7 @@ def sanitize_smiles(smi: str) -> str:
     boron_pattern = re.compile(r"B")
     remover = SaltRemover(defnData="[Cl,Br,Ca,K,Na,Zn]")
     pattern = Chem.MolFromSmarts("[+1!h0!$([*]~[-1,-2,-3,-4]),-1!$([*]~[+1,+2,+3,+4])]")
-    mol = Chem.MolFromSmiles(smi)
+    mol = Chem.MolFromSmiles(smi) if mol is None else mol
     # Removing sulfuric acid (smiles = .OS(=O)(=O)O)
     if s_acid_remover.findall(smi):
         smi = re.sub(s_acid_remover, "", smi)
@@ -0,0 +1,84 @@
+"""Conversion between sparse feature columns of data frames and the matrices passed to models.
+
+Fingerprint sets calculated with `sparse=True` are stored in the data frame as pandas sparse columns
+(`pd.SparseDtype`) and are converted to a SciPy CSR matrix only when they are handed to an estimator.
+"""
+from typing import Union
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+
+def has_sparse(X: Union[pd.DataFrame, np.ndarray, sparse.spmatrix]) -> bool:
+    """Check if features contain sparse columns.
+
+    Args:
+        X (pd.DataFrame, np.ndarray, sparse.spmatrix): the features
+
+    Returns:
+        bool: `True` if `X` is a sparse matrix or a data frame with at least one sparse column
+    """
+    if sparse.issparse(X):
+        return True
+    if isinstance(X, pd.DataFrame):
+        return any(isinstance(dtype, pd.SparseDtype) for dtype in X.dtypes)
+    return False
+
+
+def densify(X: pd.DataFrame) -> pd.DataFrame:
+    """Convert the sparse columns of a data frame to dense columns of the same data type.
+
+    Args:
+        X (pd.DataFrame): the data frame
+
+    Returns:
+        pd.DataFrame: the data frame with dense columns only, `X` itself if it has no sparse columns
+    """
+    sparse_columns = [col for col, dtype in X.dtypes.items() if isinstance(dtype, pd.SparseDtype)]
+    if not sparse_columns:
+        return X
+    dense = X[sparse_columns].sparse.to_dense()
+    return pd.concat([X.drop(columns=sparse_columns), dense], axis=1)[X.columns]
+
+
+def to_matrix(X: Union[pd.DataFrame, np.ndarray, sparse.spmatrix],
+              sparse_input: bool = True) -> Union[np.ndarray, sparse.csr_matrix]:
+    """Convert features to a matrix. Features with sparse columns become a CSR matrix, dense features
+    become an array without copying where possible.
+
+    Args:
+        X (pd.DataFrame, np.ndarray, sparse.spmatrix): the features
+        sparse_input (bool): keep sparse features sparse, if `False` a dense array is always returned
+
+    Returns:
+        np.ndarray or sparse.csr_matrix: the feature matrix, data frames with non-numeric columns
+        are always converted to a dense array
+    """
+    if sparse.issparse(X):
+        return X.tocsr() if sparse_input else X.toarray()
+    if not isinstance(X, pd.DataFrame):
+        return np.asarray(X)
+    if (not sparse_input or not has_sparse(X)
+            or not all(pd.api.types.is_numeric_dtype(dtype) for dtype in X.dtypes)):
+        return densify(X).values
+    dense_columns = {
+        col: pd.SparseDtype(dtype, 0) for col, dtype in X.dtypes.items() if not isinstance(dtype, pd.SparseDtype)
+    }
+    if dense_columns:
+        X = X.astype(dense_columns)
+    return X.sparse.to_coo().tocsr()
+
+
+def from_matrix(X: sparse.spmatrix, columns=None, index=None) -> pd.DataFrame:
+    """Create a data frame with sparse columns from a sparse matrix.
+
+    Args:
+        X (sparse.spmatrix): the sparse matrix
+        columns (list): names of the columns
+        index (pd.Index): labels of the rows
+
+    Returns:
+        pd.DataFrame: data frame with a sparse column of the data type of `X` for each column of `X`
+    """
+    return pd.DataFrame.sparse.from_spmatrix(X, index=index, columns=columns)
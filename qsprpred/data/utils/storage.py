@@ -0,0 +1,706 @@
+"""Storage backends for the data frames managed by `MoleculeTable`.
+
+The default backend pickles the whole data frame into a single file (`{name}_df.pkl`). The Parquet
+backend writes a directory (`{name}_df.parquet`) with one Parquet file per column group
+(properties, descriptors and scaffolds) so that each group can be read separately and only
+the requested columns need to be loaded from disk. Descriptors can also be kept outside of the data frame
+in a memory-mapped `DescriptorMatrix`.
+"""
+import json
+import os
+import shutil
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, List, Optional, Union
+
+import numpy as np
+import pandas as pd
+from qsprpred.data.utils.sparse_features import densify
+from qsprpred.logs import logger
+from rdkit import Chem
+
+COLUMN_GROUPS = ("properties", "descriptors", "scaffolds")
+
+
+def get_column_group(column: str) -> str:
+    """Get the name of the column group a column of a `MoleculeTable` data frame belongs to.
+
+    Args:
+        column (str): name of the column
+
+    Returns:
+        str: name of the column group (one of `COLUMN_GROUPS`)
+    """
+    if column.startswith("Descriptor_"):
+        return "descriptors"
+    elif column.startswith("Scaffold_") or column.startswith("ScaffoldGroup_"):
+        return "scaffolds"
+    else:
+        return "properties"
+
+
+class TableStorage(ABC):
+    """Interface for the on-disk storage of a `MoleculeTable` data frame.
+
+    Attributes:
+        storePrefix (str): path prefix of the data set files (`{store_dir}/{name}`)
+        extension (str): extension of the stored data frame, also used to identify the backend
+        appendable (bool): whether rows can be appended without rewriting the stored data frame
+        columnar (bool): whether single columns can be loaded without reading the whole data frame
+    """
+
+    extension = None
+    appendable = False
+    columnar = False
+
+    def __init__(self, store_prefix: str):
+        """Initialize the storage backend.
+
+        Args:
+            store_prefix (str): path prefix of the data set files (`{store_dir}/{name}`)
+        """
+        self.storePrefix = store_prefix
+
+    def __str__(self):
+        return self.__class__.__name__
+
+    @property
+    def path(self) -> str:
+        """Path to the stored data frame."""
+        return f"{self.storePrefix}_df.{self.extension}"
+
+    def exists(self) -> bool:
+        """Check if the data frame was already saved with this backend.
+
+        Returns:
+            bool: `True` if the data frame exists in store, `False` otherwise.
+        """
+        return os.path.exists(self.path)
+
+    def clear(self):
+        """Remove the stored data frame from disk."""
+        if os.path.isdir(self.path):
+            shutil.rmtree(self.path)
+        elif os.path.exists(self.path):
+            os.remove(self.path)
+
+    @staticmethod
+    def selectColumns(columns: List[str], groups: List[str] = None, prefix: str = None) -> List[str]:
+        """Select columns that belong to the given column groups and/or start with a given prefix.
+
+        Args:
+            columns (list): list of all columns
+            groups (list): names of column groups to select, all groups if `None`
+            prefix (str): prefix of the columns to select, all columns if `None`
+
+        Returns:
+            list: list of selected columns in their original order
+        """
+        return [
+            col for col in columns
+            if (groups is None or get_column_group(col) in groups)
+            and (prefix is None or col.startswith(prefix))
+        ]
+
+    @abstractmethod
+    def save(self, df: pd.DataFrame) -> str:
+        """Save the data frame to disk.
+
+        Args:
+            df (pd.DataFrame): data frame to save
+
+        Returns:
+            str: path to the saved data frame
+        """
+        pass
+
+    @abstractmethod
+    def load(self, groups: List[str] = None, columns: List[str] = None) -> pd.DataFrame:
+        """Load the data frame (or a part of it) from disk.
+
+        Args:
+            groups (list): names of column groups to load, all groups if `None`
+            columns (list): names of columns to load, all columns of the selected groups if `None`
+
+        Returns:
+            pd.DataFrame: the loaded data frame
+        """
+        pass
+
+    @abstractmethod
+    def getColumns(self) -> List[str]:
+        """Get the names of all columns in the stored data frame without loading it.
+
+        Returns:
+            list: names of the stored columns
+        """
+        pass
+
+
+class PickleStorage(TableStorage):
+    """Stores the whole data frame in a single pickle file. Column selection is only done after the full data frame
+    is read so this backend is best suited for small data sets.
+    """
+
+    extension = "pkl"
+
+    def save(self, df: pd.DataFrame) -> str:
+        df.to_pickle(self.path)
+        return self.path
+
+    def load(self, groups: List[str] = None, columns: List[str] = None) -> pd.DataFrame:
+        df = pd.read_pickle(self.path)
+        if groups is not None or columns is not None:
+            selected = self.selectColumns(df.columns, groups)
+            if columns is not None:
+                selected = [col for col in selected if col in columns]
+            df = df[selected]
+        return df
+
+    def getColumns(self) -> List[str]:
+        return self.load().columns.to_list()
+
+
+class ParquetStorage(TableStorage):
+    """Stores the data frame as a directory of Parquet files, one for each column group. Only the files and columns
+    that are requested are read from disk. Columns with RDKit molecules are saved as binary molecules and converted
+    back to `Chem.Mol` upon loading.
+
+    Rows can also be appended without rewriting the stored data (see `ParquetStorage.append`). Appended rows are
+    written as numbered parts of each column group and are concatenated upon loading. Rows appended with the label
+    of a stored row replace it in place. The parts are merged again the next time the whole data frame is saved.
+    """
+
+    extension = "parquet"
+    metaFile = "meta.json"
+    appendable = True
+    columnar = True
+
+    def groupPath(self, group: str) -> str:
+        """Path to the Parquet file of a given column group.
+
+        Args:
+            group (str): name of the column group
+
+        Returns:
+            str: path to the file
+        """
+        return os.path.join(self.path, f"{group}.parquet")
+
+    def partPath(self, group: str, part: int) -> str:
+        """Path to the Parquet file of an appended part of a given column group.
+
+        Args:
+            group (str): name of the column group
+            part (int): number of the part
+
+        Returns:
+            str: path to the file
+        """
+        return os.path.join(self.path, f"{group}.part{part:06d}.parquet")
+
+    @staticmethod
+    def isMolColumn(series: pd.Series) -> bool:
+        """Check if a column contains RDKit molecules.
+
+        Args:
+            series (pd.Series): column to check
+
+        Returns:
+            bool: `True` if the first valid value of the column is a `Chem.Mol`
+        """
+        if series.dtype != object:
+            return False
+        valid = series.dropna()
+        return len(valid) > 0 and isinstance(valid.iloc[0], Chem.Mol)
+
+    @staticmethod
+    def getSparseColumns(df: pd.DataFrame) -> List[str]:
+        """Get the names of the sparse columns of a data frame (i.e. sparse fingerprints).
+
+        Args:
+            df (pd.DataFrame): the data frame
+
+        Returns:
+            list: names of the columns with a `pd.SparseDtype`
+        """
+        return [col for col, dtype in df.dtypes.items() if isinstance(dtype, pd.SparseDtype)]
+
+    def readMeta(self) -> Dict:
+        """Read the metadata of the stored data frame (column order, groups and molecule columns).
+
+        Returns:
+            dict: metadata of the stored data frame
+        """
+        with open(os.path.join(self.path, self.metaFile)) as f:
+            return json.load(f)
+
+    def writeMeta(self, meta: Dict):
+        """Write the metadata of the stored data frame. The file is replaced atomically so that the stored data
+        stays readable if writing is interrupted.
+
+        Args:
+            meta (dict): metadata of the stored data frame
+        """
+        path = os.path.join(self.path, self.metaFile)
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(meta, f)
+        os.replace(f"{path}.tmp", path)
+
+    @staticmethod
+    def writeGroups(df: pd.DataFrame, groups: Dict[str, List[str]], mol_columns: List[str], path_fn: Callable):
+        """Write the column groups of a data frame to separate Parquet files.
+
+        Args:
+            df (pd.DataFrame): data frame to write
+            groups (dict): names of the columns in each group
+            mol_columns (list): names of the columns with RDKit molecules
+            path_fn (callable): function returning the output path for a group name
+        """
+        for group, columns in groups.items():
+            if len(columns) == 0:
+                continue
+            # Parquet has no sparse columns, they are written dense and restored upon loading
+            df_group = densify(df[columns])
+            if any(col in mol_columns for col in columns):
+                df_group = df_group.copy()
+                for col in columns:
+                    if col in mol_columns:
+                        df_group[col] = df_group[col].apply(lambda mol: mol.ToBinary() if mol is not None else None)
+            df_group.to_parquet(path_fn(group), index=True)
+
+    def save(self, df: pd.DataFrame) -> str:
+        self.clear()
+        os.makedirs(self.path)
+        mol_columns = [col for col in df.columns if self.isMolColumn(df[col])]
+        groups = {group: self.selectColumns(df.columns, [group]) for group in COLUMN_GROUPS}
+        self.writeGroups(df, groups, mol_columns, self.groupPath)
+        self.writeMeta({"columns": df.columns.to_list(), "groups": groups, "mol_columns": mol_columns, "parts": [],
+                        "sparse_columns": self.getSparseColumns(df)})
+        return self.path
+
+    def append(self, df: pd.DataFrame, part: int = None) -> str:
+        """Append rows to the stored data frame without loading or rewriting it. The store is created if it does not
+        exist yet. The appended data frame must have the same columns as the stored one.
+
+        Args:
+            df (pd.DataFrame): rows to append
+            part (int): number of the written part, the next free number by default. Writing a part with
+                an existing number replaces it so that an interrupted append can be repeated safely.
+
+        Returns:
+            str: path to the stored data frame
+        """
+        if not self.exists():
+            os.makedirs(self.path)
+            self.writeMeta({
+                "columns": df.columns.to_list(),
+                "groups": {group: self.selectColumns(df.columns, [group]) for group in COLUMN_GROUPS},
+                "mol_columns": [col for col in df.columns if self.isMolColumn(df[col])],
+                "parts": [],
+                "sparse_columns": self.getSparseColumns(df),
+            })
+        meta = self.readMeta()
+        if df.columns.to_list() != meta["columns"]:
+            raise ValueError(f"Cannot append to {self.path}, the columns of the appended data frame differ from the "
+                             f"stored ones: {df.columns.to_list()} != {meta['columns']}")
+        parts = meta.get("parts", [])
+        part = part if part is not None else max(parts, default=-1) + 1
+        self.writeGroups(df, meta["groups"], meta["mol_columns"], lambda group: self.partPath(group, part))
+        if part not in parts:
+            meta["parts"] = parts + [part]
+        self.writeMeta(meta)
+        return self.path
+
+    def load(self, groups: List[str] = None, columns: List[str] = None) -> pd.DataFrame:
+        meta = self.readMeta()
+        selected = self.selectColumns(meta["columns"], groups)
+        if columns is not None:
+            selected = [col for col in selected if col in columns]
+        parts = []
+        for group in COLUMN_GROUPS:
+            to_read = [col for col in meta["groups"][group] if col in selected]
+            if to_read or (group == "properties" and not selected):
+                # the properties group is always read to at least restore the index
+                paths = [self.groupPath(group)] + [self.partPath(group, part) for part in meta.get("parts", [])]
+                group_parts = [pd.read_parquet(path, columns=to_read) for path in paths if os.path.exists(path)]
+                if len(group_parts) > 0:
+                    parts.append(self.dropReplaced(pd.concat(group_parts, axis=0))
+                                 if len(group_parts) > 1 else group_parts[0])
+        df = pd.concat(parts, axis=1) if len(parts) > 1 else parts[0]
+        for col in meta["mol_columns"]:
+            if col in df.columns:
+                df[col] = df[col].apply(lambda blob: Chem.Mol(blob) if blob is not None else None)
+        sparse_columns = [col for col in meta.get("sparse_columns", []) if col in df.columns]
+        if sparse_columns:
+            df = df.astype({col: pd.SparseDtype(df[col].dtype, 0) for col in sparse_columns})
+        return df[selected]
+
+    @staticmethod
+    def dropReplaced(df: pd.DataFrame) -> pd.DataFrame:
+        """Resolve rows with duplicate labels after concatenating the stored parts. The last appended version of
+        each row is kept at the position of its first version.
+
+        Args:
+            df (pd.DataFrame): concatenated parts
+
+        Returns:
+            pd.DataFrame: data frame with unique row labels
+        """
+        if not df.index.has_duplicates:
+            return df
+        order = df.index[~df.index.duplicated(keep="first")]
+        return df[~df.index.duplicated(keep="last")].reindex(order)
+
+    def getColumns(self) -> List[str]:
+        return self.readMeta()["columns"]
+
+
+STORAGE_BACKENDS = {
+    "pickle": PickleStorage,
+    "parquet": ParquetStorage,
+}
+
+
+def get_storage(store_format: str, store_prefix: str) -> TableStorage:
+    """Create a storage backend for the given format.
+
+    Args:
+        store_format (str): name of the backend (one of the keys of `STORAGE_BACKENDS`)
+        store_prefix (str): path prefix of the data set files (`{store_dir}/{name}`)
+
+    Returns:
+        TableStorage: the storage backend
+    """
+    if store_format not in STORAGE_BACKENDS:
+        raise ValueError(f"Unknown storage format: '{store_format}'. Use one of: {list(STORAGE_BACKENDS.keys())}")
+    return STORAGE_BACKENDS[store_format](store_prefix)
+
+
+def detect_store_format(store_prefix: str) -> Optional[str]:
+    """Find out with which backend the data frame with the given prefix was saved.
+
+    Args:
+        store_prefix (str): path prefix of the data set files (`{store_dir}/{name}`)
+
+    Returns:
+        str: name of the backend or `None` if no data frame is found
+    """
+    for store_format in STORAGE_BACKENDS:
+        if get_storage(store_format, store_prefix).exists():
+            return store_format
+
+
+def get_store_format_from_path(path: str) -> str:
+    """Get the name of the storage backend from the path to the stored data frame.
+
+    Args:
+        path (str): path to the stored data frame (i.e. `{store_dir}/{name}_df.parquet`)
+
+    Returns:
+        str: name of the backend
+    """
+    for store_format, backend in STORAGE_BACKENDS.items():
+        if path.rstrip("/").endswith(f".{backend.extension}"):
+            return store_format
+    raise ValueError(f"Could not determine storage format of: {path}")
+
+
+def migrate_storage(name: str, store_dir: str, store_format: str = "parquet", remove_old: bool = True) -> str:
+    """Convert a data set saved with one storage backend to another (i.e. to convert old pickled data sets to Parquet).
+    The storage format saved in the data set metadata (if present) is updated as well.
+
+    Args:
+        name (str): name of the data set
+        store_dir (str): directory of the data set
+        store_format (str): name of the target backend
+        remove_old (bool): remove the data frame saved with the old backend after conversion
+
+    Returns:
+        str: path to the converted data frame
+    """
+    store_prefix = f"{store_dir.rstrip('/')}/{name}"
+    old_format = detect_store_format(store_prefix)
+    if old_format is None:
+        raise FileNotFoundError(f"No data frame found in store for '{name}' in '{store_dir}'.")
+    new_storage = get_storage(store_format, store_prefix)
+    if old_format == store_format:
+        return new_storage.path
+
+    old_storage = get_storage(old_format, store_prefix)
+    path = new_storage.save(old_storage.load())
+    meta_path = f"{store_prefix}_meta.json"
+    if os.path.exists(meta_path):
+        with open(meta_path) as f:
+            meta = json.load(f)
+        meta["init"]["store_format"] = store_format
+        with open(meta_path, "w") as f:
+            json.dump(meta, f)
+    if remove_old:
+        old_storage.clear()
+    logger.info(f"Data set '{name}' migrated from '{old_format}' to '{store_format}' storage: {path}")
+    return path
+
+
+def positions_to_slice(positions: np.ndarray) -> Optional[slice]:
+    """Convert an array of positions to a `slice` if the positions are contiguous and increasing. Indexing a numpy array
+    with a slice returns a view instead of a copy.
+
+    Args:
+        positions (np.ndarray): integer positions
+
+    Returns:
+        slice: the equivalent slice or `None` if the positions cannot be represented by one
+    """
+    positions = np.asarray(positions)
+    if len(positions) == 0:
+        return slice(0, 0)
+    start = positions[0]
+    if positions[-1] - start != len(positions) - 1 or np.any(np.diff(positions) != 1):
+        return None
+    return slice(int(start), int(start) + len(positions))
+
+
+class DescriptorMatrix:
+    """Dense `float32` matrix of descriptors memory-mapped from disk (`{name}_descriptors.npy`).
+
+    Rows are looked up by the index labels of the data frame they belong to (saved in `{name}_descriptors_index.json`)
+    so that the rows of the data frame can be filtered or reordered without touching the matrix. Contiguous blocks of
+    rows and columns are returned as views of the mapped file, other selections are gathered into a single new array.
+    The file is mapped in copy-on-write mode so modifications of the returned arrays never change the stored values.
+
+    Attributes:
+        path (str): path to the matrix file
+        indexPath (str): path to the file with column names and row labels
+        values (np.memmap): the mapped matrix (`None` if not written yet)
+        columns (list): names of the descriptors (columns of the matrix)
+        rowMap (pd.Series): maps index labels of the data frame to rows of the matrix
+    """
+
+    dtype = np.float32
+
+    def __init__(self, store_prefix: str):
+        """Initialize the matrix. The matrix is not read or created until `load` or `write` are called.
+
+        Args:
+            store_prefix (str): path prefix of the data set files (`{store_dir}/{name}`)
+        """
+        self.path = f"{store_prefix}_descriptors.npy"
+        self.indexPath = f"{store_prefix}_descriptors_index.json"
+        self.values = None
+        self.columns = []
+        self.rowMap = pd.Series(dtype=np.int64)
+
+    def __len__(self):
+        return len(self.rowMap)
+
+    def exists(self) -> bool:
+        """Check if the matrix was saved to disk.
+
+        Returns:
+            bool: `True` if both the matrix and its index exist
+        """
+        return os.path.exists(self.path) and os.path.exists(self.indexPath)
+
+    def clear(self):
+        """Remove the matrix from disk and memory."""
+        self.values = None
+        self.columns = []
+        self.rowMap = pd.Series(dtype=np.int64)
+        for path in (self.path, self.indexPath):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def write(self, descriptors: pd.DataFrame, chunk_size: int = 10000) -> "DescriptorMatrix":
+        """Write a data frame of descriptors to disk and map it. The data is converted to `float32` in chunks so that
+        no full-size intermediate copies are made.
+
+        Args:
+            descriptors (pd.DataFrame): descriptors to save, the index must match the index of the data set
+            chunk_size (int): number of rows converted at once
+
+        Returns:
+            DescriptorMatrix: this instance
+        """
+        self.values = None
+        values = np.lib.format.open_memmap(self.path, mode="w+", dtype=self.dtype, shape=descriptors.shape)
+        for i in range(0, len(descriptors), chunk_size):
+            values[i:i + chunk_size] = descriptors.iloc[i:i + chunk_size].to_numpy(dtype=self.dtype, na_value=np.nan)
+        values.flush()
+        del values
+        self.columns = descriptors.columns.to_list()
+        self.rowMap = pd.Series(np.arange(len(descriptors)), index=descriptors.index)
+        self.saveIndex()
+        return self.load()
+
+    def update(self, descriptors: pd.DataFrame, chunk_size: int = 10000) -> "DescriptorMatrix":
+        """Write descriptors of some rows and columns to the stored matrix. Values of existing rows and columns are
+        replaced in place. If the data frame contains new rows or columns, the matrix is enlarged first by copying
+        it to a new file in chunks, the new cells are set to `nan` until they are written.
+
+        Args:
+            descriptors (pd.DataFrame): descriptors to write, the index must match the index of the data set
+            chunk_size (int): number of rows converted or copied at once
+
+        Returns:
+            DescriptorMatrix: this instance
+        """
+        if self.values is None:
+            return self.write(descriptors, chunk_size)
+        new_columns = [col for col in descriptors.columns if col not in self.columns]
+        new_labels = descriptors.index[~descriptors.index.isin(self.rowMap.index)]
+        if new_columns or len(new_labels) > 0:
+            n_old_rows, n_old_cols = self.values.shape
+            shape = (n_old_rows + len(new_labels), n_old_cols + len(new_columns))
+            tmp_path = f"{self.path}.tmp.npy"
+            values = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=self.dtype, shape=shape)
+            for i in range(0, shape[0], chunk_size):
+                values[i:i + chunk_size] = np.nan
+                if i < n_old_rows:
+                    values[i:min(i + chunk_size, n_old_rows), :n_old_cols] = self.values[i:i + chunk_size]
+            values.flush()
+            del values
+            self.values = None
+            os.replace(tmp_path, self.path)
+            self.columns = self.columns + new_columns
+            self.rowMap = pd.concat([
+                self.rowMap,
+                pd.Series(np.arange(n_old_rows, shape[0], dtype=np.int64), index=new_labels)
+            ])
+            self.saveIndex()
+
+        rows = self.getRows(descriptors.index)
+        cols = self.getColumns(descriptors.columns)
+        values = np.load(self.path, mmap_mode="r+")
+        for i in range(0, len(descriptors), chunk_size):
+            values[np.ix_(rows[i:i + chunk_size], cols)] = descriptors.iloc[i:i + chunk_size].to_numpy(
+                dtype=self.dtype, na_value=np.nan)
+        values.flush()
+        del values
+        return self.mapValues()
+
+    def saveIndex(self):
+        """Save the column names and the map of row labels to disk."""
+        with open(self.indexPath, "w") as f:
+            json.dump({
+                "columns": self.columns,
+                "labels": self.rowMap.index.to_list(),
+                "rows": self.rowMap.values.tolist(),
+            }, f)
+
+    def load(self) -> "DescriptorMatrix":
+        """Map the matrix from disk and read its index.
+
+        Returns:
+            DescriptorMatrix: this instance
+        """
+        with open(self.indexPath) as f:
+            index = json.load(f)
+        self.columns = index["columns"]
+        self.rowMap = pd.Series(np.array(index["rows"], dtype=np.int64), index=index["labels"])
+        return self.mapValues()
+
+    def mapValues(self) -> "DescriptorMatrix":
+        """Map the matrix from disk again after it was written, the columns and row labels in memory are kept since
+        the saved index can be outdated (i.e. after `relabel`).
+
+        Returns:
+            DescriptorMatrix: this instance
+        """
+        self.values = np.load(self.path, mmap_mode="c")
+        return self
+
+    def getRows(self, labels) -> np.ndarray:
+        """Get matrix rows of the given index labels.
+
+        Args:
+            labels: index labels of the data frame
+
+        Returns:
+            np.ndarray: positions of the rows in the matrix
+        """
+        return self.rowMap.loc[labels].values
+
+    def getColumns(self, columns: List[str]) -> np.ndarray:
+        """Get matrix columns of the given descriptor names.
+
+        Args:
+            columns (list): names of the descriptors
+
+        Returns:
+            np.ndarray: positions of the columns in the matrix
+        """
+        return pd.Index(self.columns).get_indexer(columns)
+
+    def take(self, labels=None, columns: List[str] = None) -> np.ndarray:
+        """Get a block of the matrix. A view is returned if both the rows and columns are contiguous.
+
+        Args:
+            labels: index labels of the rows to take, all rows if `None`
+            columns (list): names of the columns to take, all columns if `None`
+
+        Returns:
+            np.ndarray: the selected block of the matrix
+        """
+        rows = self.rowMap.values if labels is None else self.getRows(labels)
+        cols = np.arange(len(self.columns)) if columns is None else self.getColumns(columns)
+        if np.any(cols < 0):
+            missing = [col for col, pos in zip(columns, cols) if pos < 0]
+            raise KeyError(f"Descriptors not found in matrix: {missing}")
+        row_slice = positions_to_slice(rows)
+        col_slice = positions_to_slice(cols)
+        if row_slice is not None and col_slice is not None:
+            return self.values[row_slice, col_slice]
+        elif row_slice is not None:
+            return self.values[row_slice][:, cols]
+        elif col_slice is not None:
+            return self.values[rows][:, col_slice]
+        else:
+            return self.values[np.ix_(rows, cols)]
+
+    def toFrame(self, labels=None, columns: List[str] = None) -> pd.DataFrame:
+        """Get a block of the matrix as a data frame. The data frame wraps the array returned by `take` without
+        copying it.
+
+        Args:
+            labels: index labels of the rows to take, all rows if `None`
+            columns (list): names of the columns to take, all columns if `None`
+
+        Returns:
+            pd.DataFrame: the selected block of the matrix
+        """
+        return pd.DataFrame(
+            self.take(labels, columns),
+            index=self.rowMap.index if labels is None else labels,
+            columns=self.columns if columns is None else columns,
+            copy=False
+        )
+
+    def relabel(self, old_labels, new_labels):
+        """Change the index labels of matrix rows, i.e. after the index of the data frame was reset. Rows not in
+        `old_labels` are no longer accessible. The new labels are written to disk with `saveIndex`.
+
+        Args:
+            old_labels: current labels of the rows
+            new_labels: new labels of the same rows
+        """
+        self.rowMap = pd.Series(self.getRows(old_labels), index=new_labels)
+
+    def fill(self, value: Union[int, float], columns: List[str] = None, chunk_size: int = 10000):
+        """Replace missing values in the stored matrix.
+
+        Args:
+            value (int, float): value to replace missing values with
+            columns (list): names of the columns to fill, all columns if `None`
+            chunk_size (int): number of rows processed at once
+        """
+        cols = slice(None) if columns is None else self.getColumns(columns)
+        values = np.load(self.path, mmap_mode="r+")
+        for i in range(0, values.shape[0], chunk_size):
+            block = values[i:i + chunk_size, cols]
+            mask = np.isnan(block)
+            if mask.any():
+                block[mask] = value
+                values[i:i + chunk_size, cols] = block
+        values.flush()
+        del values
+        self.mapValues()
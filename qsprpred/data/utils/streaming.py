@@ -0,0 +1,323 @@
+"""Construction of data sets from files that do not fit into memory.
+
+The input is read in chunks and each chunk is cleaned, filtered and featurized before it is appended to
+the Parquet store of the data set. A checkpoint file records the last stored chunk so that an interrupted
+build can be resumed.
+"""
+import inspect
+import json
+import os
+import tempfile
+from typing import Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+from qsprpred.data.data import MoleculeTable
+from qsprpred.data.utils.descriptorcalculator import Calculator
+from qsprpred.data.utils.parallel import WorkerPool
+from qsprpred.data.utils.storage import STORAGE_BACKENDS, ParquetStorage, get_storage
+from qsprpred.logs import logger
+from rdkit import Chem
+
+
+class StreamingTableBuilder:
+    """Builds a `MoleculeTable` chunk by chunk with bounded memory.
+
+    Each chunk of `chunk_size * n_jobs` rows is processed as a separate `MoleculeTable` so that its rows
+    are split evenly among the workers. The worker pool is shared by all chunks. Molecules are optionally
+    standardized and sanitized, invalid molecules are dropped, descriptors are calculated and the result
+    is appended to the Parquet store of the data set (see `ParquetStorage.append`). The built data set
+    is returned lazily, its columns other than the properties are only read from the store when used.
+
+    Attributes:
+        name (str): name of the built data set
+        storeDir (str): directory of the built data set
+        storePrefix (str): path prefix of the data set files
+        checkpointPath (str): path to the checkpoint file (`{name}_build.json`)
+        smilescol (str): name of the column with SMILES
+        calculator (Calculator): calculator of descriptors added to each chunk, no descriptors if `None`
+        standardize (bool): standardize the SMILES of each chunk
+        sanitize (bool): sanitize the SMILES of each chunk
+        nJobs (int): number of processes used to process each chunk
+        chunkSize (int): number of rows processed by each process
+        storeMols (bool): store binary RDKit molecules with each chunk (see `MoleculeTable.molCol`)
+    """
+
+    def __init__(
+            self,
+            name: str,
+            store_dir: str = '.',
+            smilescol: str = "SMILES",
+            calculator: Calculator = None,
+            standardize: bool = True,
+            sanitize: bool = True,
+            n_jobs: int = 1,
+            chunk_size: int = None,
+            overwrite: bool = False,
+            store_mols: bool = False,
+    ):
+        """Initialize the builder.
+
+        Args:
+            name (str): name of the built data set
+            store_dir (str): directory of the built data set
+            smilescol (str): name of the column with SMILES
+            calculator (Calculator): calculator of descriptors added to each chunk, no descriptors if `None`
+            standardize (bool): standardize the SMILES of each chunk
+            sanitize (bool): sanitize the SMILES of each chunk
+            n_jobs (int): number of processes used to process each chunk, all available cores if <= 0
+            chunk_size (int): number of rows processed by each process, also used as the chunk size of the built
+                `MoleculeTable`, the default chunk size of `MoleculeTable` if `None`
+            overwrite (bool): start from scratch even if a finished or interrupted build of the data set is found
+            store_mols (bool): store binary RDKit molecules of the cleaned SMILES, descriptors of each chunk are
+                then calculated from them
+        """
+        self.name = name
+        self.storeDir = store_dir.rstrip("/")
+        if not os.path.exists(self.storeDir):
+            raise FileNotFoundError(f"Directory '{self.storeDir}' does not exist.")
+        self.storePrefix = f"{self.storeDir}/{self.name}"
+        self.checkpointPath = f"{self.storePrefix}_build.json"
+        self.storage = ParquetStorage(self.storePrefix)
+        self.smilescol = smilescol
+        self.calculator = calculator
+        self.standardize = standardize
+        self.sanitize = sanitize
+        self.nJobs = n_jobs if n_jobs > 0 else os.cpu_count()
+        if chunk_size is None:
+            chunk_size = inspect.signature(MoleculeTable.__init__).parameters["chunk_size"].default
+        self.chunkSize = chunk_size
+        self.overwrite = overwrite
+        self.storeMols = store_mols
+        self.workerPool = WorkerPool(self.nJobs)
+
+    @property
+    def rowsPerChunk(self) -> int:
+        """Number of input rows read at once."""
+        return self.chunkSize * self.nJobs
+
+    def readCheckpoint(self) -> Optional[dict]:
+        """Read the checkpoint of a previous build of this data set.
+
+        Returns:
+            dict: the checkpoint or `None` if there is none
+        """
+        if not os.path.exists(self.checkpointPath):
+            return None
+        with open(self.checkpointPath) as f:
+            return json.load(f)
+
+    def writeCheckpoint(self, checkpoint: dict):
+        """Write the checkpoint file. The file is replaced atomically.
+
+        Args:
+            checkpoint (dict): the checkpoint
+        """
+        with open(f"{self.checkpointPath}.tmp", "w") as f:
+            json.dump(checkpoint, f)
+        os.replace(f"{self.checkpointPath}.tmp", self.checkpointPath)
+
+    def clear(self):
+        """Remove the stored data and the checkpoint of this data set."""
+        for store_format in STORAGE_BACKENDS:
+            get_storage(store_format, self.storePrefix).clear()
+        for path in (self.checkpointPath, f"{self.storePrefix}_feature_calculators.json"):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def start(self, source: str) -> dict:
+        """Get the checkpoint to continue from. A new build is started if there is no checkpoint for the same
+        source and chunk size or if `overwrite` is set.
+
+        Args:
+            source (str): identifier of the input (i.e. the path to the input file)
+
+        Returns:
+            dict: the checkpoint
+        """
+        checkpoint = self.readCheckpoint()
+        if (
+                not self.overwrite
+                and checkpoint is not None
+                and checkpoint["source"] == source
+                and checkpoint["rows_per_chunk"] == self.rowsPerChunk
+                and (self.storage.exists() or checkpoint["rows_stored"] == 0)
+        ):
+            if not checkpoint["finished"]:
+                logger.info(f"Resuming build of '{self.name}' after chunk {checkpoint['last_chunk']} "
+                            f"({checkpoint['rows_read']} rows read).")
+            return checkpoint
+
+        self.clear()
+        checkpoint = {
+            "source": source,
+            "rows_per_chunk": self.rowsPerChunk,
+            "last_chunk": -1,
+            "rows_read": 0,
+            "rows_stored": 0,
+            "finished": False,
+        }
+        self.writeCheckpoint(checkpoint)
+        return checkpoint
+
+    def processChunk(self, df: pd.DataFrame, tmp_dir: str) -> pd.DataFrame:
+        """Clean and featurize one chunk of the input.
+
+        Args:
+            df (pd.DataFrame): the chunk
+            tmp_dir (str): directory for the temporary `MoleculeTable` of the chunk, nothing is written to it
+
+        Returns:
+            pd.DataFrame: the processed chunk
+        """
+        table = MoleculeTable(
+            f"{self.name}_chunk",
+            df,
+            smilescol=self.smilescol,
+            store_dir=tmp_dir,
+            n_jobs=self.nJobs,
+            chunk_size=max(1, int(np.ceil(len(df) / self.nJobs))),
+            drop_invalids=False,
+        )
+        table.workerPool = self.workerPool
+        # molecules are created while cleaning
+        table.storeMols = self.storeMols
+        table.cleanMolecules(standardize=self.standardize, sanitize=self.sanitize, drop_invalids=True)
+        if self.calculator is not None and len(table) > 0:
+            table.addDescriptors(self.calculator)
+        return table.getDF()
+
+    def build(self, chunks: Iterable[pd.DataFrame], source: str, **kwargs) -> MoleculeTable:
+        """Build the data set from chunks of the input. If the build is resumed, chunks that were stored
+        before are read again, but skipped.
+
+        Args:
+            chunks (iterable): chunks of the input with `rowsPerChunk` rows each (except for the last one)
+            source (str): identifier of the input used to check if a checkpoint belongs to it
+            **kwargs: additional keyword arguments passed to the `MoleculeTable` constructor
+
+        Returns:
+            MoleculeTable: the built data set
+        """
+        checkpoint = self.start(source)
+        skip = checkpoint["last_chunk"] + 1
+        chunks = (chunk for idx, chunk in enumerate(chunks) if idx >= skip)
+        return self.consume(chunks, checkpoint, **kwargs)
+
+    def consume(self, chunks: Iterable[pd.DataFrame], checkpoint: dict, **kwargs) -> MoleculeTable:
+        """Process and store the chunks that follow the last chunk recorded in the checkpoint.
+
+        Args:
+            chunks (iterable): chunks of the input following the last stored chunk
+            checkpoint (dict): the checkpoint to continue from (see `StreamingTableBuilder.start`)
+            **kwargs: additional keyword arguments passed to the `MoleculeTable` constructor, the table is
+                loaded lazily unless `lazy=False` is given
+
+        Returns:
+            MoleculeTable: the built data set
+        """
+        if not checkpoint["finished"]:
+            if self.calculator is not None:
+                self.calculator.toFile(f"{self.storePrefix}_feature_calculators.json")
+            try:
+                with tempfile.TemporaryDirectory() as tmp_dir:
+                    for chunk_idx, df in enumerate(chunks, start=checkpoint["last_chunk"] + 1):
+                        # unique row labels that do not depend on where the build was resumed
+                        n_rows = len(df)
+                        df.index = pd.RangeIndex(checkpoint["rows_read"], checkpoint["rows_read"] + n_rows)
+                        df = self.processChunk(df, tmp_dir)
+                        if self.storage.exists():
+                            columns = self.storage.getColumns()
+                            missing = set(df.columns) - set(columns)
+                            if missing:
+                                logger.warning(f"Columns not present in the first stored chunk are dropped: {missing}")
+                            df = df.reindex(columns=columns)
+                        if len(df) > 0:
+                            self.storage.append(df, part=chunk_idx)
+                        checkpoint["last_chunk"] = chunk_idx
+                        checkpoint["rows_read"] += n_rows
+                        checkpoint["rows_stored"] += len(df)
+                        self.writeCheckpoint(checkpoint)
+                        logger.info(f"Stored chunk {chunk_idx} of '{self.name}': "
+                                    f"{checkpoint['rows_stored']} molecules from {checkpoint['rows_read']} rows.")
+            finally:
+                self.workerPool.shutdown()
+            checkpoint["finished"] = True
+            self.writeCheckpoint(checkpoint)
+
+        kwargs.setdefault("lazy", True)
+        return MoleculeTable(
+            self.name,
+            smilescol=self.smilescol,
+            store_dir=self.storeDir,
+            n_jobs=self.nJobs,
+            chunk_size=self.chunkSize,
+            drop_invalids=False,
+            store_format="parquet",
+            **kwargs
+        )
+
+    def fromTableFile(self, filename: str, sep: str = "\t", **kwargs) -> MoleculeTable:
+        """Build the data set from a file containing a table of molecules (i.e. a CSV file).
+
+        Args:
+            filename (str): path to the file
+            sep (str): separator used in the file for different columns
+            **kwargs: additional keyword arguments passed to the `MoleculeTable` constructor
+
+        Returns:
+            MoleculeTable: the built data set
+        """
+        checkpoint = self.start(os.path.abspath(filename))
+        skip = checkpoint["rows_read"] if not checkpoint["finished"] else 0
+        chunks = pd.read_table(
+            filename,
+            sep=sep,
+            chunksize=self.rowsPerChunk,
+            skiprows=range(1, skip + 1) if skip > 0 else None,
+        )
+        with chunks:
+            return self.consume(chunks, checkpoint, **kwargs)
+
+    def fromSDF(self, filename: str, smiles_prop: str = None, **kwargs) -> MoleculeTable:
+        """Build the data set from an SDF file. Unlike `MoleculeTable.fromSDF`, no column with RDKit molecules
+        is added.
+
+        Args:
+            filename (str): path to the SDF file
+            smiles_prop (str): name of the property containing the SMILES sequence, SMILES are generated from
+                the molecules if `None` or if the property is missing
+            **kwargs: additional keyword arguments passed to the `MoleculeTable` constructor
+
+        Returns:
+            MoleculeTable: the built data set
+        """
+        return self.build(self.iterSDF(filename, smiles_prop), os.path.abspath(filename), **kwargs)
+
+    def iterSDF(self, filename: str, smiles_prop: str = None) -> Iterable[pd.DataFrame]:
+        """Read an SDF file in chunks of `rowsPerChunk` molecules.
+
+        Args:
+            filename (str): path to the SDF file
+            smiles_prop (str): name of the property containing the SMILES sequence
+
+        Yields:
+            pd.DataFrame: properties of the molecules in the chunk and their SMILES
+        """
+        records: List[dict] = []
+        with open(filename, "rb") as f:
+            for mol in Chem.ForwardSDMolSupplier(f):
+                if mol is None:
+                    record = {self.smilescol: None}
+                else:
+                    record = mol.GetPropsAsDict()
+                    if smiles_prop is None or smiles_prop not in record:
+                        record[self.smilescol] = Chem.MolToSmiles(mol)
+                    elif smiles_prop != self.smilescol:
+                        record[self.smilescol] = record.pop(smiles_prop)
+                records.append(record)
+                if len(records) == self.rowsPerChunk:
+                    yield pd.DataFrame(records)
+                    records = []
+        if records:
+            yield pd.DataFrame(records)
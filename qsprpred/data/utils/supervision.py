@@ -0,0 +1,205 @@
+"""Supervised calculation of descriptor sets with a wall-clock budget per molecule.
+
+A `DescriptorSupervisor` calculates descriptor sets in a separate process that is kept alive between calls. If the
+calculation for a molecule exceeds its budget or the process crashes, the process is killed and started again and
+the calculation continues with the next molecule. Failed molecules get `NaN` values and a `CalculationError` code.
+"""
+import hashlib
+import multiprocessing
+import pickle
+from enum import IntEnum
+from typing import List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from qsprpred.logs import logger
+from rdkit.Chem import Mol
+from scipy.sparse import issparse
+
+
+class CalculationError(IntEnum):
+    """Codes of the outcome of a descriptor calculation for a molecule."""
+
+    NONE = 0  # calculated successfully
+    INVALID = 1  # the molecule is missing or could not be parsed
+    ERROR = 2  # the descriptor set raised an exception or crashed the process
+    TIMEOUT = 3  # the calculation exceeded the time budget
+
+
+def count_errors(codes: np.ndarray) -> dict:
+    """Count the failed calculations by the type of error.
+
+    Args:
+        codes (np.ndarray): `CalculationError` codes
+
+    Returns:
+        dict: number of molecules by the lower case name of the error (`invalid`, `error` and `timeout`)
+    """
+    codes = np.asarray(codes)
+    return {
+        error.name.lower(): int((codes == error).sum()) for error in CalculationError if error != CalculationError.NONE
+    }
+
+
+def _calculate_values(descset, mols: List[Mol]) -> np.ndarray:
+    """Calculate a descriptor set and return the values as a `float64` array of shape (n_mols, n_descriptors)."""
+    values = descset(mols)
+    if issparse(values):
+        values = values.toarray()
+    elif isinstance(values, pd.DataFrame):
+        values = values.apply(pd.to_numeric, errors="coerce").values
+    values = np.asarray(values, dtype=np.float64)
+    expected = (len(mols), len(descset.descriptors))
+    if values.shape != expected:
+        raise ValueError(f"Expected values of shape {expected}, got {values.shape}.")
+    return values
+
+
+def _supervised_process(conn):
+    """Main loop of the supervised process. Descriptor sets are received once and kept by their key, molecules
+    are either calculated as one batch with a single reply or one by one with a reply for each molecule.
+
+    Args:
+        conn: connection to the supervisor
+    """
+    descsets = {}
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            return
+        if message[0] == "set":
+            _, key, descset_bytes = message
+            descsets[key] = pickle.loads(descset_bytes)
+            continue
+        _, key, mols, batch = message
+        descset = descsets[key]
+        for mol_batch in ([mols] if batch else [[mol] for mol in mols]):
+            try:
+                conn.send(("ok", _calculate_values(descset, mol_batch)))
+            except Exception as exp:
+                conn.send(("error", repr(exp)))
+
+
+class DescriptorSupervisor:
+    """Calculates descriptor sets in a supervised process with a wall-clock budget per molecule.
+
+    Molecules are sent to the process one by one, except for descriptor sets that prefer batches
+    (`DescriptorSet.batchSize`), which are calculated in batches with a budget for the whole batch and
+    calculated one by one only if the batch fails. The process is started on first use and kept alive
+    between calls, it is not copied when the supervisor is pickled (i.e. each worker process of a
+    `WorkerPool` starts its own).
+
+    Attributes:
+        timeout (float): wall-clock budget in seconds to calculate one descriptor set for one molecule
+    """
+
+    def __init__(self, timeout: float):
+        """Initialize the supervisor. No process is started until the supervisor is used.
+
+        Args:
+            timeout (float): wall-clock budget in seconds to calculate one descriptor set for one molecule
+        """
+        self.timeout = timeout
+        self._process = None
+        self._conn = None
+        self._sent = set()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_process"] = None
+        state["_conn"] = None
+        state["_sent"] = set()
+        return state
+
+    def __del__(self):
+        self.shutdown()
+
+    def shutdown(self):
+        """Stop the supervised process."""
+        if getattr(self, "_process", None) is not None:
+            self._process.kill()
+            self._process.join()
+            self._conn.close()
+        self._process = None
+        self._conn = None
+        self._sent = set()
+
+    def _submit(self, key: str, descset_bytes: bytes, mols: List[Mol], batch: bool):
+        """Send molecules to the supervised process, the process is (re)started if needed."""
+        if self._process is None or not self._process.is_alive():
+            self.shutdown()
+            self._conn, child_conn = multiprocessing.Pipe()
+            self._process = multiprocessing.Process(target=_supervised_process, args=(child_conn,), daemon=True)
+            self._process.start()
+            child_conn.close()
+        if key not in self._sent:
+            self._conn.send(("set", key, descset_bytes))
+            self._sent.add(key)
+        self._conn.send(("calc", key, mols, batch))
+
+    def _receive(self, timeout: float) -> Tuple[CalculationError, Optional[np.ndarray]]:
+        """Wait for the next reply of the supervised process. The process is stopped if it does not reply
+        within the timeout or has crashed.
+
+        Returns:
+            tuple: the error code and the calculated values (`None` on failure)
+        """
+        if not self._conn.poll(timeout):
+            self.shutdown()
+            return CalculationError.TIMEOUT, None
+        try:
+            status, payload = self._conn.recv()
+        except (EOFError, OSError):
+            self.shutdown()
+            return CalculationError.ERROR, None
+        if status != "ok":
+            logger.debug(f"Supervised descriptor calculation failed: {payload}")
+            return CalculationError.ERROR, None
+        return CalculationError.NONE, payload
+
+    def calculate(self, descset, mols: List[Optional[Mol]]) -> Tuple[np.ndarray, np.ndarray]:
+        """Calculate a descriptor set for a list of molecules.
+
+        Args:
+            descset (DescriptorSet): the descriptor set, must be picklable
+            mols (list): the RDKit molecules, `None` for missing molecules
+
+        Returns:
+            tuple: `float64` values of shape (n_mols, n_descriptors) and `CalculationError` codes of shape (n_mols,)
+        """
+        values = np.full((len(mols), len(descset.descriptors)), np.nan)
+        codes = np.full(len(mols), CalculationError.INVALID, dtype=np.int8)
+        valid = [idx for idx, mol in enumerate(mols) if mol is not None]
+        descset_bytes = pickle.dumps(descset)
+        key = hashlib.sha1(descset_bytes).hexdigest()
+        batch_size = descset.batchSize if descset.batchSize else 1
+        for start in range(0, len(valid), batch_size):
+            indices = valid[start:start + batch_size]
+            if len(indices) > 1:
+                self._submit(key, descset_bytes, [mols[idx] for idx in indices], batch=True)
+                code, batch_values = self._receive(self.timeout * len(indices))
+                if code == CalculationError.NONE:
+                    values[indices] = batch_values
+                    codes[indices] = code
+                    continue
+            self._calculateEach(key, descset_bytes, mols, indices, values, codes)
+        return values, codes
+
+    def _calculateEach(self, key: str, descset_bytes: bytes, mols: List[Mol], indices: List[int],
+                       values: np.ndarray, codes: np.ndarray):
+        """Calculate the molecules at the given indices one by one. After a timeout or crash, the remaining
+        molecules are sent to a new process."""
+        pos = 0
+        while pos < len(indices):
+            remaining = indices[pos:]
+            self._submit(key, descset_bytes, [mols[idx] for idx in remaining], batch=False)
+            for idx in remaining:
+                code, mol_values = self._receive(self.timeout)
+                codes[idx] = code
+                pos += 1
+                if code == CalculationError.NONE:
+                    values[idx] = mol_values[0]
+                elif self._process is None:
+                    # the process was stopped, continue with the next molecule
+                    break
@@ -15,6 +15,7 @@ import torch
 from qsprpred.data.data import QSPRDataset
 from qsprpred.data.utils.datafilters import papyrusLowQualityFilter
 from qsprpred.data.utils.datasplitters import randomsplit, scaffoldsplit, temporalsplit
+from qsprpred.data.utils.descriptor_cache import DescriptorCache
 from qsprpred.data.utils.descriptorcalculator import DescriptorsCalculator
 from qsprpred.data.utils.descriptorsets import (
     DrugExPhyschem,
@@ -51,6 +52,16 @@ def QSPRArgParser(txt=None):
                         help="tsv file name that contains SMILES and property value column")
     parser.add_argument('-ncpu', '--ncpu', type=int, default=8,
                         help="Number of CPUs")
+    parser.add_argument('-fmt', '--store_format', type=str, choices=['pickle', 'parquet'], default='pickle',
+                        help="Storage format of the prepared data sets. 'parquet' stores descriptors, scaffolds and \
+                              other properties separately so that they can be loaded independently.")
+    parser.add_argument('-dc', '--descriptor_cache', type=str, default=None,
+                        help="Path to an SQLite database used to cache calculated descriptors between runs.")
+    parser.add_argument('-dcs', '--descriptor_cache_size', type=int, default=None,
+                        help="Maximum size of the descriptor cache in MB, no limit by default.")
+    parser.add_argument('-dto', '--descriptor_timeout', type=float, default=None,
+                        help="Time limit in seconds to calculate one descriptor set for one molecule. Molecules \
+                              that exceed it get missing values, no limit by default.")
 
     # model target arguments
     parser.add_argument('-sm', '--smilescol', type=str, default='SMILES', help="Name of the column in the dataset\
@@ -134,16 +145,24 @@ def QSPR_dataprep(args):
     if not os.path.exists(args.base_dir + '/qspr/data'):
         os.makedirs(args.base_dir + '/qspr/data')
 
+    try:
+        df_input = pd.read_csv(f'{args.base_dir}/data/{args.input}', sep='\t')
+    except BaseException:
+        log.error(f'Dataset file ({args.base_dir}/data/{args.input}) not found')
+        sys.exit()
+
+    # descriptors of the same molecules are shared between properties and tasks
+    cache = None
+    if args.descriptor_cache:
+        max_size = args.descriptor_cache_size * 1024 ** 2 if args.descriptor_cache_size else None
+        cache = DescriptorCache(args.descriptor_cache, max_size=max_size)
+
     for reg in args.regression:
         task = ModelTasks.REGRESSION if reg else ModelTasks.CLASSIFICATION
         reg_abbr = 'REGRESSION' if reg else 'CLASSIFICATION'
         for property in args.properties:
             log.info(f"Property: {property[0]} {reg_abbr}")
-            try:
-                df = pd.read_csv(f'{args.base_dir}/data/{args.input}', sep='\t')
-            except BaseException:
-                log.error(f'Dataset file ({args.base_dir}/data/{args.input}) not found')
-                sys.exit()
+            df = df_input.copy()
 
             # prepare dataset for training QSPR model
             th = args.threshold[property[0]] if args.threshold else None
@@ -161,7 +180,8 @@ def QSPR_dataprep(args):
                 n_jobs=args.ncpu,
                 target_transformer=log_transform,
                 store_dir=f"{args.base_dir}/qspr/data/",
-                overwrite=True)
+                overwrite=True,
+                store_format=args.store_format)
 
             # data filters
             datafilters = []
@@ -211,7 +231,8 @@ def QSPR_dataprep(args):
                     featurefilters.append(BorutaFilter(estimator=RandomForestClassifier(n_jobs=args.ncpu)))
 
             # prepare dataset for modelling
-            mydataset.prepareDataset(feature_calculator=DescriptorsCalculator(descriptorsets),
+            feature_calculator = DescriptorsCalculator(descriptorsets, cache=cache, timeout=args.descriptor_timeout)
+            mydataset.prepareDataset(feature_calculator=feature_calculator,
                                      datafilters=datafilters, split=split, feature_filters=featurefilters,
                                      feature_standardizer=StandardScaler())
 
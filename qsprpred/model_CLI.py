@@ -12,6 +12,7 @@ import numpy as np
 import optuna
 import torch
 from qsprpred.data.data import QSPRDataset
+from qsprpred.data.utils.storage import detect_store_format, get_storage
 from qsprpred.logs.utils import backUpFiles, commit_hash, enable_file_logger
 from qsprpred.models.models import QSPRDNN, QSPRModel, QSPRsklearn
 from qsprpred.models.tasks import ModelTasks
@@ -22,6 +23,14 @@ from sklearn.neighbors import KNeighborsClassifier, KNeighborsRegressor
 from sklearn.svm import SVC, SVR
 from xgboost import XGBClassifier, XGBRegressor
 
+# Optuna pruners selectable with --pruner
+PRUNERS = {
+    None: lambda: None,
+    'median': optuna.pruners.MedianPruner,
+    'halving': optuna.pruners.SuccessiveHalvingPruner,
+    'hyperband': optuna.pruners.HyperbandPruner,
+}
+
 
 def QSPRArgParser(txt=None):
     """Define and read command line arguments."""
@@ -67,13 +76,28 @@ def QSPRArgParser(txt=None):
                         help="If included then the model will be trained on all data and saved")
     parser.add_argument('-o', '--optimization', type=str, default=None,
                         help="Hyperparameter optimization, if 'None' no optimization, if 'grid' gridsearch, \
-                            if 'bayes' bayesian optimization")
+                            if 'halving' gridsearch racing the candidates by successive halving (on the training set \
+                            size or, for DNN, the number of epochs), if 'bayes' bayesian optimization")
     parser.add_argument('-ss', '--search_space', type=str, default=None,
                         help="search_space hyperparameter optimization json file location (base_dir/[name].json), \
                               if None default qsprpred.models.search_space.json used")
     parser.add_argument('-nj', '--n_jobs', type=int, default=1,
                         help="number of parallel trials for hyperparameter optimization,\
                         warning this increase the number of CPU's used (ncpu x n_jobs)")
+    parser.add_argument('-st', '--storage', type=str, default=None,
+                        help="URL of an Optuna storage (i.e. sqlite:///study.db) to save bayesian optimization \
+                        studies to and resume them from, parallel trials use an SQLite file in the model \
+                        directory by default, which is overwritten unless --resume is given")
+    parser.add_argument('-re', '--resume', action='store_true',
+                        help="resume the bayesian optimization study saved by an earlier run of parallel trials")
+    parser.add_argument('-pru', '--pruner', type=str, default=None, choices=['median', 'halving', 'hyperband'],
+                        help="Optuna pruner to stop unpromising trials of bayesian optimization early, \
+                        no pruning by default")
+    parser.add_argument('-nf', '--n_jobs_folds', type=int, default=1,
+                        help="number of cross-validation folds evaluated in parallel (scikit-learn models only),\
+                        warning this increase the number of CPU's used (ncpu x n_jobs_folds)")
+    parser.add_argument('-hf', '--halving_factor', type=int, default=3,
+                        help="for 'halving' optimization, inverse of the fraction of candidates kept in each round")
     parser.add_argument('-nt', '--n_trials', type=int, default=20, help="number of trials for bayes optimization")
     parser.add_argument('-me', '--model_evaluation', action='store_true',
                         help='If on, model evaluation through cross validation and independent test set is performed.')
@@ -119,22 +143,27 @@ def QSPR_modelling(args):
                 "Parameter settings file (%s/%s.json) not found." % (args.base_dir, args.parameters))
             sys.exit()
 
-    if args.optimization in ['grid', 'bayes']:
+    if args.optimization in ['grid', 'halving', 'bayes']:
+        # successive halving searches the grid search spaces
+        optim_type = 'grid' if args.optimization == 'halving' else args.optimization
         if args.search_space:
             grid_params = QSPRModel.loadParamsGrid(
                 f'{args.base_dir}/{args.search_space}.json',
-                args.optimization,
+                optim_type,
                 args.model_types)
         else:
             grid_params = QSPRModel.loadParamsGrid(
-                None, args.optimization, args.model_types)
+                None, optim_type, args.model_types)
 
     for reg in args.regression:
         reg_abbr = 'REGRESSION' if reg else 'CLASSIFICATION'
         for property in args.properties:
             log.info(f"Property: {property[0]}")
 
-            mydataset = QSPRDataset.fromFile(f'{args.base_dir}/qspr/data/{reg_abbr}_{property[0]}_df.pkl')
+            # only the columns needed for the splits and the selected features are read from Parquet stores
+            store_prefix = f'{args.base_dir}/qspr/data/{reg_abbr}_{property[0]}'
+            store_format = detect_store_format(store_prefix) or 'pickle'
+            mydataset = QSPRDataset.fromFile(get_storage(store_format, store_prefix).path, lazy=True)
 
             for model_type in args.model_types:
                 print(model_type)
@@ -197,11 +226,16 @@ def QSPR_modelling(args):
                         parameters=parameters)
 
                 # if desired run parameter optimization
-                if args.optimization == 'grid':
+                if args.optimization in ['grid', 'halving']:
                     search_space_gs = grid_params[grid_params[:, 0] ==
                                                   model_type, 1][0]
                     log.info(search_space_gs)
-                    QSPRmodel.gridSearch(search_space_gs, n_jobs=args.n_jobs)
+                    halving = args.optimization == 'halving'
+                    if model_type == 'DNN':
+                        QSPRmodel.gridSearch(search_space_gs, halving=halving, factor=args.halving_factor)
+                    else:
+                        QSPRmodel.gridSearch(search_space_gs, n_jobs=args.n_jobs, halving=halving,
+                                             factor=args.halving_factor)
                 elif args.optimization == 'bayes':
                     search_space_bs = grid_params[grid_params[:, 0] ==
                                                   model_type, 1][0]
@@ -216,12 +250,17 @@ def QSPR_modelling(args):
                     elif model_type == "RF":
                         search_space_bs.update(
                             {'criterion': ['categorical', ['gini', 'entropy']]})
-                    QSPRmodel.bayesOptimization(search_space_bs, args.n_trials, n_jobs=args.n_jobs)
+                    QSPRmodel.bayesOptimization(search_space_bs, args.n_trials, n_jobs=args.n_jobs,
+                                                storage=args.storage, pruner=PRUNERS[args.pruner](),
+                                                resume=args.resume or None)
 
                 # initialize models from saved or default parameters
 
                 if args.model_evaluation:
-                    QSPRmodel.evaluate()
+                    if model_type == 'DNN':
+                        QSPRmodel.evaluate()
+                    else:
+                        QSPRmodel.evaluate(n_jobs=args.n_jobs_folds)
 
                 if args.save_model:
                     if (model_type == 'DNN') and not (args.model_evaluation):
@@ -8,7 +8,9 @@ from inspect import isclass
 from typing import Union, Type, List
 
 import numpy as np
+import optuna
 import pandas as pd
+from joblib import Parallel, delayed
 from sklearn import metrics
 
 from qsprpred import VERSION
@@ -21,6 +23,21 @@ from qsprpred.models.tasks import ModelTasks
 from qsprpred.utils.inspect import import_class
 
 
+def _optimize_study(model, study_name, storage, pruner, n_trials, objective_args):
+    """Run trials of a study saved in a shared storage, used to run trials in parallel processes.
+
+    Arguments:
+        model (QSPRModel): the optimized model
+        study_name (str): name of the study in the storage
+        storage (str): URL of the Optuna storage
+        pruner (optuna.pruners.BasePruner): pruner of the study
+        n_trials (int): number of trials to run
+        objective_args (tuple): arguments of `model.objective` after the trial
+    """
+    study = optuna.load_study(study_name=study_name, storage=model.getStudyStorage(storage), pruner=pruner)
+    study.optimize(lambda trial: model.objective(trial, *objective_args), n_trials)
+
+
 class QSPRModel(ABC):
     """
     The definition of the common model interface for the package. Handles model initialization, fit, cross validation and hyperparameter optimization.
@@ -77,8 +94,8 @@ class QSPRModel(ABC):
         # initialize a feature calculator instance
         self.featureCalculator = self.data.descriptorCalculator if self.data else self.readDescriptorCalculator(os.path.join(self.baseDir, self.metaInfo['feature_calculator_path']))
 
-        # initialize a standardizer instance
-        self.featureStandardizer = self.data.feature_standardizer if self.data else self.readStandardizer(os.path.join(self.baseDir, self.metaInfo['feature_standardizer_path'])) if self.metaInfo['feature_standardizer_path'] else None
+        # initialize a standardizer instance, models with data use the current standardizer of the data set
+        self._featureStandardizer = None if self.data else self.readStandardizer(os.path.join(self.baseDir, self.metaInfo['feature_standardizer_path'])) if self.metaInfo['feature_standardizer_path'] else None
 
         # initialize a model instance with the given parameters
         self.alg = alg
@@ -134,6 +151,16 @@ class QSPRModel(ABC):
         """
         return self.data.task if self.data else self.metaInfo['task']
 
+    @property
+    def featureStandardizer(self):
+        """
+        The feature standardizer of the model, taken from the data set or deserialized from file if the model is loaded without data.
+
+        Returns:
+            SKLearnStandardizer: feature standardizer of the model, `None` if the features are not standardized
+        """
+        return self.data.feature_standardizer if self.data else self._featureStandardizer
+
     @property
     def nClasses(self):
         """
@@ -375,6 +402,126 @@ class QSPRModel(ABC):
         """
         pass
 
+    @staticmethod
+    def suggestParams(trial, search_space_bs):
+        """Suggest the parameters of a trial of bayesian optimization.
+
+        Arguments:
+            trial (optuna.trial.Trial): the trial
+            search_space_bs (dict): search space for bayes optimization
+
+        Returns:
+            dict: the suggested parameters
+        """
+        bayesian_params = {}
+
+        for key, value in search_space_bs.items():
+            if value[0] == 'categorical':
+                bayesian_params[key] = trial.suggest_categorical(key, value[1])
+            elif value[0] == 'discrete_uniform':
+                bayesian_params[key] = trial.suggest_float(key, value[1], value[2], step=value[3])
+            elif value[0] == 'float':
+                bayesian_params[key] = trial.suggest_float(key, value[1], value[2])
+            elif value[0] == 'int':
+                bayesian_params[key] = trial.suggest_int(key, value[1], value[2])
+            elif value[0] == 'loguniform':
+                bayesian_params[key] = trial.suggest_float(key, value[1], value[2], log=True)
+            elif value[0] == 'uniform':
+                bayesian_params[key] = trial.suggest_float(key, value[1], value[2])
+
+        return bayesian_params
+
+    @staticmethod
+    def getStudyStorage(storage):
+        """Get the Optuna storage of a study. Trials of studies in a database send a heartbeat, so that trials of
+        killed runs can be marked as failed when the study is resumed.
+
+        Arguments:
+            storage (str): URL of the database (i.e. `sqlite:///study.db`), `None` for in-memory storage
+
+        Returns:
+            optuna.storages.BaseStorage: the storage, `None` for in-memory storage
+        """
+        if storage is None:
+            return None
+        return optuna.storages.RDBStorage(storage, heartbeat_interval=60, grace_period=180)
+
+    def createStudy(self, storage=None, study_name=None, n_jobs=1, pruner=None, resume=None):
+        """Create a study to maximize the objective of bayesian optimization or load it from its storage. Trials
+        of resumed studies are kept, trials of runs that were killed are marked as failed.
+
+        Trials report intermediate scores to the study (see `objective`), which are used to stop unpromising
+        trials early if a `pruner` is given.
+
+        Arguments:
+            storage (str): URL of the Optuna storage (i.e. `sqlite:///study.db`), trials run in parallel processes
+                (`n_jobs > 1`) are stored in an SQLite file in the output directory by default (`{outPrefix}_optuna.db`)
+            study_name (str): name of the study in the storage, the name of the model by default
+            n_jobs (int): number of parallel processes
+            pruner (optuna.pruners.BasePruner): pruner of the study, no trials are pruned by default
+            resume (bool): resume the study saved in the storage, by default only if `storage` or `study_name` is
+                given, otherwise a saved study of the same name is replaced by a new one
+
+        Returns:
+            tuple: the study and the URL of its storage (`None` for in-memory storage)
+        """
+        if resume is None:
+            resume = storage is not None or study_name is not None
+        if storage is None and n_jobs > 1:
+            storage = f"sqlite:///{os.path.abspath(self.outPrefix)}_optuna.db"
+        study_name = study_name or self.name
+        rdb_storage = self.getStudyStorage(storage)
+        if rdb_storage is not None and not resume:
+            try:
+                optuna.delete_study(study_name=study_name, storage=rdb_storage)
+                logger.info(f'Replaced the earlier study {study_name} in {storage}.')
+            except KeyError:
+                pass
+        study = optuna.create_study(
+            study_name=study_name,
+            storage=rdb_storage,
+            direction='maximize',
+            pruner=pruner if pruner is not None else optuna.pruners.NopPruner(),
+            load_if_exists=True
+        )
+        if storage is not None:
+            optuna.storages.fail_stale_trials(study)
+        return study, storage
+
+    def optimizeStudy(self, study, storage, n_trials, n_jobs=1, objective_args=()):
+        """Run the trials of bayesian optimization. Trials that finished in earlier runs of the study count towards
+        `n_trials`. Parallel trials run in separate processes that share the study through its storage, each
+        trial fits its own copy of the estimator.
+
+        Arguments:
+            study (optuna.Study): the study created with `createStudy`
+            storage (str): URL of the storage of the study, required if `n_jobs > 1`
+            n_trials (int): total number of trials
+            n_jobs (int): number of parallel processes
+            objective_args (tuple): arguments of `objective` after the trial
+        """
+        finished = [trial for trial in study.trials if trial.state.is_finished() and
+                    trial.state != optuna.trial.TrialState.FAIL]
+        n_remaining = max(0, n_trials - len(finished))
+        if len(finished) > 0:
+            logger.info(f'Resuming study {study.study_name} with {len(finished)} finished trials.')
+        if n_jobs > 1 and n_remaining > 1:
+            if storage is None:
+                raise ValueError("Parallel trials need a storage shared between processes.")
+            n_jobs = min(n_jobs, n_remaining)
+            if self.data is not None:
+                # the folds and features are cached before the data set is sent to the workers
+                self.data.createFolds()
+                self.data.getFeatures()
+            Parallel(n_jobs=n_jobs)(
+                delayed(_optimize_study)(
+                    self, study.study_name, storage, study.pruner,
+                    n_remaining // n_jobs + (1 if job < n_remaining % n_jobs else 0), objective_args
+                ) for job in range(n_jobs)
+            )
+        elif n_remaining > 0:
+            study.optimize(lambda trial: self.objective(trial, *objective_args), n_remaining)
+
     @staticmethod
     def loadParamsGrid(fname, optim_type, model_types):
         """Load parameter grids for bayes or grid search parameter optimization from json file.
@@ -470,6 +617,8 @@ class QSPRModel(ABC):
         dataset = MoleculeTable.fromSMILES(f"{self.__class__.__name__}_{hash(self)}", mols, drop_invalids=False)
         dataset.addProperty(self.targetProperty, np.nan)
         dataset = QSPRDataset.fromMolTable(dataset, self.targetProperty, drop_empty=False, drop_invalids=False)
+        # molecules are parsed once while checking validity and reused for the descriptors
+        dataset.storeMols = True
         failed_mask = dataset.dropInvalids().to_list()
         failed_indices = [idx for idx,x in enumerate(failed_mask) if not x]
         if not self.featureCalculator:
@@ -4,6 +4,7 @@ At the moment there is a class for sklearn type models
 and one for a keras DNN model. To add more types a model class should be added, which
 is a sublass of the QSPRModel type.
 """
+import copy
 import math
 import os
 import os.path
@@ -13,6 +14,7 @@ from functools import partial
 from inspect import isclass
 from typing import Type, Union
 
+from joblib import Parallel, delayed
 import numpy as np
 import optuna
 import pandas as pd
@@ -20,17 +22,73 @@ import sklearn_json as skljson
 import torch
 from qsprpred import DEFAULT_DEVICE, DEFAULT_GPUS
 from qsprpred.data.data import QSPRDataset
+from qsprpred.data.utils.sparse_features import densify, to_matrix
 from qsprpred.logs import logger
 from qsprpred.models.interfaces import QSPRModel
 from qsprpred.models.neural_network import STFullyConnected
 from qsprpred.models.tasks import ModelTasks
 from sklearn import metrics
-from sklearn.base import BaseEstimator
-from sklearn.model_selection import GridSearchCV, ParameterGrid, train_test_split
+from sklearn.base import BaseEstimator, clone
+from sklearn.experimental import enable_halving_search_cv  # noqa: F401 (enables HalvingGridSearchCV)
+from sklearn.model_selection import GridSearchCV, HalvingGridSearchCV, ParameterGrid, train_test_split
 from sklearn.svm import SVC, SVR
 
 
+def _fit_predict(model, X_train, y_train, X_test, task, n_classes, fold=None):
+    """Fit an estimator and predict the scores of the test set, used to run cross-validation folds in parallel.
+
+    Arguments:
+        model (BaseEstimator): the estimator to fit
+        X_train (np.ndarray, sparse.csr_matrix): training features
+        y_train (np.ndarray): training targets
+        X_test (np.ndarray, sparse.csr_matrix): test features
+        task (ModelTasks): task of the model
+        n_classes (int): number of classes
+        fold (int): number of the cross-validation fold, only used for logging
+
+    Returns:
+        tuple: the fitted estimator and the predicted values (regression) or probabilities (classification)
+    """
+    if fold is not None:
+        logger.info('cross validation fold %s started: %s' % (fold, datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+    if type(model).__name__ == 'PLSRegression':
+        model.fit(X=X_train, Y=y_train)
+    else:
+        model.fit(X=X_train, y=y_train)
+
+    if task == ModelTasks.REGRESSION:
+        preds = model.predict(X_test)
+        if len(preds.shape) > 1:
+            preds = preds[:, 0]
+    elif n_classes > 2:
+        preds = model.predict_proba(X_test)
+    else:
+        preds = model.predict_proba(X_test)[:, -1]
+    if fold is not None:
+        logger.info('cross validation fold %s ended: %s' % (fold, datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+    return model, preds
+
+
 class QSPRsklearn(QSPRModel):
+    """QSPR model for scikit-learn estimators.
+
+    Sparse features (i.e. fingerprints calculated with `FingerprintSet(..., sparse=True)`) are passed to the estimator
+    as a sparse CSR matrix unless the estimator only accepts dense input (see `denseAlgorithms`).
+
+    Attributes:
+        denseAlgorithms (tuple): names of estimator classes that do not accept sparse input
+    """
+
+    denseAlgorithms = (
+        "GaussianNB",
+        "PLSRegression",
+        "HistGradientBoostingClassifier",
+        "HistGradientBoostingRegressor",
+        "GaussianProcessClassifier",
+        "GaussianProcessRegressor",
+        "LinearDiscriminantAnalysis",
+        "QuadraticDiscriminantAnalysis",
+    )
 
     def __init__(self, base_dir: str, alg=None, data: QSPRDataset = None,
                  name: str = None, parameters: dict = None, autoload: bool = True):
@@ -54,7 +112,7 @@ class QSPRsklearn(QSPRModel):
         # check if data is available
         self.checkForData()
 
-        X_all = self.data.getFeatures(concat=True).values
+        X_all = self.toMatrix(self.data.getFeatures(concat=True))
         y_all = self.data.getTargetProperties(concat=True).values.ravel()
 
         fit_set = {'X': X_all}
@@ -69,76 +127,24 @@ class QSPRsklearn(QSPRModel):
         logger.info('Model fit ended: %s' % datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
         self.save()
 
-    def evaluate(self, save=True):
+    def evaluate(self, save=True, n_jobs=1):
         """Make predictions for crossvalidation and independent test set.
 
+        Each fold is fitted with a clone of the estimator, so the folds and the final fit on the whole training set
+        can run in parallel (`n_jobs`). Large feature matrices are memory-mapped by `joblib` and shared read-only
+        with the worker processes. After evaluation, `model` is fitted on the whole training set.
+
         arguments:
             save (bool): don't save predictions when used in bayesian optimization
+            n_jobs (int): number of folds fitted in parallel, -1 to use all cores
         """
 
         # check if data is available
         self.checkForData()
 
-        folds = self.data.createFolds()
-        X, X_ind = self.data.getFeatures()
+        cvs, fold_counter, (self.model, inds) = self._crossValidate(self.model, n_jobs=n_jobs)
         y, y_ind = self.data.getTargetProperties()
 
-        cvs = np.zeros(
-            len(y)) if (
-            self.data.task == ModelTasks.REGRESSION or not self.data.isMultiClass()) else np.zeros(
-            (y.shape[0],
-             self.data.nClasses))
-
-        fold_counter = np.zeros(y.shape[0])
-
-        # cross validation
-        for i, (X_train, X_test, y_train, y_test, idx_train, idx_test) in enumerate(folds):
-            logger.info('cross validation fold %s started: %s' % (i, datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
-
-            fold_counter[idx_test] = i
-
-            fit_set = {'X': X_train}
-
-            # self.data.createFolds() returns numpy arrays by default so we don't call `.values` here
-            if (isclass(self.alg) and self.alg.__name__ == 'PLSRegression') or (
-                    type(self.alg).__name__ == 'PLSRegression'):
-                fit_set['Y'] = y_train.ravel()
-            else:
-                fit_set['y'] = y_train.ravel()
-            self.model.fit(**fit_set)
-
-            if self.data.task == ModelTasks.REGRESSION:
-                preds = self.model.predict(X_test)
-                if len(preds.shape) > 1:
-                    preds = preds[:, 0]
-                cvs[idx_test] = preds
-            elif self.data.nClasses > 2:
-                cvs[idx_test] = self.model.predict_proba(X_test)
-            else:
-                cvs[idx_test] = self.model.predict_proba(X_test)[:, -1]
-
-            logger.info('cross validation fold %s ended: %s' % (i, datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
-
-        # fitting on whole trainingset and predicting on test set
-        fit_set = {'X': X}
-
-        if type(self.model).__name__ == 'PLSRegression':
-            fit_set['Y'] = y.values.ravel()
-        else:
-            fit_set['y'] = y.values.ravel()
-
-        self.model.fit(**fit_set)
-
-        if self.data.task == ModelTasks.REGRESSION:
-            preds = self.model.predict(X_ind)
-            if len(preds.shape) > 1:
-                preds = preds[:, 0]
-            inds = preds
-        elif self.data.nClasses > 2:
-            inds = self.model.predict_proba(X_ind)
-        else:
-            inds = self.model.predict_proba(X_ind)[:, -1]
-
         # save crossvalidation results
         if save:
             train, test = pd.DataFrame(
@@ -156,13 +162,86 @@ class QSPRsklearn(QSPRModel):
 
         return cvs
 
-    def gridSearch(self, search_space_gs, scoring=None, n_jobs=1):
+    def _crossValidate(self, model, n_jobs=1, fit_final=True, fold_callback=None):
+        """Cross-validate an estimator, the estimator itself is not fitted.
+
+        Arguments:
+            model (BaseEstimator): the estimator, each fold is fitted with a clone
+            n_jobs (int): number of folds fitted in parallel, -1 to use all cores
+            fit_final (bool): also fit a clone on the whole training set and predict the independent test set
+            fold_callback (callable): called with the number of the fold, the positions of its test samples and
+                their predictions after each fold (i.e. to report intermediate scores to an optuna trial), the folds
+                are then fitted one after another and exceptions raised by the callback stop the cross-validation
+
+        Returns:
+            tuple: predictions of the folds, the fold of each training sample and the estimator fitted on the whole
+                training set with its predictions of the independent test set (`None` if `fit_final` is `False`)
+        """
+        folds = self.data.createFolds()
+        X, X_ind = self.data.getFeatures()
+        y, y_ind = self.data.getTargetProperties()
+
+        cvs = np.zeros(
+            len(y)) if (
+            self.data.task == ModelTasks.REGRESSION or not self.data.isMultiClass()) else np.zeros(
+            (y.shape[0],
+             self.data.nClasses))
+
+        fold_counter = np.zeros(y.shape[0])
+
+        fold_indices = []
+
+        def jobs():
+            # fitting on whole trainingset and predicting on test set, the largest job is started first
+            if fit_final:
+                yield delayed(_fit_predict)(
+                    clone(model), self.toMatrix(X), y.values.ravel(), self.toMatrix(X_ind), self.data.task,
+                    self.data.nClasses
+                )
+            # cross validation, the folds are cached by the data set and dispatched when a worker is ready for them
+            for i, (X_train, X_test, y_train, y_test, idx_train, idx_test) in enumerate(folds):
+                fold_counter[idx_test] = i
+                fold_indices.append(idx_test)
+                # self.data.createFolds() returns numpy arrays by default so we don't call `.values` here
+                yield delayed(_fit_predict)(
+                    clone(model), self.toMatrix(X_train), y_train.ravel(), self.toMatrix(X_test),
+                    self.data.task, self.data.nClasses, fold=i
+                )
+
+        logger.info('cross validation started: %s' % datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+        if fold_callback is None:
+            results = Parallel(n_jobs=n_jobs)(jobs())
+        else:
+            results = []
+            for func, args, kwargs in jobs():
+                results.append(func(*args, **kwargs))
+                if 'fold' in kwargs:
+                    fold_callback(kwargs['fold'], fold_indices[-1], results[-1][1])
+        logger.info('cross validation ended: %s' % datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+
+        final = results.pop(0) if fit_final else None
+        for idx_test, (_, preds) in zip(fold_indices, results):
+            cvs[idx_test] = preds
+
+        return cvs, fold_counter, final
+
+    def gridSearch(self, search_space_gs, scoring=None, n_jobs=1, halving=False, factor=3, min_resources='exhaust'):
         """Optimization of hyperparameters using gridSearch.
 
+        With `halving`, the candidates are raced by successive halving (`HalvingGridSearchCV`): all candidates are
+        cross-validated on a random subsample of the training set, the best `1 / factor` of them are kept and the
+        subsample is enlarged `factor` times until the best candidates remain.
+
         Arguments:
             search_space_gs (dict): search space for the grid search
             scoring (Optional[str, Callable]): scoring function for the grid search.
             n_jobs (int): number of jobs for hyperparameter optimization
+            halving (bool): race the candidates by successive halving instead of evaluating all of them on the
+                whole training set
+            factor (int): inverse of the fraction of candidates kept in each round of successive halving
+            min_resources (Union[int, str]): number of training samples in the first round of successive halving,
+                'exhaust' uses the whole training set in the last round, 'smallest' starts with as few samples as
+                possible
 
         Note: Default `scoring=None` will use explained_variance for regression,
         roc_auc_ovr_weighted for multiclass, and roc_auc for binary classification.
@@ -176,12 +255,18 @@ class QSPRsklearn(QSPRModel):
                 scoring = 'roc_auc_ovr_weighted'
             else:
                 scoring = 'roc_auc'
-        grid = GridSearchCV(self.model, search_space_gs, n_jobs=n_jobs, verbose=1, cv=(
-            (x[4], x[5]) for x in self.data.createFolds()), scoring=scoring, refit=False)
+        # the splits are reused in each round of successive halving
+        folds = [(x[4], x[5]) for x in self.data.createFolds()]
+        if halving:
+            grid = HalvingGridSearchCV(self.model, search_space_gs, factor=factor, min_resources=min_resources,
+                                       n_jobs=n_jobs, verbose=1, cv=folds, scoring=scoring, refit=False)
+        else:
+            grid = GridSearchCV(self.model, search_space_gs, n_jobs=n_jobs, verbose=1, cv=folds, scoring=scoring,
+                                refit=False)
 
         X, X_ind = self.data.getFeatures()
         y, y_ind = self.data.getTargetProperties()
-        fit_set = {'X': X, 'y': y.iloc[:, 0].values.ravel()}
+        fit_set = {'X': self.toMatrix(X), 'y': y.iloc[:, 0].values.ravel()}
         logger.info('Grid search started: %s' % datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
         grid.fit(**fit_set)
         logger.info('Grid search ended: %s' % datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
@@ -191,15 +276,29 @@ class QSPRsklearn(QSPRModel):
         self.model = self.model.set_params(**grid.best_params_)
         self.save()
 
-    def bayesOptimization(self, search_space_bs, n_trials, scoring=None, th=0.5, n_jobs=1):
+    def bayesOptimization(self, search_space_bs, n_trials, scoring=None, th=0.5, n_jobs=1, storage=None,
+                          study_name=None, pruner=None, resume=None):
         """Bayesian optimization of hyperparameters using optuna.
 
+        Each trial is evaluated with its own clone of the estimator, so trials can run in parallel processes
+        (`n_jobs`) that share the study through a database (`storage`). Studies in a given database are resumed
+        when the optimization is started again, already finished trials count towards `n_trials`. The mean score of the
+        finished cross-validation folds is reported to the trial after each fold, so that a `pruner` can stop
+        unpromising trials early.
+
         Arguments:
             search_space_gs (dict): search space for the grid search
             n_trials (int): number of trials for bayes optimization
             scoring (Optional[str, Callable]): scoring function for the optimization.
             th (float): threshold for scoring if `scoring in self._needs_discrete_to_score`.
             n_jobs (int): the number of parallel trials
+            storage (str): URL of the Optuna storage (i.e. `sqlite:///study.db`), trials run in parallel are stored
+                in `{outPrefix}_optuna.db` by default
+            study_name (str): name of the study in the storage, the name of the model by default
+            pruner (optuna.pruners.BasePruner): pruner that stops unpromising trials early (i.e.
+                `optuna.pruners.MedianPruner()`), no trials are pruned by default
+            resume (bool): resume the saved study, by default only if `storage` or `study_name` is given, the
+                default study of parallel trials is replaced otherwise
 
         Example of search_space_bs for scikit-learn's MLPClassifier:
         >>> model = QSPRsklearn(base_dir='.', data=dataset,
@@ -220,13 +319,9 @@ class QSPRsklearn(QSPRModel):
         https://scikit-learn.org/stable/modules/model_evaluation.html
         """
         print('Bayesian optimization can take a while for some hyperparameter combinations')
-        if n_jobs > 1:
-            logger.warning("At the moment n_jobs>1 not available for bayesoptimization. n_jobs set to 1")
-            n_jobs = 1
-
-        study = optuna.create_study(direction='maximize')
+        study, storage = self.createStudy(storage, study_name, n_jobs, pruner, resume)
         logger.info('Bayesian optimization started: %s' % datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
-        study.optimize(lambda trial: self.objective(trial, scoring, th, search_space_bs), n_trials, n_jobs=n_jobs)
+        self.optimizeStudy(study, storage, n_trials, n_jobs, (scoring, th, search_space_bs))
         logger.info('Bayesian optimization ended: %s' % datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
 
         trial = study.best_trial
@@ -245,30 +340,32 @@ class QSPRsklearn(QSPRModel):
             th (float): threshold for scoring if `scoring in self._needs_discrete_to_score`.
             search_space_bs (dict): search space for bayes optimization
         """
-        bayesian_params = {}
-
-        for key, value in search_space_bs.items():
-            if value[0] == 'categorical':
-                bayesian_params[key] = trial.suggest_categorical(key, value[1])
-            elif value[0] == 'discrete_uniform':
-                bayesian_params[key] = trial.suggest_float(key, value[1], value[2], step=value[3])
-            elif value[0] == 'float':
-                bayesian_params[key] = trial.suggest_float(key, value[1], value[2])
-            elif value[0] == 'int':
-                bayesian_params[key] = trial.suggest_int(key, value[1], value[2])
-            elif value[0] == 'loguniform':
-                bayesian_params[key] = trial.suggest_float(key, value[1], value[2], log=True)
-            elif value[0] == 'uniform':
-                bayesian_params[key] = trial.suggest_float(key, value[1], value[2])
-
+        bayesian_params = self.suggestParams(trial, search_space_bs)
         print(bayesian_params)
-        self.model.set_params(**bayesian_params)
+        # the shared estimator is not changed, so that trials can run in parallel
+        model = clone(self.model).set_params(**bayesian_params)
 
         y, y_ind = self.data.getTargetProperties()
         if scoring in self._needs_discrete_to_score:
             y = np.where(y > th, 1, 0)
         score_func = self.get_scoring_func(scoring)
-        score = score_func(y, self.evaluate(save=False))
+        fold_scores = []
+
+        def report(fold, idx_test, preds):
+            # the mean score of the finished folds is reported, so the pruner can stop the trial early
+            try:
+                fold_scores.append(score_func(np.asarray(y)[idx_test], preds))
+            except ValueError:
+                # the score is not defined for this fold (i.e. only one class in the test set)
+                return
+            trial.report(np.mean(fold_scores), fold)
+            if trial.should_prune():
+                raise optuna.TrialPruned()
+
+        # folds are only validated one by one if the scores are used for pruning, otherwise they run in parallel
+        pruned = not isinstance(trial.study.pruner, optuna.pruners.NopPruner)
+        cvs, _, _ = self._crossValidate(model, fit_final=False, fold_callback=report if pruned else None)
+        score = score_func(y, cvs)
         return score
 
     def loadModel(self, alg: Union[Type, BaseEstimator] = None, params: dict = None):
@@ -294,19 +391,36 @@ class QSPRsklearn(QSPRModel):
         skljson.to_json(self.model, model_path)
         return model_path
 
+    @property
+    def supportsSparse(self) -> bool:
+        """Whether the estimator accepts sparse input."""
+        return type(self.model).__name__ not in self.denseAlgorithms
+
+    def toMatrix(self, X):
+        """Convert features to the input of the estimator. Sparse features are kept sparse if the estimator
+        supports it and are converted to a dense array otherwise.
+
+        Arguments:
+            X (pd.DataFrame, np.ndarray, sparse.spmatrix): the features
+
+        Returns:
+            np.ndarray or sparse.csr_matrix: the feature matrix
+        """
+        return to_matrix(X, sparse_input=self.supportsSparse)
+
     def predict(self, X: Union[pd.DataFrame, np.ndarray, QSPRDataset]):
         if isinstance(X, QSPRDataset):
             X = X.getFeatures(raw=True, concat=True)
         if self.featureStandardizer:
-            X = self.featureStandardizer(X)
-        return self.model.predict(X)
+            X = self.featureStandardizer(densify(X) if isinstance(X, pd.DataFrame) else to_matrix(X, False))
+        return self.model.predict(self.toMatrix(X))
 
     def predictProba(self, X: Union[pd.DataFrame, np.ndarray, QSPRDataset]):
         if isinstance(X, QSPRDataset):
             X = X.getFeatures(raw=True, concat=True)
         if self.featureStandardizer:
-            X = self.featureStandardizer(X)
-        return self.model.predict_proba(X)
+            X = self.featureStandardizer(densify(X) if isinstance(X, pd.DataFrame) else to_matrix(X, False))
+        return self.model.predict_proba(self.toMatrix(X))
 
 
 class QSPRDNN(QSPRModel):
@@ -469,26 +583,8 @@ class QSPRDNN(QSPRModel):
         X, X_ind = self.data.getFeatures()
         y, y_ind = self.data.getTargetProperties()
         indep_loader = self.model.get_dataloader(X_ind.values)
-        last_save_epochs = 0
 
-        cvs = np.zeros((y.shape[0], max(1, self.data.nClasses)))
-        fold_counter = np.zeros(y.shape[0])
-        for i, (X_train, X_test, y_train, y_test, idx_train, idx_test) in enumerate(self.data.createFolds()):
-            y_train = y_train.reshape(-1, 1)
-            X_train_fold, X_val_fold, y_train_fold, y_val_fold = train_test_split(
-                X_train, y_train, test_size=ES_val_size)
-            train_loader = self.model.get_dataloader(X_train_fold, y_train_fold)
-            ES_valid_loader = self.model.get_dataloader(X_val_fold, y_val_fold)
-            valid_loader = self.model.get_dataloader(X_test)
-            last_save_epoch = self.model.fit(
-                train_loader, ES_valid_loader, '%s_temp' %
-                self.outPrefix, self.patience, self.tol)
-            last_save_epochs += last_save_epoch
-            logger.info(f'cross validation fold {i}: last save epoch {last_save_epoch}')
-            os.remove('%s_temp_weights.pkg' % self.outPrefix)
-            cvs[idx_test] = self.model.predict(valid_loader)
-            fold_counter[idx_test] = i
-        os.remove('%s_temp.log' % self.outPrefix)
+        cvs, fold_counter, last_save_epochs = self._crossValidate(self.model, self.outPrefix, ES_val_size)
 
         if save:
             n_folds = max(fold_counter) + 1
@@ -520,9 +616,59 @@ class QSPRDNN(QSPRModel):
         else:
             return cvs
 
-    def gridSearch(self, search_space_gs, scoring=None, th=0.5, ES_val_size=0.1):
+    def _crossValidate(self, model, out_prefix, ES_val_size=0.1, epoch_callback=None):
+        """Cross-validate a network with early stopping on a part of the training set of each fold.
+
+        Arguments:
+            model (STFullyConnected): the network, it is refitted on each fold
+            out_prefix (str): prefix of the temporary files written during training
+            ES_val_size (float): validation set size for early stopping in CV
+            epoch_callback (callable): called with the number of the fold, the epoch and the validation loss after
+                each epoch (i.e. to report intermediate scores to an optuna trial), exceptions raised by the
+                callback stop the cross-validation
+
+        Returns:
+            tuple: predictions of the folds, the fold of each training sample and the sum of the epochs with the best
+                validation loss of all folds
+        """
+        y, y_ind = self.data.getTargetProperties()
+        last_save_epochs = 0
+
+        cvs = np.zeros((y.shape[0], max(1, self.data.nClasses)))
+        fold_counter = np.zeros(y.shape[0])
+        try:
+            for i, (X_train, X_test, y_train, y_test, idx_train, idx_test) in enumerate(self.data.createFolds()):
+                y_train = y_train.reshape(-1, 1)
+                X_train_fold, X_val_fold, y_train_fold, y_val_fold = train_test_split(
+                    X_train, y_train, test_size=ES_val_size)
+                train_loader = model.get_dataloader(X_train_fold, y_train_fold)
+                ES_valid_loader = model.get_dataloader(X_val_fold, y_val_fold)
+                valid_loader = model.get_dataloader(X_test)
+                last_save_epoch = model.fit(
+                    train_loader, ES_valid_loader, '%s_temp' %
+                    out_prefix, self.patience, self.tol,
+                    epoch_callback=partial(epoch_callback, i) if epoch_callback else None)
+                last_save_epochs += last_save_epoch
+                logger.info(f'cross validation fold {i}: last save epoch {last_save_epoch}')
+                os.remove('%s_temp_weights.pkg' % out_prefix)
+                cvs[idx_test] = model.predict(valid_loader)
+                fold_counter[idx_test] = i
+        finally:
+            # temporary files are also removed if the cross-validation was stopped
+            for path in ('%s_temp_weights.pkg' % out_prefix, '%s_temp.log' % out_prefix):
+                if os.path.exists(path):
+                    os.remove(path)
+
+        return cvs, fold_counter, last_save_epochs
+
+    def gridSearch(self, search_space_gs, scoring=None, th=0.5, ES_val_size=0.1, halving=False, factor=3,
+                   min_epochs=None):
         """Optimization of hyperparameters using gridSearch.
 
+        With `halving`, the candidates are raced by successive halving on the number of training epochs: all
+        candidates are cross-validated with a small number of epochs, the best `1 / factor` of them are kept and the
+        number of epochs is increased `factor` times until the best candidates are trained for all their epochs.
+
         Arguments:
             search_space_gs (dict): search space for the grid search, accepted parameters are:
                 lr (int) ~ learning rate for fitting
@@ -534,9 +680,24 @@ class QSPRDNN(QSPRModel):
             scoring (Optional[str, Callable]): scoring function for the grid search.
             th (float): threshold for scoring if `scoring in self._needs_discrete_to_score`.
             ES_val_size (float): validation set size for early stopping in CV
+            halving (bool): race the candidates by successive halving instead of training all of them to early
+                stopping on every fold
+            factor (int): inverse of the fraction of candidates kept in each round of successive halving
+            min_epochs (int): maximum number of epochs in the first round of successive halving, by default the
+                candidates are trained for all their epochs in the last round
         """
         self.model = self.loadModel(self.alg)
 
+        if halving:
+            logger.info('Grid search started: %s' % datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+            self.parameters = self._halvingSearch(
+                list(ParameterGrid(search_space_gs)), scoring, th, ES_val_size, factor, min_epochs)
+            logger.info('Grid search best parameters: %s' % self.parameters)
+            logger.info('Grid search ended: %s' % datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+            self.model.set_params(**self.parameters)
+            self.save()
+            return
+
         if self.data.task == ModelTasks.REGRESSION:
             scoring = metrics.explained_variance_score
         else:
@@ -583,28 +744,88 @@ class QSPRDNN(QSPRModel):
         self.model.set_params(**self.parameters)
         self.save()
 
-    def bayesOptimization(self, search_space_bs, n_trials, scoring=None, th=0.5, n_jobs=1):
+    def _halvingSearch(self, candidates, scoring=None, th=0.5, ES_val_size=0.1, factor=3, min_epochs=None):
+        """Race parameter settings by successive halving on the number of training epochs.
+
+        In each round, all remaining candidates are cross-validated with early stopping and at most the number of
+        epochs of the round. The best `1 / factor` of them are kept and the number of epochs is multiplied by
+        `factor`, until one candidate is left or the candidates were trained for all their epochs.
+
+        Arguments:
+            candidates (list of dict): parameter settings of the network
+            scoring (Optional[str, Callable]): scoring function of the cross-validation predictions
+            th (float): threshold for scoring if `scoring in self._needs_discrete_to_score`.
+            ES_val_size (float): validation set size for early stopping in CV
+            factor (int): inverse of the fraction of candidates kept in each round
+            min_epochs (int): maximum number of epochs in the first round, by default it is chosen so that the
+                candidates of the last round are trained for all their epochs
+
+        Returns:
+            dict: the best parameter settings
+        """
+        y, y_ind = self.data.getTargetProperties()
+        if scoring in self._needs_discrete_to_score:
+            y = np.where(y > th, 1, 0)
+        score_func = self.get_scoring_func(scoring)
+
+        max_epochs = max(params.get('n_epochs', self.model.n_epochs) for params in candidates)
+        if min_epochs is None:
+            n_rounds, n_candidates = 1, len(candidates)
+            while n_candidates > 1:
+                n_candidates = math.ceil(n_candidates / factor)
+                n_rounds += 1
+            min_epochs = max(1, max_epochs // factor ** (n_rounds - 1))
+
+        epochs = min(min_epochs, max_epochs)
+        while True:
+            logger.info(f'Successive halving: {len(candidates)} candidates, at most {epochs} epochs')
+            scores = []
+            for params in candidates:
+                # each candidate is trained for the number of epochs of the round, but not more than its own
+                model = copy.deepcopy(self.model).set_params(
+                    **{**params, 'n_epochs': min(epochs, params.get('n_epochs', self.model.n_epochs))})
+                cvs, _, _ = self._crossValidate(model, self.outPrefix, ES_val_size)
+                scores.append(score_func(y, cvs[:, 1] if self.data.nClasses == 2 else cvs))
+                logger.info(f'{params}: {scores[-1]}')
+            if len(candidates) == 1 or epochs >= max_epochs:
+                return candidates[int(np.argmax(scores))]
+            best = np.argsort(scores)[::-1][:math.ceil(len(candidates) / factor)]
+            candidates = [candidates[i] for i in best]
+            if len(candidates) == 1:
+                return candidates[0]
+            epochs = min(epochs * factor, max_epochs)
+
+    def bayesOptimization(self, search_space_bs, n_trials, scoring=None, th=0.5, n_jobs=1, storage=None,
+                          study_name=None, pruner=None, resume=None):
         """Bayesian optimization of hyperparameters using optuna.
 
+        Each trial trains its own copy of the network, so trials can run in parallel processes (`n_jobs`) that
+        share the study through a database (`storage`). Studies in a given database are resumed when the
+        optimization is started again, already finished trials count towards `n_trials`. The negative validation loss of each
+        epoch is reported to the trial, so that a `pruner` can stop unpromising trials early.
+
         Arguments:
             search_space_gs (dict): search space for the grid search
             n_trials (int): number of trials for bayes optimization
             scoring (Optional[str, Callable]): scoring function for the optimization.
             th (float): threshold for scoring if `scoring in self._needs_discrete_to_score`.
             n_jobs (int): the number of parallel trials
+            storage (str): URL of the Optuna storage (i.e. `sqlite:///study.db`), trials run in parallel are stored
+                in `{outPrefix}_optuna.db` by default
+            study_name (str): name of the study in the storage, the name of the model by default
+            pruner (optuna.pruners.BasePruner): pruner that stops unpromising trials early (i.e.
+                `optuna.pruners.MedianPruner()`), no trials are pruned by default
+            resume (bool): resume the saved study, by default only if `storage` or `study_name` is given, the
+                default study of parallel trials is replaced otherwise
         """
         print('Bayesian optimization can take a while for some hyperparameter combinations')
         # TODO add timeout function
 
         self.model = self.loadModel(self.alg)
 
-        if n_jobs > 1:
-            logger.warning("At the moment n_jobs>1 not available for bayesoptimization. n_jobs set to 1")
-            n_jobs = 1
-
-        study = optuna.create_study(direction='maximize')
+        study, storage = self.createStudy(storage, study_name, n_jobs, pruner, resume)
         logger.info('Bayesian optimization started: %s' % datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
-        study.optimize(lambda trial: self.objective(trial, scoring, th, search_space_bs), n_trials, n_jobs=n_jobs)
+        self.optimizeStudy(study, storage, n_trials, n_jobs, (scoring, th, search_space_bs))
         logger.info('Bayesian optimization ended: %s' % datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
 
         trial = study.best_trial
@@ -624,29 +845,30 @@ class QSPRDNN(QSPRModel):
             th (float): threshold for scoring if `scoring in self._needs_discrete_to_score`.
             search_space_bs (dict): search space for bayes optimization
         """
-        bayesian_params = {}
-
-        for key, value in search_space_bs.items():
-            if value[0] == 'categorical':
-                bayesian_params[key] = trial.suggest_categorical(key, value[1])
-            elif value[0] == 'discrete_uniform':
-                bayesian_params[key] = trial.suggest_discrete_uniform(key, value[1], value[2], value[3])
-            elif value[0] == 'float':
-                bayesian_params[key] = trial.suggest_float(key, value[1], value[2])
-            elif value[0] == 'int':
-                bayesian_params[key] = trial.suggest_int(key, value[1], value[2])
-            elif value[0] == 'loguniform':
-                bayesian_params[key] = trial.suggest_float(key, value[1], value[2], log=True)
-            elif value[0] == 'uniform':
-                bayesian_params[key] = trial.suggest_float(key, value[1], value[2])
-
-        self.model.set_params(**bayesian_params)
+        bayesian_params = self.suggestParams(trial, search_space_bs)
+        # each trial trains its own network and writes its own temporary files, so that trials can run in parallel
+        model = copy.deepcopy(self.model).set_params(**bayesian_params)
 
         y, y_ind = self.data.getTargetProperties()
         if scoring in self._needs_discrete_to_score:
             y = np.where(y > th, 1, 0)
         score_func = self.get_scoring_func(scoring)
-        score = score_func(y, self.evaluate(save=False))
+        # the number of epochs can differ between trials, so the steps are offset by the largest one
+        max_epochs = self.model.n_epochs
+        if "n_epochs" in search_space_bs:
+            value = search_space_bs["n_epochs"]
+            max_epochs = max(value[1]) if value[0] == 'categorical' else value[2]
+        max_epochs = int(max(max_epochs, model.n_epochs))
+
+        def report(fold, epoch, loss_valid):
+            # the negative validation loss is reported as the study is maximized, the steps of each fold are
+            # offset by the maximum number of epochs so that trials are compared at the same fold and epoch
+            trial.report(-loss_valid, fold * max_epochs + epoch)
+            if trial.should_prune():
+                raise optuna.TrialPruned()
+
+        cvs, _, _ = self._crossValidate(model, f"{self.outPrefix}_trial{trial.number}", epoch_callback=report)
+        score = score_func(y, cvs[:, 1] if self.data.nClasses == 2 else cvs)
         return score
 
     def saveModel(self) -> str:
@@ -7,6 +7,7 @@ from collections import defaultdict
 import numpy as np
 import torch
 from qsprpred import DEFAULT_DEVICE, DEFAULT_GPUS
+from qsprpred.data.utils.sparse_features import has_sparse, to_matrix
 from qsprpred.logs import logger
 from torch import nn, optim
 from torch.nn import functional as F
@@ -42,7 +43,7 @@ class Base(nn.Module):
                 f"At the moment multiple gpus is not possible: running DNN on gpu: {gpus[0]}."
             )
 
-    def fit(self, train_loader, valid_loader, out, patience=50, tol=0):
+    def fit(self, train_loader, valid_loader, out, patience=50, tol=0, epoch_callback=None):
         """Training the DNN model.
 
         Training is, similar to the scikit-learn or Keras style.
@@ -62,6 +63,9 @@ class Base(nn.Module):
                 always train to n_epochs
             tol (float): minimum absolute improvement of loss necessary to count as
                 progress on best validation score
+            epoch_callback (callable): called with the epoch and the validation loss after
+                each epoch if a validation set is used (i.e. to report the loss to an optuna
+                trial), exceptions raised by the callback stop the training
         """
         if "optim" in self.__dict__:
             optimizer = self.optim
@@ -136,6 +140,12 @@ class Base(nn.Module):
                     # in 100 epochs. The model training will stop in order to save time.
                     if epoch - last_save > patience:
                         break
+                if epoch_callback is not None:
+                    try:
+                        epoch_callback(epoch, loss_valid)
+                    except Exception:
+                        log.close()
+                        raise
         if patience == -1:
             torch.save(self.state_dict(), out + "_weights.pkg")
         print("Neural net fitting completed.", file=log)
@@ -285,6 +295,8 @@ class Base(nn.Module):
         X (numpy 2d array): input dataset
         y (numpy 1d column vector): output data
         """
+        if has_sparse(X):
+            X = to_matrix(X, sparse_input=False)
         if y is None:
             tensordataset = torch.Tensor(X)
         else:
@@ -7,10 +7,14 @@ from os.path import exists
 from unittest import TestCase
 
 import numpy as np
+import optuna
 import pandas as pd
+import scipy.sparse
 import torch
 from parameterized import parameterized
 from qsprpred.data.tests import DataSetsMixIn
+from qsprpred.data.utils.descriptorcalculator import DescriptorsCalculator
+from qsprpred.data.utils.descriptorsets import FingerprintSet
 from qsprpred.models.interfaces import QSPRModel
 from qsprpred.models.models import QSPRDNN, QSPRsklearn
 from qsprpred.models.neural_network import STFullyConnected
@@ -214,6 +218,50 @@ class NeuralNet(ModelDataSetsMixIn, ModelTestMixIn, TestCase):
         self.fit_test(model)
         self.predictor_test(alg_name, model.baseDir, QSPRDNN)
 
+    def test_halving_grid_search(self):
+        dataset = self.create_large_dataset(task=ModelTasks.REGRESSION, preparation_settings=self.get_default_prep())
+        model = self.get_model(name="STFullyConnected_halving", alg=STFullyConnected, dataset=dataset)
+        search_space_gs = {'lr': [1e-4, 1e-3, 1e-2], 'n_epochs': [8]}
+
+        # record the number of epochs of each cross-validation
+        epochs = []
+        cross_validate = model._crossValidate
+
+        def record(network, *args, **kwargs):
+            epochs.append(network.n_epochs)
+            return cross_validate(network, *args, **kwargs)
+
+        model._crossValidate = record
+
+        # 3 candidates with 2 epochs, the best 2 with 4 epochs
+        model.gridSearch(search_space_gs, halving=True, factor=2)
+        self.assertListEqual(epochs, [2, 2, 2, 4, 4])
+        self.assertIn(model.parameters['lr'], search_space_gs['lr'])
+        self.assertEqual(model.parameters['n_epochs'], 8)
+        self.assertTrue(exists(f"{model.baseDir}/{model.metaInfo['parameters_path']}"))
+
+    def test_pruning(self):
+        dataset = self.create_large_dataset(task=ModelTasks.REGRESSION, preparation_settings=self.get_default_prep())
+        model = self.get_model(name="STFullyConnected_pruning", alg=STFullyConnected, dataset=dataset)
+        search_space_bs = {'n_epochs': ['categorical', [2, 4]]}
+        n_folds = len(list(dataset.createFolds()))
+
+        # the steps of each fold are offset by the largest number of epochs of the search space
+        study, _ = model.createStudy(pruner=optuna.pruners.MedianPruner(n_startup_trials=10))
+        study.optimize(lambda trial: model.objective(trial, None, 0.5, search_space_bs), 4)
+        for trial in study.trials:
+            self.assertEqual(trial.state, optuna.trial.TrialState.COMPLETE)
+            steps = list(trial.intermediate_values)
+            self.assertSetEqual({step // 4 for step in steps}, set(range(n_folds)))
+            self.assertTrue(all(step % 4 < trial.params['n_epochs'] for step in steps))
+
+        # trials are stopped after the first epoch if the pruner says so
+        study, _ = model.createStudy(pruner=optuna.pruners.ThresholdPruner(lower=np.inf))
+        study.optimize(lambda trial: model.objective(trial, None, 0.5, search_space_bs), 2)
+        for trial in study.trials:
+            self.assertEqual(trial.state, optuna.trial.TrialState.PRUNED)
+            self.assertListEqual(list(trial.intermediate_values), [0])
+
 
 class TestQSPRsklearn(ModelDataSetsMixIn, ModelTestMixIn, TestCase):
 
@@ -297,3 +345,106 @@ class TestQSPRsklearn(ModelDataSetsMixIn, ModelTestMixIn, TestCase):
         )
         self.fit_test(model)
         self.predictor_test(f"{model_name}_{task}", model.baseDir)
+
+    @parameterized.expand([
+        ("RFC", RandomForestClassifier, {"n_jobs": N_CPUS}, True),
+        ("NB", GaussianNB, None, False),
+    ])
+    def test_sparse_features(self, model_name, model_class, parameters, supports_sparse):
+        prep = self.get_default_prep()
+        prep["feature_calculator"] = DescriptorsCalculator(
+            [FingerprintSet(fingerprint_type="MorganFP", radius=3, nBits=1024, sparse=True)])
+        prep["feature_standardizer"] = None
+        dataset = self.create_large_dataset(task=ModelTasks.CLASSIFICATION, th=[35], preparation_settings=prep)
+        self.assertTrue(scipy.sparse.issparse(next(dataset.createFolds())[0]))
+
+        # sparse features are passed to estimators that support them
+        model = self.get_model(name=f"{model_name}_sparse", alg=model_class, dataset=dataset, parameters=parameters)
+        self.assertEqual(model.supportsSparse, supports_sparse)
+        self.assertEqual(scipy.sparse.issparse(model.toMatrix(dataset.getFeatures(concat=True))), supports_sparse)
+        model.evaluate()
+        model.fit()
+        self.predictor_test(f"{model_name}_sparse", model.baseDir)
+
+    @parameterized.expand([
+        ("KNNR", ModelTasks.REGRESSION, KNeighborsRegressor, None),
+        ("NB", ModelTasks.CLASSIFICATION, GaussianNB, [0, 1, 10, 1100]),
+    ])
+    def test_parallel_evaluate(self, model_name, task, model_class, th):
+        dataset = self.create_large_dataset(task=task, th=th, preparation_settings=self.get_default_prep())
+        model = self.get_model(name=f"{model_name}_parallel", alg=model_class, dataset=dataset)
+        serial = model.evaluate(save=False)
+        serial_ind = model.predictProba(dataset.X_ind) if task == ModelTasks.CLASSIFICATION \
+            else model.predict(dataset.X_ind)
+
+        # folds run in parallel with the same results and the model is fitted on the whole training set
+        parallel = model.evaluate(n_jobs=N_CPUS)
+        self.assertTrue(np.allclose(serial, parallel))
+        parallel_ind = model.predictProba(dataset.X_ind) if task == ModelTasks.CLASSIFICATION \
+            else model.predict(dataset.X_ind)
+        self.assertTrue(np.allclose(serial_ind, parallel_ind))
+        self.assertTrue(exists(f'{model.outDir}/{model.name}.cv.tsv'))
+
+    def test_parallel_bayes(self):
+        dataset = self.create_large_dataset(task=ModelTasks.REGRESSION, preparation_settings=self.get_default_prep())
+        model = self.get_model(name="KNNR_parallel_bayes", alg=KNeighborsRegressor, dataset=dataset)
+        fname = f'{os.path.dirname(__file__)}/test_files/search_space_test.json'
+        grid_params = model.__class__.loadParamsGrid(fname, "bayes", "KNNR")
+        search_space_bs = grid_params[grid_params[:, 0] == "KNNR", 1][0]
+        default_params = model.model.get_params()
+
+        # trials run in parallel processes and are saved in the study database
+        model.bayesOptimization(search_space_bs=search_space_bs, n_trials=4, n_jobs=N_CPUS)
+        storage = f"sqlite:///{os.path.abspath(model.outPrefix)}_optuna.db"
+        study = optuna.load_study(study_name=model.name, storage=storage)
+        self.assertEqual(len(study.trials), 4)
+        self.assertTrue(all(trial.state == optuna.trial.TrialState.COMPLETE for trial in study.trials))
+        self.assertDictEqual(model.parameters, study.best_trial.params)
+        self.assertEqual(model.model.get_params()["n_neighbors"], study.best_trial.params["n_neighbors"])
+        self.assertNotEqual(default_params, model.model.get_params())
+
+        # the study is resumed on request, finished trials are not repeated
+        model.bayesOptimization(search_space_bs=search_space_bs, n_trials=5, n_jobs=N_CPUS, resume=True)
+        study = optuna.load_study(study_name=model.name, storage=storage)
+        self.assertEqual(len(study.trials), 5)
+
+        # otherwise the default study is replaced
+        model.bayesOptimization(search_space_bs=search_space_bs, n_trials=2, n_jobs=N_CPUS)
+        study = optuna.load_study(study_name=model.name, storage=storage)
+        self.assertEqual(len(study.trials), 2)
+
+    def test_halving_grid_search(self):
+        dataset = self.create_large_dataset(task=ModelTasks.REGRESSION, preparation_settings=self.get_default_prep())
+        model = self.get_model(name="RFR_halving", alg=RandomForestRegressor, dataset=dataset)
+        search_space_gs = {'n_estimators': [5, 10, 20], 'max_depth': [2, 5, None]}
+
+        model.gridSearch(search_space_gs, halving=True, factor=3)
+        for param, values in search_space_gs.items():
+            self.assertIn(model.parameters[param], values)
+            self.assertEqual(model.model.get_params()[param], model.parameters[param])
+        self.assertTrue(exists(f"{model.baseDir}/{model.metaInfo['parameters_path']}"))
+
+    def test_pruning(self):
+        dataset = self.create_large_dataset(task=ModelTasks.REGRESSION, preparation_settings=self.get_default_prep())
+        model = self.get_model(name="KNNR_pruning", alg=KNeighborsRegressor, dataset=dataset)
+        search_space_bs = {'n_neighbors': ['int', 1, 10]}
+        n_folds = len(list(dataset.createFolds()))
+
+        # without a pruner the folds are not reported and run in parallel
+        study, _ = model.createStudy()
+        study.optimize(lambda trial: model.objective(trial, None, 0.5, search_space_bs), 1)
+        self.assertEqual(study.trials[0].state, optuna.trial.TrialState.COMPLETE)
+        self.assertDictEqual(study.trials[0].intermediate_values, {})
+
+        # the mean score of the finished folds is reported after each fold
+        study, _ = model.createStudy(pruner=optuna.pruners.MedianPruner(n_startup_trials=10))
+        study.optimize(lambda trial: model.objective(trial, None, 0.5, search_space_bs), 1)
+        self.assertEqual(study.trials[0].state, optuna.trial.TrialState.COMPLETE)
+        self.assertListEqual(sorted(study.trials[0].intermediate_values), list(range(n_folds)))
+
+        # trials are stopped after the first fold if the pruner says so
+        study, _ = model.createStudy(pruner=optuna.pruners.ThresholdPruner(lower=np.inf))
+        study.optimize(lambda trial: model.objective(trial, None, 0.5, search_space_bs), 2)
+        for trial in study.trials:
+            self.assertEqual(trial.state, optuna.trial.TrialState.PRUNED)
+            self.assertListEqual(list(trial.intermediate_values), [0])
@@ -11,6 +11,7 @@ import numpy as np
 import optuna
 import pandas as pd
 import torch
+from qsprpred.data.utils.descriptor_cache import DescriptorCache
 from qsprpred.data.utils.smiles_standardization import (
     chembl_smi_standardizer,
     sanitize_smiles,
@@ -56,6 +57,8 @@ def QSPRArgParser(txt=None):
                              'PLS' (only with REG), 'NB' (only with CLS) 'KNN'")
     parser.add_argument('-np', '--no_preprocessing', action='store_true',
                         help="If included do not standardize and sanitize SMILES.")
+    parser.add_argument('-dc', '--descriptor_cache', type=str, default=None,
+                        help="Path to an SQLite database used to cache calculated descriptors between runs.")
 
     # other
     parser.add_argument('-ng', '--no_git', action='store_true',
@@ -114,6 +117,7 @@ def QSPR_predict(args):
 
     results = {"SMILES": smiles_list}
     mols = [Chem.MolFromSmiles(smiles) for smiles in smiles_list]
+    cache = DescriptorCache(args.descriptor_cache) if args.descriptor_cache else None
 
     for reg in args.regression:
         reg_abbr = 'REGRESSION' if reg else 'CLASSIFICATION'
@@ -131,6 +135,7 @@ def QSPR_predict(args):
                     predictor = QSPRDNN.fromFile(metadata_path)
                 else:
                     predictor = QSPRsklearn.fromFile(metadata_path)
+                predictor.featureCalculator.cache = cache
                 predictions = predictor.predictMols(smiles_list)
                 results.update({f"preds_{model_type}_{reg_abbr}_{property[0]}": predictions})
 